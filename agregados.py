@@ -0,0 +1,194 @@
+import os
+import sys
+import sqlite3
+import logging
+import threading
+from datetime import date, datetime
+import google_sheets
+
+# Totales del reporte (opción 6) por cliente, guardados en SQLite y actualizados con cada
+# fila que el bot escribe en "Historial de movimientos" o "Lotes", para no leer el
+# historial completo en cada reporte. Si se editan las hojas a mano, se reconstruyen con:
+#
+#     python agregados.py reconstruir [url ...]
+#
+# Las pérdidas por vencimiento se guardan por fecha de vencimiento (como ordinal) y el
+# reporte suma las fechas anteriores a hoy.
+AGREGADOS_DB = os.environ.get("AGREGADOS_DB", "agregados.db")
+
+HOJA_HISTORIAL = "Historial de movimientos"
+HOJA_LOTES = "Lotes"
+
+_conexion = None
+_lock = threading.Lock()
+
+def _obtener_conexion():
+    global _conexion
+    if _conexion is None:
+        _conexion = sqlite3.connect(AGREGADOS_DB, check_same_thread=False, isolation_level=None, timeout=30)
+        _conexion.executescript(
+            "CREATE TABLE IF NOT EXISTS resumen ("
+            "tenant TEXT PRIMARY KEY, movimientos INTEGER NOT NULL, ganancias REAL NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS ventas_fecha ("
+            "tenant TEXT NOT NULL, fecha TEXT NOT NULL, unidades INTEGER NOT NULL, PRIMARY KEY (tenant, fecha));"
+            "CREATE TABLE IF NOT EXISTS ventas_producto ("
+            "tenant TEXT NOT NULL, nombre TEXT NOT NULL, codigo TEXT NOT NULL, unidades INTEGER NOT NULL, "
+            "PRIMARY KEY (tenant, nombre));"
+            "CREATE TABLE IF NOT EXISTS perdidas_vencimiento ("
+            "tenant TEXT NOT NULL, vence INTEGER NOT NULL, monto REAL NOT NULL, PRIMARY KEY (tenant, vence));"
+        )
+    return _conexion
+
+def _columnas(fila, ancho):
+    return list(fila) + [""] * (ancho - len(fila))
+
+def _sumar_movimiento(conexion, tenant, fila, signo):
+    fecha, codigo, nombre, tipo, cantidad, _, precio, costo = _columnas(fila, 8)[:8]
+    conexion.execute("UPDATE resumen SET movimientos = movimientos + ? WHERE tenant = ?", (signo, tenant))
+    if tipo.lower() != "salida":
+        return
+    try:
+        cantidad = int(cantidad)
+    except ValueError:
+        return
+    # El rowid conserva el orden de aparición, que decide los empates del reporte
+    conexion.execute(
+        "INSERT OR IGNORE INTO ventas_fecha (tenant, fecha, unidades) VALUES (?, ?, 0)", (tenant, fecha)
+    )
+    conexion.execute(
+        "UPDATE ventas_fecha SET unidades = unidades + ? WHERE tenant = ? AND fecha = ?",
+        (signo * cantidad, tenant, fecha)
+    )
+    conexion.execute(
+        "INSERT OR IGNORE INTO ventas_producto (tenant, nombre, codigo, unidades) VALUES (?, ?, ?, 0)",
+        (tenant, nombre, codigo)
+    )
+    conexion.execute(
+        "UPDATE ventas_producto SET unidades = unidades + ? WHERE tenant = ? AND nombre = ?",
+        (signo * cantidad, tenant, nombre)
+    )
+    try:
+        ganancia = (float(precio) - float(costo)) * cantidad
+    except ValueError:
+        return
+    conexion.execute("UPDATE resumen SET ganancias = ganancias + ? WHERE tenant = ?", (signo * ganancia, tenant))
+
+def _sumar_lote(conexion, tenant, fila, signo):
+    fila = _columnas(fila, 8)
+    try:
+        vence = datetime.strptime(fila[4].strip(), "%Y-%m-%d").date().toordinal()
+        disponible = int(fila[7])
+        costo = float(fila[5])
+    except ValueError:
+        return
+    if disponible <= 0:
+        return
+    conexion.execute(
+        "INSERT INTO perdidas_vencimiento (tenant, vence, monto) VALUES (?, ?, ?) "
+        "ON CONFLICT (tenant, vence) DO UPDATE SET monto = monto + excluded.monto",
+        (tenant, vence, signo * disponible * costo)
+    )
+
+def _construido(conexion, tenant):
+    return conexion.execute("SELECT 1 FROM resumen WHERE tenant = ?", (tenant,)).fetchone() is not None
+
+def _olvidar(conexion, tenant):
+    for tabla in ("resumen", "ventas_fecha", "ventas_producto", "perdidas_vencimiento"):
+        conexion.execute(f"DELETE FROM {tabla} WHERE tenant = ?", (tenant,))
+
+def _aplicar_cambios(sumar, url, cambios):
+    with _lock:
+        conexion = _obtener_conexion()
+        if not _construido(conexion, url):
+            return  # se calculará completo en el primer reporte
+        conexion.execute("BEGIN IMMEDIATE")
+        try:
+            if cambios is None:
+                _olvidar(conexion, url)
+            else:
+                for anterior, nueva in cambios:
+                    if anterior is not None:
+                        sumar(conexion, url, anterior, -1)
+                    if nueva is not None:
+                        sumar(conexion, url, nueva, 1)
+            conexion.execute("COMMIT")
+        except Exception:
+            conexion.execute("ROLLBACK")
+            raise
+
+def reconstruir(url):
+    """
+    Recalcula los totales del cliente leyendo sus hojas de historial y lotes.
+    """
+    with google_sheets.bloqueo_escritura(url):
+        movimientos = google_sheets.abrir_hoja(url, HOJA_HISTORIAL).get_all_values()[1:]
+        lotes = google_sheets.abrir_hoja(url, HOJA_LOTES).get_all_values()[1:]
+        with _lock:
+            conexion = _obtener_conexion()
+            conexion.execute("BEGIN IMMEDIATE")
+            try:
+                _olvidar(conexion, url)
+                conexion.execute("INSERT INTO resumen (tenant, movimientos, ganancias) VALUES (?, 0, 0)", (url,))
+                for fila in movimientos:
+                    _sumar_movimiento(conexion, url, fila, 1)
+                for fila in lotes:
+                    _sumar_lote(conexion, url, fila, 1)
+                conexion.execute("COMMIT")
+            except Exception:
+                conexion.execute("ROLLBACK")
+                raise
+    logging.info(f"📊 Totales reconstruidos: {len(movimientos)} movimientos, {len(lotes)} lotes")
+
+def reporte(url, hoy=None):
+    """
+    Devuelve los datos del reporte de ventas del cliente:
+    {"movimientos", "fechas_mas_ventas": [(fecha, unidades)], "mas_vendidos" y
+    "menos_vendidos": [(nombre, código, unidades)], "ganancias", "perdidas"}.
+    """
+    with _lock:
+        construido = _construido(_obtener_conexion(), url)
+    if not construido:
+        reconstruir(url)
+    hoy = (hoy or date.today()).toordinal()
+    with _lock:
+        conexion = _obtener_conexion()
+        movimientos, ganancias = conexion.execute(
+            "SELECT movimientos, ganancias FROM resumen WHERE tenant = ?", (url,)
+        ).fetchone()
+        fechas_mas_ventas = conexion.execute(
+            "SELECT fecha, unidades FROM ventas_fecha WHERE tenant = ? AND unidades = "
+            "(SELECT MAX(unidades) FROM ventas_fecha WHERE tenant = ?) ORDER BY rowid", (url, url)
+        ).fetchall()
+        mas_vendidos = conexion.execute(
+            "SELECT nombre, codigo, unidades FROM ventas_producto WHERE tenant = ? "
+            "ORDER BY unidades DESC, rowid LIMIT 3", (url,)
+        ).fetchall()
+        menos_vendidos = conexion.execute(
+            "SELECT nombre, codigo, unidades FROM ventas_producto WHERE tenant = ? "
+            "ORDER BY unidades, rowid LIMIT 3", (url,)
+        ).fetchall()
+        perdidas = conexion.execute(
+            "SELECT COALESCE(SUM(monto), 0) FROM perdidas_vencimiento WHERE tenant = ? AND vence < ?", (url, hoy)
+        ).fetchone()[0]
+    return {
+        "movimientos": movimientos,
+        "fechas_mas_ventas": fechas_mas_ventas,
+        "mas_vendidos": mas_vendidos,
+        "menos_vendidos": menos_vendidos,
+        "ganancias": ganancias,
+        "perdidas": perdidas
+    }
+
+google_sheets.observar_hoja(HOJA_HISTORIAL, lambda url, cambios: _aplicar_cambios(_sumar_movimiento, url, cambios))
+google_sheets.observar_hoja(HOJA_LOTES, lambda url, cambios: _aplicar_cambios(_sumar_lote, url, cambios))
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] != "reconstruir":
+        print("Uso: python agregados.py reconstruir [url ...]")
+        sys.exit(1)
+    urls = sys.argv[2:] or sorted({cliente["url"] for _, cliente in google_sheets.listar_clientes() if cliente["url"]})
+    for url in urls:
+        try:
+            reconstruir(url)
+        except Exception as e:
+            logging.error(f"❌ Error al reconstruir totales de {url}: {e}")
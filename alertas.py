@@ -0,0 +1,132 @@
+import os
+import time
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import date
+import google_sheets
+from movimientos import ordinal_de_fecha
+
+# Alertas de la opción 5: lotes vencidos, lotes por vencer y productos con stock bajo.
+# Por cliente se guardan los lotes ordenados por fecha de vencimiento (ordinales en un
+# array), así vencidos y por vencer son dos búsquedas binarias. El resultado se reutiliza
+# hasta que el bot modifica Lotes o Productos, cambia el día o pasan ALERTAS_TTL segundos.
+DIAS_ALERTA_VENCIMIENTO = int(os.environ.get("DIAS_ALERTA_VENCIMIENTO", "21"))
+ALERTAS_TTL = float(os.environ.get("ALERTAS_TTL", "300"))
+
+HOJA_LOTES = "Lotes"
+
+class Alertas:
+    """
+    Lotes con unidades disponibles ordenados por vencimiento y stock total por producto
+    (suma de lo disponible en sus lotes).
+    """
+    def __init__(self, productos, lotes):
+        self.productos = {}  # código → (nombre, marca, stock mínimo)
+        for producto in productos:
+            try:
+                self.productos[producto[0]] = (producto[1], producto[2], int(producto[5]))
+            except (IndexError, ValueError):
+                continue
+        self.stock = dict.fromkeys(self.productos, 0)
+        self.etiquetas = []  # (nombre, marca, ID de lote, fecha de vencimiento)
+        registros = []       # (vencimiento, posición en etiquetas)
+        for lote in lotes:
+            lote = list(lote) + [""] * (8 - len(lote))
+            info = self.productos.get(lote[0])
+            try:
+                disponible = int(lote[7])
+            except ValueError:
+                continue
+            if not info or disponible <= 0:
+                continue
+            self.stock[lote[0]] += disponible
+            vence = ordinal_de_fecha(lote[4].strip())
+            if vence is not None:
+                registros.append((vence, len(self.etiquetas)))
+                self.etiquetas.append((lote[1], info[1], lote[2], lote[4].strip()))
+        registros.sort()
+        self.vencimientos = array("l", (vence for vence, _ in registros))
+        self.orden = array("l", (i for _, i in registros))
+        self.cargado_en = time.monotonic()
+
+    def calcular(self, hoy, dias=DIAS_ALERTA_VENCIMIENTO):
+        """
+        Devuelve {"stock_bajo": [(nombre, marca, stock, mínimo)], "por_vencer" y
+        "vencidos": [(nombre, marca, ID de lote, fecha de vencimiento)]}.
+        """
+        i = bisect_left(self.vencimientos, hoy.toordinal())
+        j = bisect_right(self.vencimientos, hoy.toordinal() + dias)
+        return {
+            "stock_bajo": [
+                (nombre, marca, self.stock[codigo], minimo)
+                for codigo, (nombre, marca, minimo) in self.productos.items()
+                if minimo > 0 and self.stock[codigo] <= minimo
+            ],
+            "por_vencer": [self.etiquetas[k] for k in self.orden[i:j]],
+            "vencidos": [self.etiquetas[k] for k in self.orden[:i]]
+        }
+
+def texto_alertas(datos):
+    """
+    Arma el texto de la opción 5 con el resultado de alertas_de().
+    """
+    stock_minimos = [
+        f"- {nombre} ({marca}) | Stock: {stock} | Mínimo: {minimo}"
+        for nombre, marca, stock, minimo in datos["stock_bajo"]
+    ]
+    proximos_vencer = [
+        f"- {nombre} ({marca}), Lote {lote_id} | Vence: {fecha_venc}"
+        for nombre, marca, lote_id, fecha_venc in datos["por_vencer"]
+    ]
+    vencidos = [
+        f"- {nombre} ({marca}), Lote {lote_id} | Venció: {fecha_venc}"
+        for nombre, marca, lote_id, fecha_venc in datos["vencidos"]
+    ]
+
+    texto = "📋 *Productos con stock mínimo:*\n"
+    texto += "\n".join(stock_minimos) if stock_minimos else "✅ No hay productos con stock bajo."
+
+    texto += f"\n\n⏰ *Productos próximos a vencer (≤{DIAS_ALERTA_VENCIMIENTO} días):*\n"
+    texto += "\n".join(proximos_vencer) if proximos_vencer else "✅ No hay productos próximos a vencer."
+
+    texto += "\n\n❌ *Productos vencidos:*\n"
+    texto += "\n".join(vencidos) if vencidos else "✅ No hay productos vencidos."
+    return texto
+
+_cache = {}     # url → (Alertas, día, resultado)
+_versiones = {}  # url → cambios vistos en Lotes o Productos
+_lock = threading.Lock()
+
+def alertas_de(url, hoy=None):
+    """
+    Devuelve las alertas del cliente (ver Alertas.calcular) para el día `hoy`.
+    """
+    hoy = hoy or date.today()
+    with _lock:
+        item = _cache.get(url)
+        if item and time.monotonic() - item[0].cargado_en <= ALERTAS_TTL:
+            alertas, dia, resultado = item
+            if dia == hoy:
+                return resultado
+        else:
+            alertas = None
+        version = _versiones.get(url, 0)
+    if alertas is None:
+        alertas = Alertas(
+            google_sheets.abrir_hoja(url).get_all_values()[1:],
+            google_sheets.abrir_hoja(url, HOJA_LOTES).get_all_values()[1:]
+        )
+    resultado = alertas.calcular(hoy)
+    with _lock:
+        if _versiones.get(url, 0) == version:
+            _cache[url] = (alertas, hoy, resultado)
+    return resultado
+
+def _al_cambiar(url, cambios):
+    with _lock:
+        _versiones[url] = _versiones.get(url, 0) + 1
+        _cache.pop(url, None)
+
+google_sheets.observar_hoja(HOJA_LOTES, _al_cambiar)
+google_sheets.observar_hoja(None, _al_cambiar)
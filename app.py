@@ -1,33 +1,261 @@
 import os
+import time
+import heapq
 import logging
-from datetime import datetime, date
-from flask import Flask, request
+from datetime import datetime, date, timedelta
+from flask import Flask, request, jsonify, send_from_directory, abort
 from twilio.twiml.messaging_response import MessagingResponse
-from google_sheets import obtener_productos
+from google_sheets import buscar_productos_por_prefijo
 from google_sheets import get_client_sheet_url
 from google_sheets import get_inventory_sheet_for_number
 from google_sheets import registrar_movimiento
 from google_sheets import get_client_name
-from google_sheets import get_historial_sheet_for_number  
 from google_sheets import get_lotes_sheet_for_number
+from google_sheets import generar_codigo_producto
+from google_sheets import generar_id_lote
+from google_sheets import EscrituraAgrupada
+from google_sheets import bloqueo_escritura
+from google_sheets import precalentar
+import cola_mensajes
+import importador
+import agregados
+import alertas
+import movimientos
+import programador
+import reporte_pdf
+from estados import crear_almacen_estados, crear_almacen_respuestas
+import metricas
 
 app = Flask(__name__)
-user_states = {}  # Aquí definimos el diccionario para guardar el estado de los usuarios
+# Máximo de productos que se listan al filtrar por código
+MAX_RESULTADOS_CODIGO = int(os.environ.get("MAX_RESULTADOS_CODIGO", "20"))
+# Listado de la opción 1: productos por página ("mas" pide la siguiente) y tope de
+# caracteres por mensaje (WhatsApp por Twilio no acepta cuerpos de más de 1600)
+PRODUCTOS_POR_PAGINA = int(os.environ.get("PRODUCTOS_POR_PAGINA", "20"))
+LIMITE_MENSAJE = int(os.environ.get("LIMITE_MENSAJE", "1600"))
+# Máximo de líneas por mensaje en "entrada masiva" / "salida masiva"
+MAX_LINEAS_MASIVAS = int(os.environ.get("MAX_LINEAS_MASIVAS", "100"))
+# Con WEBHOOK_ASINCRONO=1 el webhook encola el mensaje y responde por la API REST de Twilio
+WEBHOOK_ASINCRONO = os.environ.get("WEBHOOK_ASINCRONO", "0") == "1"
+user_states = crear_almacen_estados()  # Estado de la conversación de cada usuario (ver estados.py)
+respuestas_enviadas = crear_almacen_respuestas()  # Respuesta ya dada a cada MessageSid
+# Segundos que un POST reintentado espera la respuesta del original si aún se está procesando
+ESPERA_DUPLICADO = float(os.environ.get("ESPERA_DUPLICADO", "10"))
 
 def normalizar_fecha(fecha_str):
     try:
         return datetime.strptime(fecha_str.strip(), "%Y-%m-%d").date()
     except ValueError:
         return None    
+
+def periodo_de_reporte(texto, hoy):
+    """
+    Convierte el texto después de "reporte" en (desde, hasta), o None si no es válido.
+    Acepta dos fechas AAAA-MM-DD, "semana", "mes" o "mes pasado".
+    """
+    texto = " ".join(texto.lower().split())
+    if texto == "semana":
+        return hoy - timedelta(days=hoy.weekday()), hoy
+    if texto == "mes":
+        return hoy.replace(day=1), hoy
+    if texto == "mes pasado":
+        hasta = hoy.replace(day=1) - timedelta(days=1)
+        return hasta.replace(day=1), hasta
+    partes = texto.split()
+    if len(partes) != 2:
+        return None
+    desde, hasta = normalizar_fecha(partes[0]), normalizar_fecha(partes[1])
+    if not desde or not hasta or desde > hasta:
+        return None
+    return desde, hasta
+
+def _largo(texto):
+    # Twilio cuenta caracteres UTF-16: un emoji ocupa dos
+    return len(texto.encode("utf-16-le")) // 2
+
+def pagina_de_productos(filas, desde, por_pagina=PRODUCTOS_POR_PAGINA, limite=LIMITE_MENSAJE):
+    """
+    Arma la página del listado de productos que empieza en filas[desde] (sin encabezado),
+    con hasta `por_pagina` productos y sin pasar de `limite` caracteres.
+    Devuelve (texto, posición de la siguiente página o None si no quedan más).
+    """
+    titulo = "📦 *Productos en inventario:*\n"
+    pie = "\n➡️ Mostrando {}-{} de {}. Escribe *mas* para ver los siguientes o *menu* para volver."
+    partes = [titulo]
+    largo = _largo(titulo) + _largo(pie.format(len(filas), len(filas), len(filas)))
+    i = desde
+    while i < len(filas) and i - desde < por_pagina:
+        row = list(filas[i]) + [""] * (5 - len(filas[i]))
+        linea = (
+            f"{i + 1}. *{row[1]}* ({row[2]}) - {row[0]}\n"
+            f"   📦 Stock: {row[4]} | 💰 S/ {row[3]}\n"
+        )
+        if largo + _largo(linea) > limite:
+            if i > desde:
+                break
+            linea = linea[:max(limite - largo, 0) // 2] + "…\n"  # un solo producto que no cabe
+        partes.append(linea)
+        largo += _largo(linea)
+        i += 1
+    if i >= len(filas):
+        return "".join(partes), None
+    partes.append(pie.format(desde + 1, i, len(filas)))
+    return "".join(partes), i
+
+def cola_de_lotes(lotes, fecha_salida=None):
+    """
+    Arma una cola de prioridad FEFO (heapq) con los lotes [(fila, lote)] que tienen
+    unidades y no vencen antes de `fecha_salida`: primero el que vence antes, los que no
+    tienen vencimiento al final y, a igual vencimiento, el comprado antes.
+    """
+    cola = []
+    for fila, lote in lotes:
+        if not lote[7].isdigit() or int(lote[7]) <= 0:
+            continue
+        vence = normalizar_fecha(lote[4]) or date.max
+        if fecha_salida and vence < fecha_salida:
+            continue
+        compra = normalizar_fecha(lote[3]) or date.min
+        cola.append((vence.toordinal(), compra.toordinal(), fila, lote))
+    heapq.heapify(cola)
+    return cola
+
+PASOS = {}  # nombre del paso → función(phone_number, incoming_msg, estado, msg)
+_hooks_pasos = []
+
+def paso(nombre):
+    def registrar(funcion):
+        PASOS[nombre] = funcion
+        return funcion
+    return registrar
+
+def registrar_hook_paso(hook):
+    """
+    Agrega un hook(nombre_paso, segundos) que se llama al terminar cada paso.
+    """
+    _hooks_pasos.append(hook)
+
+registrar_hook_paso(lambda nombre, segundos: metricas.observar(f"paso.{nombre}", segundos))
+
+def despachar_paso(phone_number, incoming_msg, estado, msg):
+    nombre = estado.get("step")
+    while nombre in PASOS:
+        inicio = time.perf_counter()
+        try:
+            siguiente = PASOS[nombre](phone_number, incoming_msg, estado, msg)
+        finally:
+            duracion = time.perf_counter() - inicio
+            for hook in _hooks_pasos:
+                hook(nombre, duracion)
+        if not siguiente:
+            break
+        estado["step"] = nombre = siguiente
         
 @app.route("/webhook", methods=["POST"])
 def whatsapp_bot():
     incoming_msg = request.values.get("Body", "").strip()
     phone_number = request.values.get("From", "").replace("whatsapp:", "").replace("+", "")
-    
+    message_sid = request.values.get("MessageSid")
+    con_adjunto = int(request.values.get("NumMedia", "0") or 0) > 0
+
+    # Los adjuntos se descargan con las credenciales de Twilio: solo se aceptan POST firmados por Twilio
+    if con_adjunto and not firma_de_twilio_valida():
+        logging.warning(f"⚠️ POST con adjunto sin firma válida de Twilio desde {request.remote_addr}")
+        abort(403)
+
+    # Twilio reintenta el POST si tardamos en responder: el mismo MessageSid no se procesa dos veces
+    if message_sid and not respuestas_enviadas.reservar(message_sid):
+        metricas.incrementar("webhook.duplicados")
+        logging.warning(f"⚠️ Mensaje {message_sid} repetido, se reenvía la respuesta anterior")
+        return respuesta_anterior(message_sid)
+
+    if con_adjunto:
+        twiml = recibir_archivo(
+            phone_number, request.values.get("MediaUrl0", ""), request.values.get("MediaContentType0", "")
+        )
+    elif WEBHOOK_ASINCRONO:
+        # Respondemos vacío de inmediato; la respuesta real se envía por la API REST
+        cola_mensajes.encolar(phone_number, incoming_msg)
+        twiml = str(MessagingResponse())
+    else:
+        try:
+            twiml = procesar_mensaje(phone_number, incoming_msg)
+        except Exception:
+            if message_sid:
+                respuestas_enviadas.liberar(message_sid)
+            raise
+    if message_sid:
+        respuestas_enviadas.guardar(message_sid, twiml)
+    return twiml
+
+def firma_de_twilio_valida():
+    # Twilio firma la URL pública; detrás de un proxy request.url puede llegar como http://
+    firma = request.headers.get("X-Twilio-Signature", "")
+    urls = [request.url]
+    if reporte_pdf.URL_PUBLICA:
+        urls.append(reporte_pdf.URL_PUBLICA + request.full_path.rstrip("?"))
+    return any(importador.firma_valida(url, request.form, firma) for url in urls)
+
+def recibir_archivo(phone_number, media_url, tipo):
+    """
+    Inicia la importación del catálogo adjunto (CSV o Excel) y responde de inmediato;
+    el resumen llega en otro mensaje cuando termina.
+    """
+    resp = MessagingResponse()
+    url = get_client_sheet_url(phone_number)
+    if not url:
+        resp.message("❌ No se encontró la hoja de productos para tu número.")
+    elif not importador.es_adjunto_de_twilio(media_url):
+        resp.message("❌ No se pudo descargar el archivo adjunto.")
+    elif not importador.es_importable(tipo):
+        resp.message(f"❌ Ese tipo de archivo no se puede importar.\n\n{importador.FORMATO_IMPORTACION}")
+    else:
+        importador.importar_adjunto(phone_number, url, media_url, tipo)
+        resp.message("📥 Recibí tu archivo. Te aviso cuando termine de importar los productos.")
+    return str(resp)
+
+def respuesta_anterior(message_sid):
+    """
+    Devuelve la respuesta dada al MessageSid; si el original aún se procesa, la espera
+    hasta ESPERA_DUPLICADO segundos y luego responde vacío.
+    """
+    limite = time.monotonic() + ESPERA_DUPLICADO
+    while True:
+        twiml = respuestas_enviadas.respuesta(message_sid)
+        if twiml is not None:
+            return twiml
+        if time.monotonic() >= limite:
+            return str(MessagingResponse())
+        time.sleep(0.2)
+
+@app.route("/reportes/<archivo>", methods=["GET"])
+def ver_reporte(archivo):
+    # Twilio descarga de aquí el PDF enviado como adjunto (ver reporte_pdf.py)
+    return send_from_directory(os.path.abspath(reporte_pdf.REPORTES_DIR), archivo, mimetype="application/pdf")
+
+@app.route("/metricas", methods=["GET"])
+def ver_metricas():
+    return jsonify(metricas.instantanea())
+
+def procesar_mensaje(phone_number, incoming_msg):
+    """
+    Procesa un mensaje entrante y devuelve la respuesta TwiML como texto.
+    """
+    try:
+        return _procesar_mensaje(phone_number, incoming_msg)
+    finally:
+        # Guarda el estado modificado en sitio durante el mensaje
+        user_states.confirmar(phone_number)
+
+def _procesar_mensaje(phone_number, incoming_msg):
     print(f"📱 Mensaje recibido de {phone_number}: {incoming_msg}")
     resp = MessagingResponse()
     msg = resp.message()
+
+    # El listado de la opción 1 solo sigue con "mas"; cualquier otro mensaje lo cierra
+    estado = user_states.get(phone_number)
+    if estado and estado.get("step") == "listar_productos" and incoming_msg.lower() not in ("mas", "más"):
+        user_states.pop(phone_number, None)
     
     if incoming_msg.lower() in ["hola", "menu", "inicio"]:
         nombre_cliente = get_client_name(phone_number)
@@ -44,710 +272,21 @@ def whatsapp_bot():
         )
         msg.body(menu)
         return str(resp)
+    # Entradas o salidas de varios productos en un solo mensaje, una línea por producto.
+    # Se atiende en cualquier paso: las opciones 3 y 4 lo sugieren mientras piden el código
+    elif incoming_msg.lower().startswith(("entrada masiva", "salida masiva")):
+        tipo = "entrada" if incoming_msg.lower().startswith("entrada") else "salida"
+        user_states.pop(phone_number, None)
+        _, _, lineas = incoming_msg.partition("\n")
+        if lineas.strip():
+            msg.body(registrar_masivo(phone_number, tipo, lineas))
+        else:
+            user_states[phone_number] = {"step": f"{tipo}_masiva"}
+            msg.body(FORMATO_MASIVO[tipo])
+        return str(resp)
     elif phone_number in user_states:
         estado = user_states[phone_number]
-
-        if estado.get("step") == "submenu_gestion":
-            opcion = incoming_msg.strip().lower()
-            if opcion == "a":
-                user_states[phone_number] = {"step": "esperando_codigo"}
-                msg.body("🔍 Escribe el código del producto que deseas buscar:")
-                return str(resp)
-            elif opcion == "b":
-                user_states[phone_number] = {"step": "preguntar_perecible"}
-                msg.body("🧾 ¿El producto es perecible? (sí / no)")
-                return str(resp)
-            elif opcion == "c":
-                user_states[phone_number] = {"step": "esperando_codigo_actualizar"}
-                msg.body("✏️ Ingresa el *código* del producto que deseas actualizar:")
-                return str(resp)
-            elif opcion == "d":
-                user_states[phone_number] = {"step": "esperando_codigo_eliminar"}
-                msg.body("🗑️ Ingresa el *código* del producto que deseas eliminar:")
-                return str(resp)
-            else:
-                msg.body("❌ Opción inválida. Escribe A, B, C o D o escribe 'menu' para regresar.")
-                return str(resp)
-
-        # OPCIÓN B: AGREGAR PRODUCTO
-        elif estado.get("step") == "preguntar_perecible":
-            respuesta = incoming_msg.lower()
-            if respuesta in ["sí", "si"]:
-                estado["perecible"] = True
-                estado["step"] = "elegir_categoria"
-                msg.body(
-                    "📦 Elige la categoría del producto:\n"
-                    "A. Comestibles\nB. Medicamentos\nC. Higiene personal\nD. Limpieza"
-                )
-            elif respuesta == "no":
-                estado["perecible"] = False
-                estado["step"] = "elegir_categoria"
-                msg.body(
-                    "🛠️ Elige la categoría del producto:\n"
-                    "E. Herramientas\nF. Papelería\nG. Electrónicos\nH. Ropa"
-                )
-            else:
-                msg.body("❌ Respuesta no válida. Escribe 'sí' o 'no'.")
-            return str(resp)
-
-        elif estado.get("step") == "elegir_categoria":
-            categorias = {
-                "a": "1", "b": "2", "c": "3", "d": "4",  # Perecibles
-                "e": "5", "f": "6", "g": "7", "h": "8"   # No perecibles
-            }
-            opcion = incoming_msg.lower()
-            if opcion not in categorias:
-                msg.body("❌ Opción inválida. Elige una letra válida (A-H).")
-                return str(resp)
-
-            estado["categoria"] = categorias[opcion]
-            estado["step"] = "esperando_datos"
-            msg.body(
-                "📝 Ingresa los datos del producto en este formato:\n"
-                "```Artículo, Marca, Precio, Stock Mínimo, Ubicación referencial```\n"
-                "📌 Si deseas cancelar, escribe *menu*."
-            )
-            return str(resp)
-
-        elif estado.get("step") == "esperando_datos":
-            partes = [x.strip() for x in incoming_msg.split(",")]
-
-            if len(partes) != 6:
-                msg.body(
-                    "❌ Formato incorrecto. Asegúrate de escribir:\n"
-                    "```Artículo, Marca, Precio, Stock Mínimo, Ubicación referencial```\n"
-                    "📌 Si deseas salir, escribe *menu*."
-                )
-                return str(resp)
-
-            estado["nombre"] = partes[0]
-            estado["marca"] = partes[1]
-            estado["precio"] = partes[2]
-            estado["stock_minimo"] = partes[3]
-            estado["lugar"] = partes[4]
-
-            estado["step"] = "esperando_empaque"
-            msg.body("📦 ¿Cuál es el tipo de empaque? (unidad / caja / bolsa / paquete / saco / botella / lata / tetrapack / sobre / tableta)")
-            return str(resp)
-
-        elif estado.get("step") == "esperando_empaque":
-            empaque = incoming_msg.strip().lower()
-            if not empaque:
-                msg.body("❌ Tipo de empaque no válido. Intenta nuevamente.")
-                return str(resp)
-
-            estado["empaque"] = empaque
-            hoja = get_inventory_sheet_for_number(phone_number)
-            if not hoja:
-                msg.body("❌ No se pudo acceder a tu hoja de inventario.")
-                return str(resp)
-
-            # Generar prefijo del código
-            categoria_num = estado["categoria"]
-            marca_inicial = estado["marca"][0].upper()
-            empaque_inicial = empaque[0].upper()
-            prefijo_codigo = f"{categoria_num}{marca_inicial}{empaque_inicial}"
-
-            # Obtener productos existentes
-            productos = hoja.get_all_values()
-            data = productos[1:] if len(productos) > 1 else []
-
-            # Buscar correlativo existente
-            correlativos = []
-            for fila in data:
-                if fila and fila[0].startswith(prefijo_codigo) and len(fila[0]) >= 4:
-                    sufijo = fila[0][3:]
-                    if sufijo.isdigit():
-                        correlativos.append(int(sufijo))
-
-            nuevo_num = str(max(correlativos, default=0) + 1).zfill(2)
-            codigo = f"{prefijo_codigo}{nuevo_num}"
-
-            # Crear la nueva fila del producto
-            nuevo_producto = [
-                codigo,
-                estado["nombre"],
-                estado["marca"],
-                estado["precio"],
-                "0",
-                estado["stock_minimo"],
-                estado["lugar"]
-            ]
-
-            # Agregar a la hoja
-            hoja.append_row(nuevo_producto)
-
-            msg.body(
-                f"✅ Producto '{estado['nombre']}' agregado con código *{codigo}*.\n"
-                "¿Deseas registrar otro producto? (sí / no)"
-            )
-            estado.clear()
-            estado["step"] = "confirmar_continuar"
-            return str(resp)
-
-        elif estado.get("step") == "confirmar_continuar":
-            if incoming_msg.lower() in ["sí", "si"]:
-                estado.clear()
-                estado["step"] = "preguntar_perecible"
-                msg.body("🧾 ¿El siguiente producto es perecible? (sí / no)")
-            elif incoming_msg.lower() == "no":
-                user_states.pop(phone_number)
-                msg.body("📋 Has salido del registro de productos. Escribe 'menu' para ver las opciones.")
-            else:
-                msg.body("❓ Respuesta no válida. Escribe 'sí' para registrar otro producto o 'no' para salir.")
-            return str(resp)
-
-        # OPCION A: Filtrar por código
-        elif estado.get("step") == "esperando_codigo":
-            filtro_codigo = incoming_msg.upper().strip()
-            hoja_cliente = get_inventory_sheet_for_number(phone_number)
-
-            if not hoja_cliente:
-                msg.body("❌ No se encontró tu hoja de productos.")
-                user_states.pop(phone_number, None)
-            else:
-                productos = obtener_productos(hoja_cliente)
-                coincidencias = [p for p in productos if p["codigo"].upper().startswith(filtro_codigo)]
-
-                if not coincidencias:
-                    msg.body("❌ No se encontraron productos con ese código. ¿Deseas intentar con otro código? (sí / no)")
-                elif len(coincidencias) == 1:
-                    p = coincidencias[0]
-                    respuesta = (
-                        f"🔎 Detalles del producto con código {p['codigo']}:\n"
-                        f"📌 Nombre: {p['nombre']}\n"
-                        f"🏷️ Marca: {p['marca']}\n"
-                        f"📦 Stock total: {p['cantidad']}\n"
-                        f"💵 Precio de venta: S/ {p['precio']}\n"
-                        f"📉 Stock mínimo: {p['stock_minimo']}\n"
-                        f"🛒 Ubicación: {p['lugar']}\n\n"
-                        "¿Deseas consultar otro código? (sí / no)"
-                    )
-                    msg.body(respuesta)
-                else:
-                    respuesta = f"🔍 Se encontraron {len(coincidencias)} productos:\n"
-                    for i, p in enumerate(coincidencias, start=1):
-                        respuesta += f"{i}. {p['nombre']} - {p['marca']}, Stock: {p['cantidad']} (Código: {p['codigo']})\n"
-                    respuesta += "\n¿Deseas consultar otro código? (sí / no)"
-                    msg.body(respuesta)
-
-                user_states[phone_number] = {"step": "preguntar_otro_codigo"}
-
-        elif estado.get("step") == "preguntar_otro_codigo":
-            if incoming_msg.lower() in ["sí", "si", "s"]:
-                user_states[phone_number] = {"step": "esperando_codigo"}
-                msg.body("🔍 Escribe el siguiente código que deseas consultar:")
-            else:
-                user_states.pop(phone_number, None)
-                msg.body("✅ Consulta finalizada. Escribe 'menu' para ver más opciones.")
-        
-        # OPCION C: Actualizar producto
-        elif estado.get("step") == "esperando_codigo_actualizar":
-            codigo = incoming_msg.strip().upper()
-            hoja = get_inventory_sheet_for_number(phone_number)
-            hoja_lotes = get_lotes_sheet_for_number(phone_number)
-
-            productos = hoja.get_all_values()
-            lotes = hoja_lotes.get_all_values()[1:]  # Ignora encabezado
-
-            encontrado = None
-            for i, row in enumerate(productos[1:], start=2):
-                if row[0] == codigo:
-                    encontrado = (i, row)
-                    break
-
-            if encontrado:
-                fila, producto = encontrado
-                lotes_producto = [l for l in lotes if l[0] == codigo]
-
-                estado.update({
-                    "step": "esperando_campo_a_modificar",
-                    "fila": fila,
-                    "producto": producto,
-                    "codigo": codigo,
-                    "lotes": lotes_producto
-                })
-
-                detalles_lotes = ""
-                if lotes_producto:
-                    detalles_lotes = "\n\n📦 *Lotes disponibles:*\n"
-                    for idx, lote in enumerate(lotes_producto, start=1):
-                        detalles_lotes += (
-                            f"{idx}. Lote {lote[2]} - Vence: {lote[4]} - Costo: S/ {lote[5]} - Disponible: {lote[7]}\n"
-                        )
-
-                msg.body(
-                    f"🔍 Producto encontrado: {producto[1]} - {producto[2]}\n"
-                    f"💾 Código: {codigo}\n"
-                    f"¿Qué campo deseas modificar?\n"
-                    f"- Fecha de vencimiento\n- Costo\n- Precio\n- Stock mínimo\n- Ubicación referencial"
-                    f"{detalles_lotes}"
-                )
-            else:
-                msg.body("❌ Producto no encontrado. ¿Deseas ingresar otro código? (sí / no)")
-                estado["step"] = "confirmar_codigo_nuevamente_4"
-            return str(resp)
-
-        elif estado.get("step") == "esperando_campo_a_modificar":
-            campo = incoming_msg.strip().lower()
-            campos_validos = ["fecha de vencimiento", "costo", "precio", "stock mínimo", "ubicación referencial"]
-            if campo not in campos_validos:
-                msg.body("❌ Campo no válido. Elige uno de: Fecha de vencimiento / Costo / Precio / Stock mínimo / Ubicación referencial.")
-                return str(resp)
-
-            estado["campo"] = campo
-
-            if campo in ["fecha de vencimiento", "costo"]:
-                if not estado.get("lotes"):
-                    msg.body("❌ Este producto no tiene lotes registrados. No se puede modificar ese campo.")
-                    user_states.pop(phone_number, None)
-                    return str(resp)
-                estado["step"] = "seleccionar_lote_para_modificar"
-                texto_lotes = "\n\nElige el número del lote que deseas modificar:\n"
-                for idx, lote in enumerate(estado["lotes"], start=1):
-                    texto_lotes += f"{idx}. Lote {lote[2]} - Vence: {lote[4]} - Costo: S/ {lote[5]} - Disponible: {lote[7]}\n"
-                msg.body(texto_lotes)
-            else:
-                estado["step"] = "esperando_nuevo_valor"
-                msg.body(f"✏️ Ingresa el nuevo valor para '{campo}':")
-            return str(resp)
-
-        elif estado.get("step") == "seleccionar_lote_para_modificar":
-            try:
-                index = int(incoming_msg.strip()) - 1
-                lote = estado["lotes"][index]
-                estado["lote_seleccionado"] = lote
-                estado["index_lote"] = index + 2  # +2 por encabezado en hoja
-                estado["step"] = "esperando_nuevo_valor"
-                msg.body(f"✏️ Ingresa el nuevo valor para '{estado['campo']}' del lote {lote[2]}:")
-            except:
-                msg.body("❌ Opción inválida. Ingresa el número del lote a modificar.")
-            return str(resp)
-
-        elif estado.get("step") == "esperando_nuevo_valor":
-            nuevo_valor = incoming_msg.strip()
-            campo = estado["campo"]
-
-            try:
-                if campo in ["fecha de vencimiento", "costo"]:
-                    hoja_lotes = get_lotes_sheet_for_number(phone_number)
-                    col = 5 if campo == "fecha de vencimiento" else 6
-                    hoja_lotes.update_cell(estado["index_lote"], col, nuevo_valor)
-                    msg.body(f"✅ {campo.title()} del lote actualizado correctamente.")
-
-                else:
-                    hoja = get_inventory_sheet_for_number(phone_number)
-                    campos_columna = {
-                        "precio": 4,
-                        "stock mínimo": 5,
-                        "ubicación referencial": 6
-                    }
-                    hoja.update_cell(estado["fila"], campos_columna[campo] + 1, nuevo_valor)
-                    msg.body(f"✅ Campo '{campo}' actualizado correctamente.")
-
-                estado["step"] = "confirmar_otro_campo"
-                msg.body("¿Deseas actualizar otro campo de este producto? (sí / no)")
-            except Exception as e:
-                logging.error(f"❌ Error al actualizar: {e}")
-                msg.body("❌ Ocurrió un error al actualizar. Intenta nuevamente.")
-            return str(resp)
-
-        elif estado.get("step") == "confirmar_otro_campo":
-            if incoming_msg.lower() in ["sí", "si"]:
-                estado["step"] = "esperando_campo_a_modificar"
-                msg.body("🔁 ¿Qué otro campo deseas modificar? (Fecha de vencimiento / Costo / Precio / Stock mínimo / Ubicación referencial)")
-            else:
-                user_states.pop(phone_number, None)
-                msg.body("✅ Actualización finalizada. Escribe 'menu' para más opciones.")
-            return str(resp)
-
-        # OPCION D: Eliminar producto
-        elif phone_number in user_states and user_states[phone_number].get("step") == "esperando_codigo_eliminar":
-            hoja = get_inventory_sheet_for_number(phone_number)
-            productos = hoja.get_all_values()
-            codigo = incoming_msg.strip().upper()
-
-            encontrado = None
-            for i, row in enumerate(productos[1:], start=2):
-                if row[0] == codigo:
-                    encontrado = (i, row)
-                    break
-
-            if not encontrado:
-                msg.body("❌ Producto no encontrado. ¿Deseas ingresar otro código? (sí / no)")
-                user_states[phone_number] = {"step": "confirmar_codigo_nuevamente_5"}
-                return str(resp)
-
-            fila, producto = encontrado
-            user_states[phone_number] = {
-                "step": "confirmar_eliminacion",
-                "fila": fila,
-                "producto": producto,
-                "codigo": codigo
-            }
-            msg.body(
-                f"⚠️ Producto encontrado: *{producto[1]}* - {producto[2]}\n"
-                "¿Estás seguro de que deseas eliminarlo completamente? Esto también eliminará los lotes relacionados. (sí / no)"
-            )
-            return str(resp)
-
-        elif estado.get("step") == "confirmar_codigo_nuevamente_5":
-            if incoming_msg.lower() in ["si", "sí"]:
-                user_states[phone_number] = {"step": "esperando_codigo_eliminar"}
-                msg.body("🗑️ Ingresa el código del producto que deseas eliminar:")
-            else:
-                user_states.pop(phone_number, None)
-                msg.body("✅ Cancelado. Envía 'menu' para ver las opciones.")
-            return str(resp)
-
-        elif estado.get("step") == "confirmar_eliminacion":
-            if incoming_msg.lower() in ["si", "sí"]:
-                codigo = estado["codigo"]
-                hoja_lotes = get_lotes_sheet_for_number(phone_number)
-                filas_a_borrar = []
-
-                if hoja_lotes:
-                    lotes = hoja_lotes.get_all_values()
-                    for i, fila in enumerate(lotes[1:], start=2):
-                        if fila[0] == codigo:
-                            disponible = int(fila[7]) if fila[7].isdigit() else 0
-                            if disponible > 0:
-                                estado["step"] = "doble_confirmacion_lotes"
-                                estado["filas_lotes"] = filas_a_borrar
-                                msg.body("⚠️ Este producto tiene lotes con *stock disponible*. ¿Seguro que deseas eliminarlos junto con el producto? (sí / no)")
-                                return str(resp)
-                            filas_a_borrar.append(i)
-
-                estado["step"] = "eliminar_todo"
-                return whatsapp_bot()  # fuerza el paso al siguiente estado
-            else:
-                user_states.pop(phone_number, None)
-                msg.body("✅ Eliminación cancelada. Envía 'menu' para ver opciones.")
-            return str(resp)
-
-        elif estado.get("step") == "doble_confirmacion_lotes":
-            if incoming_msg.lower() in ["sí", "si"]:
-                estado["step"] = "eliminar_todo"
-                return whatsapp_bot()  # continúa con eliminación
-            else:
-                user_states.pop(phone_number, None)
-                msg.body("✅ Eliminación cancelada. Escribe 'menu' para volver.")
-            return str(resp)
-
-        elif estado.get("step") == "eliminar_todo":
-            try:
-                hoja = get_inventory_sheet_for_number(phone_number)
-                hoja_lotes = get_lotes_sheet_for_number(phone_number)
-                fila = estado["fila"]
-                codigo = estado["codigo"]
-
-                hoja.delete_rows(fila)
-
-                eliminados = 0
-                if hoja_lotes:
-                    lotes = hoja_lotes.get_all_values()
-                    filas_a_borrar = [i for i, fila in enumerate(lotes[1:], start=2) if fila[0] == codigo]
-                    for i in reversed(filas_a_borrar):
-                        hoja_lotes.delete_rows(i)
-                        eliminados += 1
-
-                msg.body(f"✅ Producto eliminado. Se eliminaron {eliminados} lote(s) asociados.")
-            except Exception as e:
-                logging.error(f"❌ Error al eliminar: {e}")
-                msg.body("❌ Ocurrió un error al eliminar el producto o sus lotes.")
-            user_states.pop(phone_number, None)
-            return str(resp)
-
-        # Paso 6: Registrar entrada
-        elif estado.get("step") == "entrada_codigo":
-            hoja = get_inventory_sheet_for_number(phone_number)
-            if not hoja:
-                msg.body("⚠️ No se pudo acceder a tu hoja de productos. Es posible que se haya superado el límite de uso. Intenta nuevamente más tarde.")
-                return str(resp)
-            productos = hoja.get_all_values()
-            codigo = incoming_msg.strip().upper()
-
-            for i, row in enumerate(productos[1:], start=2):
-                if row[0] == codigo:
-                    estado.update({
-                        "step": "entrada_fecha_compra",
-                        "fila": i,
-                        "producto": row,
-                        "codigo": codigo
-                    })
-                    msg.body(
-                        f"🔍 Producto encontrado: {row[1]} - {row[2]}\n"
-                        f"📦 Stock actual: {row[5]}\n"
-                        "📅 Ingresa la *fecha de compra* (AAAA-MM-DD):\nEscribe *menu* para cancelar."
-                    )
-                    return str(resp)
-
-            msg.body("❌ Código no encontrado. ¿Deseas ingresar otro código? (sí / no)")
-            user_states[phone_number] = {"step": "entrada_codigo_reintentar"}
-            return str(resp)
-
-        elif estado.get("step") == "entrada_codigo_reintentar":
-            if incoming_msg.lower() in ["si", "sí"]:
-                user_states[phone_number] = {"step": "entrada_codigo"}
-                msg.body("📥 Ingresa el código del producto:")
-            else:
-                user_states.pop(phone_number, None)
-                msg.body("✅ Cancelado. Envía 'menu' para ver las opciones.")
-            return str(resp)
-
-        elif estado.get("step") == "entrada_fecha_compra":
-            if incoming_msg.lower() == "menu":
-                user_states.pop(phone_number, None)
-                msg.body("✅ Registro cancelado. Escribe 'menu' para ver las opciones.")
-                return str(resp)
-
-            fecha_compra = incoming_msg.strip()
-            fecha_compra_obj = normalizar_fecha(fecha_compra)
-
-            if not fecha_compra_obj:
-                msg.body("❌ Formato de fecha inválido. ¿Deseas intentarlo de nuevo? (sí / no)")
-                estado["step"] = "confirmar_fecha_compra_invalida"
-                return str(resp)
-
-            hoy = date.today()
-            if fecha_compra_obj > hoy:
-                msg.body("❌ La fecha de compra no puede ser futura. Ingresa una fecha válida o escribe *menu* para salir:")
-                return str(resp)
-
-            estado["fecha_compra"] = fecha_compra
-
-            # Detectar si es perecible a partir de la hoja (si el producto ya no tiene fecha anterior)
-            perecible = True
-            hoja_lotes = get_lotes_sheet_for_number(phone_number)
-            lotes_existentes = hoja_lotes.get_all_values()
-            for row in lotes_existentes:
-                if row[0] == estado["codigo"] and not row[4].strip():
-                    perecible = False
-                    break
-
-            if perecible:
-                estado["perecible"] = True
-                estado["step"] = "entrada_fecha_vencimiento"
-                msg.body("📅 Ingresa la *fecha de vencimiento* (AAAA-MM-DD):")
-            else:
-                estado["fecha_vencimiento"] = ""
-                estado["step"] = "entrada_costo"
-                msg.body("💰 Ingresa el *costo unitario* del lote:")
-            return str(resp)
-
-        elif estado.get("step") == "confirmar_fecha_compra_invalida":
-            if incoming_msg.lower() in ["sí", "si"]:
-                estado["step"] = "entrada_fecha_compra"
-                msg.body("📅 Ingresa la *fecha de compra* (AAAA-MM-DD):")
-            else:
-                user_states.pop(phone_number, None)
-                msg.body("✅ Registro cancelado. Escribe 'menu' para ver opciones.")
-            return str(resp)
-
-        elif estado.get("step") == "entrada_fecha_vencimiento":
-            fecha_vencimiento = incoming_msg.strip()
-            fecha_vencimiento_obj = normalizar_fecha(fecha_vencimiento)
-
-            if not fecha_vencimiento_obj:
-                msg.body("❌ Fecha de vencimiento inválida. Intenta nuevamente:")
-                return str(resp)
-
-            estado["fecha_vencimiento"] = fecha_vencimiento
-            estado["step"] = "entrada_costo"
-            msg.body("💰 Ingresa el *costo unitario* del lote:")
-            return str(resp)
-
-        elif estado.get("step") == "entrada_costo":
-            costo = incoming_msg.strip()
-            try:
-                float(costo)
-                estado["costo"] = costo
-                estado["step"] = "entrada_cantidad"
-                msg.body("🔢 Ingresa la *cantidad* de productos del nuevo lote:")
-            except:
-                msg.body("❌ Costo no válido. Ingresa un número válido.")
-            return str(resp)
-
-        elif estado.get("step") == "entrada_cantidad":
-            cantidad = incoming_msg.strip()
-            if not cantidad.isdigit():
-                msg.body("❌ Ingresa una cantidad válida.")
-                return str(resp)
-
-            hoja = get_inventory_sheet_for_number(phone_number)
-            fila = estado["fila"]
-            producto = estado["producto"]
-            codigo = estado["codigo"]
-            nueva_cantidad = int(producto[5]) + int(cantidad)
-
-            # Actualizar stock total en hoja de productos
-            hoja.update_cell(fila, 6, str(nueva_cantidad))
-
-            # Registrar lote
-            hoja_lotes = get_lotes_sheet_for_number(phone_number)
-            lotes = hoja_lotes.get_all_values()
-            lotes_existentes = [row for row in lotes if row[0] == codigo]
-            nuevo_lote_id = str(len(lotes_existentes) + 1)
-
-            nuevo_lote = [
-                codigo,
-                producto[1],
-                nuevo_lote_id,
-                estado["fecha_compra"],
-                estado.get("fecha_vencimiento", ""),
-                estado["costo"],
-                cantidad,
-                cantidad
-            ]
-            hoja_lotes.append_row(nuevo_lote)
-
-            # Registrar en historial con precio de venta desde producto[3]
-            registrar_movimiento(
-                phone_number,
-                "Entrada",
-                codigo,
-                producto[1],
-                cantidad,
-                nueva_cantidad,
-                estado["fecha_compra"],
-                precio=producto[3],
-                costo=estado["costo"]
-            )
-
-            msg.body(
-                f"✅ Entrada registrada. Nuevo stock: {nueva_cantidad}\n"
-                "📦 ¿Deseas registrar otra entrada? (sí / no)"
-            )
-            estado.clear()
-            estado["step"] = "confirmar_otra_entrada"
-            return str(resp)
-
-        elif estado.get("step") == "confirmar_otra_entrada":
-            if incoming_msg.lower() in ["sí", "si"]:
-                estado.clear()
-                estado["step"] = "entrada_codigo"
-                msg.body("📥 Ingresa el código del producto al que deseas registrar entrada:")
-            else:
-                user_states.pop(phone_number, None)
-                msg.body("✅ Registro finalizado. Escribe *menu* para ver las opciones.")
-            return str(resp)
-
-        # Paso 7: Registrar salida
-        elif estado.get("step") == "salida_codigo":
-            hoja = get_inventory_sheet_for_number(phone_number)
-            productos = hoja.get_all_values()
-            codigo = incoming_msg.strip().upper()
-
-            for i, row in enumerate(productos[1:], start=2):
-                if row[0] == codigo:
-                    estado.update({
-                        "step": "salida_fecha",
-                        "fila": i,
-                        "producto": row,
-                        "codigo": codigo
-                    })
-                    hoja_lotes = get_lotes_sheet_for_number(phone_number)
-                    lotes = [l for l in hoja_lotes.get_all_values()[1:] if l[0] == codigo and int(l[7]) > 0]
-                    lotes_ordenados = sorted(lotes, key=lambda l: normalizar_fecha(l[3]))
-
-                    if not lotes_ordenados:
-                        msg.body("⚠️ No hay lotes disponibles para este producto.")
-                        user_states.pop(phone_number, None)
-                        return str(resp)
-
-                    primer_lote = lotes_ordenados[0]
-                    estado["lote"] = primer_lote
-
-                    msg.body(
-                        f"🔍 Producto encontrado: {row[1]} - {row[2]}\n"
-                        f"📦 Stock total: {row[5]} | 💰 Precio actual: S/ {row[3]}\n"
-                        f"📦 Se usará el lote más antiguo (ID {primer_lote[2]}) con {primer_lote[7]} unidades disponibles.\n"
-                        "📅 Ingresa la *fecha de salida* (AAAA-MM-DD):"
-                    )
-                    return str(resp)
-
-            msg.body("❌ Código no encontrado. ¿Deseas ingresar otro código? (sí / no)")
-            user_states[phone_number] = {"step": "salida_codigo_reintentar"}
-            return str(resp)
-
-        elif estado.get("step") == "salida_codigo_reintentar":
-            if incoming_msg.lower() in ["sí", "si"]:
-                estado["step"] = "salida_codigo"
-                msg.body("📤 Ingresa el código del producto:")
-            else:
-                user_states.pop(phone_number, None)
-                msg.body("✅ Cancelado. Envía 'menu' para ver las opciones.")
-            return str(resp)
-
-        elif estado.get("step") == "salida_fecha":
-            fecha_salida = incoming_msg.strip()
-            fecha_obj = normalizar_fecha(fecha_salida)
-            hoy = date.today()
-
-            if not fecha_obj:
-                msg.body("❌ Formato de fecha inválido. Usa el formato AAAA-MM-DD.")
-                return str(resp)
-            if fecha_obj > hoy:
-                msg.body("❌ La fecha de salida no puede ser futura. Ingresa una fecha válida.")
-                return str(resp)
-
-            lote = estado["lote"]
-            vencimiento_lote = normalizar_fecha(lote[4])
-            if vencimiento_lote and vencimiento_lote < fecha_obj:
-                msg.body(f"⚠️ El lote seleccionado (ID {lote[2]}) venció el {lote[4]}. No se permite registrar salidas de productos vencidos.")
-                user_states.pop(phone_number, None)
-                return str(resp)
-
-            estado["fecha_salida"] = fecha_salida
-            estado["step"] = "salida_cantidad"
-            msg.body("🔢 Ingresa la cantidad que deseas retirar:")
-            return str(resp)
-
-        elif estado.get("step") == "salida_cantidad":
-            cantidad_salida = incoming_msg.strip()
-            if not cantidad_salida.isdigit():
-                msg.body("❌ Ingresa una cantidad válida.")
-                return str(resp)
-
-            cantidad_retirar = int(cantidad_salida)
-            lote = estado["lote"]
-            disponible_lote = int(lote[7])
-
-            if cantidad_retirar > disponible_lote:
-                msg.body(f"❌ No puedes retirar más de lo disponible en el lote. Disponible: {disponible_lote}")
-                return str(resp)
-
-            hoja_productos = get_inventory_sheet_for_number(phone_number)
-            hoja_lotes = get_lotes_sheet_for_number(phone_number)
-
-            fila_producto = estado["fila"]
-            producto = estado["producto"]
-            nuevo_stock = int(producto[5]) - cantidad_retirar
-            hoja_productos.update_cell(fila_producto, 6, str(nuevo_stock))
-
-            # Actualizar lote
-            filas_lotes = hoja_lotes.get_all_values()
-            for idx, row in enumerate(filas_lotes):
-                if row[0] == estado["codigo"] and row[2] == lote[2]:
-                    fila_lote = idx + 1
-                    hoja_lotes.update_cell(fila_lote, 8, str(disponible_lote - cantidad_retirar))
-                    break
-
-            registrar_movimiento(
-                phone_number,
-                "Salida",
-                estado["codigo"],
-                producto[1],
-                cantidad_retirar,
-                nuevo_stock,
-                estado["fecha_salida"],
-                precio=producto[3],
-                costo=lote[5]
-            )
-
-            msg.body(f"✅ Salida registrada. Nuevo stock total: {nuevo_stock}\n📋 Escribe *menu* para regresar al menú.")
-            user_states.pop(phone_number, None)
-            return str(resp)
+        despachar_paso(phone_number, incoming_msg, estado, msg)
         return str(resp)
 
     # Opción 1: Ver productos
@@ -760,18 +299,10 @@ def whatsapp_bot():
             if not productos or len(productos) <= 1:
                 msg.body("📭 No hay productos registrados.")
             else:
-                respuesta = "📦 *Productos en inventario:*\n"
-                for i, row in enumerate(productos[1:], start=1):  # Saltamos encabezado
-                    codigo = row[0]
-                    nombre = row[1]
-                    marca = row[2]
-                    precio = row[3]
-                    stock = row[4]
-                    respuesta += (
-                        f"{i}. *{nombre}* ({marca}) - {codigo}\n"
-                        f"   📦 Stock: {stock} | 💰 S/ {precio}\n"
-                    )
-                msg.body(respuesta)
+                texto, siguiente = pagina_de_productos(productos[1:], 0)  # Saltamos encabezado
+                if siguiente is not None:
+                    user_states[phone_number] = {"step": "listar_productos", "desde": siguiente}
+                msg.body(texto)
         return str(resp)
 
     # Opción 2: Gestionar productos
@@ -782,113 +313,74 @@ def whatsapp_bot():
             "A. Filtrar por código\n"
             "B. Agregar producto\n"
             "C. Actualizar producto\n"
-            "D. Eliminar producto\n\n"
-            "Escribe A, B, C o D para continuar. O escribe 'menu' para volver."
+            "D. Eliminar producto\n"
+            "E. Importar productos desde un archivo\n\n"
+            "Escribe A, B, C, D o E para continuar. O escribe 'menu' para volver."
         )
         return str(resp)    
 
     # Opción 3: Registrar entrada
     elif incoming_msg == "3":
         user_states[phone_number] = {"step": "entrada_codigo"}
-        msg.body("📥 Ingresa el código del producto al que deseas registrar entrada:")
+        msg.body(
+            "📥 Ingresa el código del producto al que deseas registrar entrada:\n"
+            "📋 Para varios productos a la vez escribe *entrada masiva*."
+        )
         return str(resp)   
     # Opción 4: Registrar salida
     elif incoming_msg == "4":
         user_states[phone_number] = {"step": "salida_codigo"}
-        msg.body("📤 Ingresa el código del producto del que deseas registrar una salida:")
+        msg.body(
+            "📤 Ingresa el código del producto del que deseas registrar una salida:\n"
+            "📋 Para varios productos a la vez escribe *salida masiva*."
+        )
         return str(resp)
     # Opción 6: Reporte
     elif incoming_msg == "6":
         try:
-            hoja = get_historial_sheet_for_number(phone_number)
-            if not hoja:
+            url = get_client_sheet_url(phone_number)
+            if not url:
                 msg.body("❌ No se encontró la hoja de historial de movimientos.")
                 return str(resp)
 
-            datos = hoja.get_all_values()[1:]
-            if not datos:
+            # Totales mantenidos en agregados.py; no se recorre el historial
+            datos = agregados.reporte(url)
+            if not datos["movimientos"]:
                 msg.body("⚠️ No hay registros en el historial para generar un reporte.")
                 return str(resp)
-
-            fechas = {}
-            productos = {}  # nombre: [cantidad_total, código, marca]
-            ganancias = 0.0
-
-            hoja_productos = get_inventory_sheet_for_number(phone_number)
-            datos_productos = hoja_productos.get_all_values()[1:]
-
-            for row in datos:
-                fecha, codigo, nombre, tipo, cantidad, stock_final, precio_venta, costo = row
-                cantidad = int(cantidad)
-                if tipo.lower() == "salida":
-                    fechas[fecha] = fechas.get(fecha, 0) + cantidad
-
-                    if nombre not in productos:
-                        marca = ""
-                        for p in datos_productos:
-                            if p[0] == codigo:
-                                marca = p[2]
-                                break
-                        productos[nombre] = [cantidad, codigo, marca]
-                    else:
-                        productos[nombre][0] += cantidad
-
-                    try:
-                        ganancias += (float(precio_venta) - float(costo)) * cantidad
-                    except:
-                        continue
-
-            if not productos:
+            if not datos["mas_vendidos"]:
                 msg.body("⚠️ No hay suficientes salidas para generar un reporte.")
                 return str(resp)
 
-            # Fechas con más ventas
-            max_ventas = max(fechas.values())
-            fechas_mas_ventas = [(f, v) for f, v in fechas.items() if v == max_ventas]
-
-            # Top 3 más vendidos
-            top_mas_vendidos = sorted(productos.items(), key=lambda x: x[1][0], reverse=True)[:3]
-
-            # Top 3 menos vendidos
-            top_menos_vendidos = sorted(productos.items(), key=lambda x: x[1][0])[:3]
-
-            # Cálculo de pérdidas por productos vencidos
-            perdidas = 0.0
-            hoja_lotes = get_lotes_sheet_for_number(phone_number)
-            hoy = date.today()
-            lotes = hoja_lotes.get_all_values()[1:]
-            for row in lotes:
-                try:
-                    fecha_venc = normalizar_fecha(row[4])
-                    disponible = int(row[7])
-                    costo_lote = float(row[5])
-                    if fecha_venc and fecha_venc < hoy and disponible > 0:
-                        perdidas += disponible * costo_lote
-                except:
-                    continue
+            hoja_productos = get_inventory_sheet_for_number(phone_number)
+            marcas = {}
+            for _, codigo, _ in datos["mas_vendidos"] + datos["menos_vendidos"]:
+                if codigo not in marcas:
+                    encontrado = hoja_productos.buscar(codigo)
+                    marcas[codigo] = encontrado[1][2] if encontrado else ""
 
             reporte = "📈 *REPORTE DE VENTAS*\n"
             reporte += "-------------------------------------------\n"
             reporte += "📅 *Fecha(s) con más ventas:* \n"
-            for fecha, total in fechas_mas_ventas:
+            for fecha, total in datos["fechas_mas_ventas"]:
                 reporte += f"{fecha} ({total})\n"
 
             reporte += "-------------------------------------------\n"
             reporte += "🥇 *Top 3 más vendidos:* \n"
-            for nombre, datos in top_mas_vendidos:
-                cantidad, codigo, marca = datos
-                reporte += f"{nombre} ({codigo}, {marca}, {cantidad}u)\n"
+            for nombre, codigo, cantidad in datos["mas_vendidos"]:
+                reporte += f"{nombre} ({codigo}, {marcas[codigo]}, {cantidad}u)\n"
 
             reporte += "-------------------------------------------\n"
             reporte += "🥉 *Top 3 menos vendidos:* \n"
-            for nombre, datos in top_menos_vendidos:
-                cantidad, codigo, marca = datos
-                reporte += f"{nombre} ({codigo}, {marca}, {cantidad}u)\n"
+            for nombre, codigo, cantidad in datos["menos_vendidos"]:
+                reporte += f"{nombre} ({codigo}, {marcas[codigo]}, {cantidad}u)\n"
 
             reporte += "-------------------------------------------\n"
-            reporte += f"💰 *Ganancias acumuladas:* S/ {ganancias:.2f}\n"
-            reporte += f"⚠️ *Pérdidas por productos vencidos:* S/ {perdidas:.2f}\n"
+            reporte += f"💰 *Ganancias acumuladas:* S/ {datos['ganancias']:.2f}\n"
+            reporte += f"⚠️ *Pérdidas por productos vencidos:* S/ {datos['perdidas']:.2f}\n"
             reporte += "-------------------------------------------\n"
+            reporte += "📆 Para un periodo escribe *reporte semana*, *reporte mes* o *reporte AAAA-MM-DD AAAA-MM-DD*.\n"
+            reporte += "📄 Para el reporte completo en PDF escribe *pdf* (o *pdf semana*, *pdf mes pasado*...).\n"
             reporte += "📲 Escribe *menu* para regresar al menú."
 
             msg.body(reporte)
@@ -901,71 +393,1062 @@ def whatsapp_bot():
 
     # Opción 5: Revisar stock mínimo / vencimiento
     elif incoming_msg == "5":
-        hoja_productos = get_inventory_sheet_for_number(phone_number)
-        hoja_lotes = get_lotes_sheet_for_number(phone_number)
-
-        if not hoja_productos or not hoja_lotes:
+        url = get_client_sheet_url(phone_number)
+        if not url:
             msg.body("❌ No se encontró alguna de tus hojas de inventario.")
             return str(resp)
+        try:
+            datos = alertas.alertas_de(url)
+        except Exception as e:
+            logging.error(f"❌ Error al revisar alertas: {e}")
+            msg.body("❌ No se encontró alguna de tus hojas de inventario.")
+            return str(resp)
+
+        respuesta = alertas.texto_alertas(datos)
+        respuesta += "\n\n📲 Escribe *menu* para regresar al menú principal."
+        msg.body(respuesta)
+        return str(resp)
+
+    # Reporte en PDF: "pdf" (mes actual) o "pdf" con un periodo como en "reporte ..."
+    elif incoming_msg.lower().split()[:1] == ["pdf"]:
+        texto_periodo = incoming_msg[len("pdf"):].strip() or "mes"
+        periodo = periodo_de_reporte(texto_periodo, date.today())
+        if not periodo:
+            msg.body(
+                "❌ Periodo no válido. Escribe por ejemplo:\n"
+                "*pdf*\n*pdf semana*\n*pdf mes pasado*\n*pdf 2026-09-01 2026-09-30*"
+            )
+            return str(resp)
+        url = get_client_sheet_url(phone_number)
+        if not url:
+            msg.body("❌ No se encontró la hoja de historial de movimientos.")
+            return str(resp)
+        if not reporte_pdf.URL_PUBLICA:
+            logging.error("❌ Falta URL_PUBLICA para enviar reportes PDF")
+            msg.body("❌ Los reportes en PDF no están disponibles por ahora.")
+            return str(resp)
+        desde, hasta = periodo
+        media_url = reporte_pdf.pdf_en_cache(url, desde, hasta)
+        if media_url:
+            msg.body(f"📄 Tu reporte del {desde} al {hasta}.")
+            msg.media(media_url)
+        else:
+            reporte_pdf.solicitar(phone_number, url, desde, hasta)
+            msg.body("⏳ Estoy preparando tu reporte en PDF; te lo envío en un momento.")
+        return str(resp)
+
+    # Reporte por periodo: "reporte AAAA-MM-DD AAAA-MM-DD", "reporte semana", "reporte mes"...
+    elif incoming_msg.lower().startswith("reporte"):
+        periodo = periodo_de_reporte(incoming_msg[len("reporte"):], date.today())
+        if not periodo:
+            msg.body(
+                "❌ Periodo no válido. Escribe por ejemplo:\n"
+                "*reporte 2026-09-01 2026-09-30*\n*reporte semana*\n*reporte mes*\n*reporte mes pasado*"
+            )
+            return str(resp)
+        url = get_client_sheet_url(phone_number)
+        if not url:
+            msg.body("❌ No se encontró la hoja de historial de movimientos.")
+            return str(resp)
+        desde, hasta = periodo
+        try:
+            datos = movimientos.reporte_periodo(url, desde, hasta)
+        except Exception as e:
+            logging.error(f"❌ Error al generar reporte por periodo: {e}")
+            msg.body("❌ Ocurrió un error al generar el reporte.")
+            return str(resp)
 
-        productos = hoja_productos.get_all_values()[1:]
-        lotes = hoja_lotes.get_all_values()[1:]
+        reporte = f"📈 *REPORTE DEL {desde} AL {hasta}*\n"
+        reporte += "-------------------------------------------\n"
+        if not datos["movimientos"]:
+            reporte += "⚠️ No hay movimientos en este periodo.\n"
+        else:
+            reporte += f"📤 Unidades vendidas: {datos['unidades_vendidas']} ({datos['salidas']} salidas)\n"
+            reporte += f"📥 Unidades ingresadas: {datos['unidades_ingresadas']}\n"
+            reporte += f"💵 Ventas: S/ {datos['ventas']:.2f}\n"
+            reporte += f"💰 Ganancias: S/ {datos['ganancias']:.2f}\n"
+            if datos["mejor_dia"]:
+                dia, total = datos["mejor_dia"]
+                reporte += f"📅 Día con más ventas: {dia} ({total})\n"
+            if datos["mas_vendidos"]:
+                reporte += "-------------------------------------------\n"
+                reporte += "🥇 *Top 3 más vendidos:* \n"
+                for nombre, codigo, cantidad in datos["mas_vendidos"]:
+                    reporte += f"{nombre} ({codigo}, {cantidad}u)\n"
+        reporte += "-------------------------------------------\n"
+        reporte += "📲 Escribe *menu* para regresar al menú."
+        msg.body(reporte)
+        return str(resp)
+    return str(resp)
 
-        hoy = datetime.today().date()
-        stock_minimos = []
-        proximos_vencer = []
-        vencidos = []
+# Pasos de conversación: cada paso es una función registrada en PASOS con @paso(nombre).
+# Una función puede devolver el nombre de otro paso para continuar con él en el mismo
+# mensaje (sin volver a entrar a procesar_mensaje).
+
+# OPCIÓN 1: páginas siguientes del listado, desde las filas en caché de la hoja
+@paso("listar_productos")
+def paso_listar_productos(phone_number, incoming_msg, estado, msg):
+    hoja_cliente = get_inventory_sheet_for_number(phone_number)
+    productos = hoja_cliente.get_all_values()[1:] if hoja_cliente else []
+    if estado["desde"] >= len(productos):
+        user_states.pop(phone_number, None)
+        msg.body("📭 No hay más productos. Escribe *menu* para volver.")
+        return
+    texto, siguiente = pagina_de_productos(productos, estado["desde"])
+    if siguiente is None:
+        user_states.pop(phone_number, None)
+    else:
+        estado["desde"] = siguiente
+    msg.body(texto)
+
+@paso("submenu_gestion")
+def paso_submenu_gestion(phone_number, incoming_msg, estado, msg):
+    opcion = incoming_msg.strip().lower()
+    if opcion == "a":
+        user_states[phone_number] = {"step": "esperando_codigo"}
+        msg.body("🔍 Escribe el código del producto que deseas buscar:")
+        return
+    elif opcion == "b":
+        user_states[phone_number] = {"step": "preguntar_perecible"}
+        msg.body("🧾 ¿El producto es perecible? (sí / no)")
+        return
+    elif opcion == "c":
+        user_states[phone_number] = {"step": "esperando_codigo_actualizar"}
+        msg.body("✏️ Ingresa el *código* del producto que deseas actualizar:")
+        return
+    elif opcion == "d":
+        user_states[phone_number] = {"step": "esperando_codigo_eliminar"}
+        msg.body("🗑️ Ingresa el *código* del producto que deseas eliminar:")
+        return
+    elif opcion == "e":
+        user_states.pop(phone_number, None)
+        msg.body(importador.FORMATO_IMPORTACION)
+        return
+    else:
+        msg.body("❌ Opción inválida. Escribe A, B, C, D o E o escribe 'menu' para regresar.")
+        return
+
+# OPCIÓN B: AGREGAR PRODUCTO
+@paso("preguntar_perecible")
+def paso_preguntar_perecible(phone_number, incoming_msg, estado, msg):
+    respuesta = incoming_msg.lower()
+    if respuesta in ["sí", "si"]:
+        estado["perecible"] = True
+        estado["step"] = "elegir_categoria"
+        msg.body(
+            "📦 Elige la categoría del producto:\n"
+            "A. Comestibles\nB. Medicamentos\nC. Higiene personal\nD. Limpieza"
+        )
+    elif respuesta == "no":
+        estado["perecible"] = False
+        estado["step"] = "elegir_categoria"
+        msg.body(
+            "🛠️ Elige la categoría del producto:\n"
+            "E. Herramientas\nF. Papelería\nG. Electrónicos\nH. Ropa"
+        )
+    else:
+        msg.body("❌ Respuesta no válida. Escribe 'sí' o 'no'.")
+
+@paso("elegir_categoria")
+def paso_elegir_categoria(phone_number, incoming_msg, estado, msg):
+    categorias = {
+        "a": "1", "b": "2", "c": "3", "d": "4",  # Perecibles
+        "e": "5", "f": "6", "g": "7", "h": "8"   # No perecibles
+    }
+    opcion = incoming_msg.lower()
+    if opcion not in categorias:
+        msg.body("❌ Opción inválida. Elige una letra válida (A-H).")
+        return
+
+    estado["categoria"] = categorias[opcion]
+    estado["step"] = "esperando_datos"
+    msg.body(
+        "📝 Ingresa los datos del producto en este formato:\n"
+        "```Artículo, Marca, Precio, Stock Mínimo, Ubicación referencial```\n"
+        "📌 Si deseas cancelar, escribe *menu*."
+    )
+
+@paso("esperando_datos")
+def paso_esperando_datos(phone_number, incoming_msg, estado, msg):
+    partes = [x.strip() for x in incoming_msg.split(",")]
+
+    if len(partes) != 6:
+        msg.body(
+            "❌ Formato incorrecto. Asegúrate de escribir:\n"
+            "```Artículo, Marca, Precio, Stock Mínimo, Ubicación referencial```\n"
+            "📌 Si deseas salir, escribe *menu*."
+        )
+        return
+
+    estado["nombre"] = partes[0]
+    estado["marca"] = partes[1]
+    estado["precio"] = partes[2]
+    estado["stock_minimo"] = partes[3]
+    estado["lugar"] = partes[4]
+
+    estado["step"] = "esperando_empaque"
+    msg.body("📦 ¿Cuál es el tipo de empaque? (unidad / caja / bolsa / paquete / saco / botella / lata / tetrapack / sobre / tableta)")
+
+@paso("esperando_empaque")
+def paso_esperando_empaque(phone_number, incoming_msg, estado, msg):
+    empaque = incoming_msg.strip().lower()
+    if not empaque:
+        msg.body("❌ Tipo de empaque no válido. Intenta nuevamente.")
+        return
+
+    estado["empaque"] = empaque
+    hoja = get_inventory_sheet_for_number(phone_number)
+    if not hoja:
+        msg.body("❌ No se pudo acceder a tu hoja de inventario.")
+        return
+
+    # Generar prefijo del código
+    categoria_num = estado["categoria"]
+    marca_inicial = estado["marca"][0].upper()
+    empaque_inicial = empaque[0].upper()
+    prefijo_codigo = f"{categoria_num}{marca_inicial}{empaque_inicial}"
+
+    with bloqueo_escritura(hoja.url):
+        # Reservar el siguiente correlativo del prefijo
+        codigo = generar_codigo_producto(hoja, prefijo_codigo)
+
+        # Crear la nueva fila del producto
+        nuevo_producto = [
+            codigo,
+            estado["nombre"],
+            estado["marca"],
+            estado["precio"],
+            "0",
+            estado["stock_minimo"],
+            estado["lugar"]
+        ]
+
+        # Agregar a la hoja
+        hoja.append_row(nuevo_producto)
+
+    msg.body(
+        f"✅ Producto '{estado['nombre']}' agregado con código *{codigo}*.\n"
+        "¿Deseas registrar otro producto? (sí / no)"
+    )
+    estado.clear()
+    estado["step"] = "confirmar_continuar"
+
+@paso("confirmar_continuar")
+def paso_confirmar_continuar(phone_number, incoming_msg, estado, msg):
+    if incoming_msg.lower() in ["sí", "si"]:
+        estado.clear()
+        estado["step"] = "preguntar_perecible"
+        msg.body("🧾 ¿El siguiente producto es perecible? (sí / no)")
+    elif incoming_msg.lower() == "no":
+        user_states.pop(phone_number)
+        msg.body("📋 Has salido del registro de productos. Escribe 'menu' para ver las opciones.")
+    else:
+        msg.body("❓ Respuesta no válida. Escribe 'sí' para registrar otro producto o 'no' para salir.")
+
+# OPCION A: Filtrar por código
+@paso("esperando_codigo")
+def paso_esperando_codigo(phone_number, incoming_msg, estado, msg):
+    filtro_codigo = incoming_msg.upper().strip()
+    hoja_cliente = get_inventory_sheet_for_number(phone_number)
+
+    if not hoja_cliente:
+        msg.body("❌ No se encontró tu hoja de productos.")
+        user_states.pop(phone_number, None)
+    else:
+        total, coincidencias = buscar_productos_por_prefijo(hoja_cliente, filtro_codigo, MAX_RESULTADOS_CODIGO)
+
+        if coincidencias is None:
+            msg.body("❌ No se pudo leer tu hoja de productos. Intenta nuevamente más tarde.")
+            user_states.pop(phone_number, None)
+            return
+        elif not coincidencias:
+            msg.body("❌ No se encontraron productos con ese código. ¿Deseas intentar con otro código? (sí / no)")
+        elif total == 1:
+            p = coincidencias[0]
+            respuesta = (
+                f"🔎 Detalles del producto con código {p['codigo']}:\n"
+                f"📌 Nombre: {p['nombre']}\n"
+                f"🏷️ Marca: {p['marca']}\n"
+                f"📦 Stock total: {p['cantidad']}\n"
+                f"💵 Precio de venta: S/ {p['precio']}\n"
+                f"📉 Stock mínimo: {p['stock_minimo']}\n"
+                f"🛒 Ubicación: {p['lugar']}\n\n"
+                "¿Deseas consultar otro código? (sí / no)"
+            )
+            msg.body(respuesta)
+        else:
+            respuesta = f"🔍 Se encontraron {total} productos:\n"
+            for i, p in enumerate(coincidencias, start=1):
+                respuesta += f"{i}. {p['nombre']} - {p['marca']}, Stock: {p['cantidad']} (Código: {p['codigo']})\n"
+            if total > len(coincidencias):
+                respuesta += f"… y {total - len(coincidencias)} más. Escribe un código más específico para acotar.\n"
+            respuesta += "\n¿Deseas consultar otro código? (sí / no)"
+            msg.body(respuesta)
+
+        user_states[phone_number] = {"step": "preguntar_otro_codigo"}
+
+@paso("preguntar_otro_codigo")
+def paso_preguntar_otro_codigo(phone_number, incoming_msg, estado, msg):
+    if incoming_msg.lower() in ["sí", "si", "s"]:
+        user_states[phone_number] = {"step": "esperando_codigo"}
+        msg.body("🔍 Escribe el siguiente código que deseas consultar:")
+    else:
+        user_states.pop(phone_number, None)
+        msg.body("✅ Consulta finalizada. Escribe 'menu' para ver más opciones.")
+
+# OPCION C: Actualizar producto
+@paso("esperando_codigo_actualizar")
+def paso_esperando_codigo_actualizar(phone_number, incoming_msg, estado, msg):
+    codigo = incoming_msg.strip().upper()
+    hoja = get_inventory_sheet_for_number(phone_number)
+    hoja_lotes = get_lotes_sheet_for_number(phone_number)
+
+    encontrado = hoja.buscar(codigo)
+
+    if encontrado:
+        fila, producto = encontrado
+        lotes_producto = [l for _, l in hoja_lotes.filas_de(codigo)]
+
+        estado.update({
+            "step": "esperando_campo_a_modificar",
+            "fila": fila,
+            "producto": producto,
+            "codigo": codigo,
+            "lotes": lotes_producto
+        })
+
+        detalles_lotes = ""
+        if lotes_producto:
+            detalles_lotes = "\n\n📦 *Lotes disponibles:*\n"
+            for idx, lote in enumerate(lotes_producto, start=1):
+                detalles_lotes += (
+                    f"{idx}. Lote {lote[2]} - Vence: {lote[4]} - Costo: S/ {lote[5]} - Disponible: {lote[7]}\n"
+                )
 
-        # Mapeo código → info (para encontrar stock mínimo y marca)
-        productos_dict = {p[0]: {"nombre": p[1], "marca": p[2], "stock_minimo": int(p[5])} for p in productos if len(p) >= 6}
+        msg.body(
+            f"🔍 Producto encontrado: {producto[1]} - {producto[2]}\n"
+            f"💾 Código: {codigo}\n"
+            f"¿Qué campo deseas modificar?\n"
+            f"- Fecha de vencimiento\n- Costo\n- Precio\n- Stock mínimo\n- Ubicación referencial"
+            f"{detalles_lotes}"
+        )
+    else:
+        msg.body("❌ Producto no encontrado. ¿Deseas ingresar otro código? (sí / no)")
+        estado["step"] = "confirmar_codigo_nuevamente_4"
+
+@paso("esperando_campo_a_modificar")
+def paso_esperando_campo_a_modificar(phone_number, incoming_msg, estado, msg):
+    campo = incoming_msg.strip().lower()
+    campos_validos = ["fecha de vencimiento", "costo", "precio", "stock mínimo", "ubicación referencial"]
+    if campo not in campos_validos:
+        msg.body("❌ Campo no válido. Elige uno de: Fecha de vencimiento / Costo / Precio / Stock mínimo / Ubicación referencial.")
+        return
+
+    estado["campo"] = campo
+
+    if campo in ["fecha de vencimiento", "costo"]:
+        if not estado.get("lotes"):
+            msg.body("❌ Este producto no tiene lotes registrados. No se puede modificar ese campo.")
+            user_states.pop(phone_number, None)
+            return
+        estado["step"] = "seleccionar_lote_para_modificar"
+        texto_lotes = "\n\nElige el número del lote que deseas modificar:\n"
+        for idx, lote in enumerate(estado["lotes"], start=1):
+            texto_lotes += f"{idx}. Lote {lote[2]} - Vence: {lote[4]} - Costo: S/ {lote[5]} - Disponible: {lote[7]}\n"
+        msg.body(texto_lotes)
+    else:
+        estado["step"] = "esperando_nuevo_valor"
+        msg.body(f"✏️ Ingresa el nuevo valor para '{campo}':")
+
+@paso("seleccionar_lote_para_modificar")
+def paso_seleccionar_lote_para_modificar(phone_number, incoming_msg, estado, msg):
+    try:
+        index = int(incoming_msg.strip()) - 1
+        lote = estado["lotes"][index]
+        estado["lote_seleccionado"] = lote
+        estado["step"] = "esperando_nuevo_valor"
+        msg.body(f"✏️ Ingresa el nuevo valor para '{estado['campo']}' del lote {lote[2]}:")
+    except:
+        msg.body("❌ Opción inválida. Ingresa el número del lote a modificar.")
+
+@paso("esperando_nuevo_valor")
+def paso_esperando_nuevo_valor(phone_number, incoming_msg, estado, msg):
+    nuevo_valor = incoming_msg.strip()
+    campo = estado["campo"]
 
-        for lote in lotes:
-            try:
-                codigo = lote[0]
-                nombre = lote[1]
-                lote_id = lote[2]
-                fecha_venc = lote[4]
-                disponible = int(lote[7])
-                producto_info = productos_dict.get(codigo)
+    try:
+        if campo in ["fecha de vencimiento", "costo"]:
+            hoja_lotes = get_lotes_sheet_for_number(phone_number)
+            col = 5 if campo == "fecha de vencimiento" else 6
+            with bloqueo_escritura(hoja_lotes.url):
+                encontrado = hoja_lotes.releer(estado["codigo"], estado["lote_seleccionado"][2])
+                if encontrado:
+                    hoja_lotes.update_cell(encontrado[0], col, nuevo_valor)
+            if not encontrado:
+                msg.body("❌ El lote ya no existe en tu hoja. Escribe *menu* para ver las opciones.")
+                user_states.pop(phone_number, None)
+                return
+            msg.body(f"✅ {campo.title()} del lote actualizado correctamente.")
 
-                if not producto_info:
-                    continue
+        else:
+            hoja = get_inventory_sheet_for_number(phone_number)
+            campos_columna = {
+                "precio": 4,
+                "stock mínimo": 5,
+                "ubicación referencial": 6
+            }
+            with bloqueo_escritura(hoja.url):
+                encontrado = hoja.releer(estado["codigo"])
+                if encontrado:
+                    hoja.update_cell(encontrado[0], campos_columna[campo] + 1, nuevo_valor)
+            if not encontrado:
+                msg.body("❌ El producto ya no existe en tu hoja. Escribe *menu* para ver las opciones.")
+                user_states.pop(phone_number, None)
+                return
+            msg.body(f"✅ Campo '{campo}' actualizado correctamente.")
+
+        estado["step"] = "confirmar_otro_campo"
+        msg.body("¿Deseas actualizar otro campo de este producto? (sí / no)")
+    except Exception as e:
+        logging.error(f"❌ Error al actualizar: {e}")
+        msg.body("❌ Ocurrió un error al actualizar. Intenta nuevamente.")
+
+@paso("confirmar_otro_campo")
+def paso_confirmar_otro_campo(phone_number, incoming_msg, estado, msg):
+    if incoming_msg.lower() in ["sí", "si"]:
+        estado["step"] = "esperando_campo_a_modificar"
+        msg.body("🔁 ¿Qué otro campo deseas modificar? (Fecha de vencimiento / Costo / Precio / Stock mínimo / Ubicación referencial)")
+    else:
+        user_states.pop(phone_number, None)
+        msg.body("✅ Actualización finalizada. Escribe 'menu' para más opciones.")
+
+# OPCION D: Eliminar producto
+@paso("esperando_codigo_eliminar")
+def paso_esperando_codigo_eliminar(phone_number, incoming_msg, estado, msg):
+    hoja = get_inventory_sheet_for_number(phone_number)
+    codigo = incoming_msg.strip().upper()
+
+    encontrado = hoja.buscar(codigo)
+
+    if not encontrado:
+        msg.body("❌ Producto no encontrado. ¿Deseas ingresar otro código? (sí / no)")
+        user_states[phone_number] = {"step": "confirmar_codigo_nuevamente_5"}
+        return
+
+    fila, producto = encontrado
+    user_states[phone_number] = {
+        "step": "confirmar_eliminacion",
+        "fila": fila,
+        "producto": producto,
+        "codigo": codigo
+    }
+    msg.body(
+        f"⚠️ Producto encontrado: *{producto[1]}* - {producto[2]}\n"
+        "¿Estás seguro de que deseas eliminarlo completamente? Esto también eliminará los lotes relacionados. (sí / no)"
+    )
+
+@paso("confirmar_codigo_nuevamente_5")
+def paso_confirmar_codigo_nuevamente_5(phone_number, incoming_msg, estado, msg):
+    if incoming_msg.lower() in ["si", "sí"]:
+        user_states[phone_number] = {"step": "esperando_codigo_eliminar"}
+        msg.body("🗑️ Ingresa el código del producto que deseas eliminar:")
+    else:
+        user_states.pop(phone_number, None)
+        msg.body("✅ Cancelado. Envía 'menu' para ver las opciones.")
+
+@paso("confirmar_eliminacion")
+def paso_confirmar_eliminacion(phone_number, incoming_msg, estado, msg):
+    if incoming_msg.lower() in ["si", "sí"]:
+        codigo = estado["codigo"]
+        hoja_lotes = get_lotes_sheet_for_number(phone_number)
+        filas_a_borrar = []
+
+        if hoja_lotes:
+            for i, fila in hoja_lotes.filas_de(codigo):
+                disponible = int(fila[7]) if fila[7].isdigit() else 0
+                if disponible > 0:
+                    estado["step"] = "doble_confirmacion_lotes"
+                    estado["filas_lotes"] = filas_a_borrar
+                    msg.body("⚠️ Este producto tiene lotes con *stock disponible*. ¿Seguro que deseas eliminarlos junto con el producto? (sí / no)")
+                    return
+                filas_a_borrar.append(i)
+
+        return "eliminar_todo"  # continúa en el paso siguiente
+    else:
+        user_states.pop(phone_number, None)
+        msg.body("✅ Eliminación cancelada. Envía 'menu' para ver opciones.")
+
+@paso("doble_confirmacion_lotes")
+def paso_doble_confirmacion_lotes(phone_number, incoming_msg, estado, msg):
+    if incoming_msg.lower() in ["sí", "si"]:
+        return "eliminar_todo"  # continúa con eliminación
+    else:
+        user_states.pop(phone_number, None)
+        msg.body("✅ Eliminación cancelada. Escribe 'menu' para volver.")
+
+@paso("eliminar_todo")
+def paso_eliminar_todo(phone_number, incoming_msg, estado, msg):
+    try:
+        hoja = get_inventory_sheet_for_number(phone_number)
+        hoja_lotes = get_lotes_sheet_for_number(phone_number)
+        codigo = estado["codigo"]
 
-                stock_minimo = producto_info["stock_minimo"]
-                marca = producto_info["marca"]
+        # Las filas se ubican dentro del bloqueo, releídas de la hoja (la del producto y
+        # Lotes entera, una llamada cada una), para no borrar otras si alguien insertó o
+        # borró filas mientras se confirmaba
+        with bloqueo_escritura(hoja.url):
+            encontrado = hoja.releer(codigo)
+            if not encontrado:
+                msg.body("❌ El producto ya no existe en tu hoja. Escribe *menu* para ver las opciones.")
+                user_states.pop(phone_number, None)
+                return
+            lotes = []
+            if hoja_lotes:
+                hoja_lotes.recargar()
+                lotes = [fila for fila, _ in hoja_lotes.filas_de(codigo)]
+
+            # Producto y lotes se borran en un solo batch_update
+            with EscrituraAgrupada(hoja.url) as escritura:
+                escritura.delete_rows(hoja, encontrado[0])
+                for fila_lote in lotes:
+                    escritura.delete_rows(hoja_lotes, fila_lote)
+
+        msg.body(f"✅ Producto eliminado. Se eliminaron {len(lotes)} lote(s) asociados.")
+    except Exception as e:
+        logging.error(f"❌ Error al eliminar: {e}")
+        msg.body("❌ Ocurrió un error al eliminar el producto o sus lotes.")
+    user_states.pop(phone_number, None)
+
+# Paso 6: Registrar entrada
+@paso("entrada_codigo")
+def paso_entrada_codigo(phone_number, incoming_msg, estado, msg):
+    hoja = get_inventory_sheet_for_number(phone_number)
+    if not hoja:
+        msg.body("⚠️ No se pudo acceder a tu hoja de productos. Es posible que se haya superado el límite de uso. Intenta nuevamente más tarde.")
+        return
+    codigo = incoming_msg.strip().upper()
+
+    encontrado = hoja.buscar(codigo)
+    if encontrado:
+        i, row = encontrado
+        estado.update({
+            "step": "entrada_fecha_compra",
+            "fila": i,
+            "producto": row,
+            "codigo": codigo
+        })
+        msg.body(
+            f"🔍 Producto encontrado: {row[1]} - {row[2]}\n"
+            f"📦 Stock actual: {row[5]}\n"
+            "📅 Ingresa la *fecha de compra* (AAAA-MM-DD):\nEscribe *menu* para cancelar."
+        )
+        return
 
-                # Stock mínimo
-                if disponible <= stock_minimo:
-                    stock_minimos.append(
-                        f"- {nombre} ({marca}), Lote {lote_id} | Stock: {disponible} | Mínimo: {stock_minimo}"
-                    )
+    msg.body("❌ Código no encontrado. ¿Deseas ingresar otro código? (sí / no)")
+    user_states[phone_number] = {"step": "entrada_codigo_reintentar"}
 
-                # Revisar vencimiento si aplica
-                if fecha_venc:
-                    fecha_obj = datetime.strptime(fecha_venc, "%Y-%m-%d").date()
-                    dias_restantes = (fecha_obj - hoy).days
+@paso("entrada_codigo_reintentar")
+def paso_entrada_codigo_reintentar(phone_number, incoming_msg, estado, msg):
+    if incoming_msg.lower() in ["si", "sí"]:
+        user_states[phone_number] = {"step": "entrada_codigo"}
+        msg.body("📥 Ingresa el código del producto:")
+    else:
+        user_states.pop(phone_number, None)
+        msg.body("✅ Cancelado. Envía 'menu' para ver las opciones.")
+
+@paso("entrada_fecha_compra")
+def paso_entrada_fecha_compra(phone_number, incoming_msg, estado, msg):
+    if incoming_msg.lower() == "menu":
+        user_states.pop(phone_number, None)
+        msg.body("✅ Registro cancelado. Escribe 'menu' para ver las opciones.")
+        return
+
+    fecha_compra = incoming_msg.strip()
+    fecha_compra_obj = normalizar_fecha(fecha_compra)
+
+    if not fecha_compra_obj:
+        msg.body("❌ Formato de fecha inválido. ¿Deseas intentarlo de nuevo? (sí / no)")
+        estado["step"] = "confirmar_fecha_compra_invalida"
+        return
+
+    hoy = date.today()
+    if fecha_compra_obj > hoy:
+        msg.body("❌ La fecha de compra no puede ser futura. Ingresa una fecha válida o escribe *menu* para salir:")
+        return
+
+    estado["fecha_compra"] = fecha_compra
+
+    # Detectar si es perecible a partir de la hoja (si el producto ya no tiene fecha anterior)
+    perecible = True
+    hoja_lotes = get_lotes_sheet_for_number(phone_number)
+    for _, row in hoja_lotes.filas_de(estado["codigo"]):
+        if not row[4].strip():
+            perecible = False
+            break
+
+    if perecible:
+        estado["perecible"] = True
+        estado["step"] = "entrada_fecha_vencimiento"
+        msg.body("📅 Ingresa la *fecha de vencimiento* (AAAA-MM-DD):")
+    else:
+        estado["fecha_vencimiento"] = ""
+        estado["step"] = "entrada_costo"
+        msg.body("💰 Ingresa el *costo unitario* del lote:")
+
+@paso("confirmar_fecha_compra_invalida")
+def paso_confirmar_fecha_compra_invalida(phone_number, incoming_msg, estado, msg):
+    if incoming_msg.lower() in ["sí", "si"]:
+        estado["step"] = "entrada_fecha_compra"
+        msg.body("📅 Ingresa la *fecha de compra* (AAAA-MM-DD):")
+    else:
+        user_states.pop(phone_number, None)
+        msg.body("✅ Registro cancelado. Escribe 'menu' para ver opciones.")
+
+@paso("entrada_fecha_vencimiento")
+def paso_entrada_fecha_vencimiento(phone_number, incoming_msg, estado, msg):
+    fecha_vencimiento = incoming_msg.strip()
+    fecha_vencimiento_obj = normalizar_fecha(fecha_vencimiento)
+
+    if not fecha_vencimiento_obj:
+        msg.body("❌ Fecha de vencimiento inválida. Intenta nuevamente:")
+        return
+
+    estado["fecha_vencimiento"] = fecha_vencimiento
+    estado["step"] = "entrada_costo"
+    msg.body("💰 Ingresa el *costo unitario* del lote:")
+
+@paso("entrada_costo")
+def paso_entrada_costo(phone_number, incoming_msg, estado, msg):
+    costo = incoming_msg.strip()
+    try:
+        float(costo)
+        estado["costo"] = costo
+        estado["step"] = "entrada_cantidad"
+        msg.body("🔢 Ingresa la *cantidad* de productos del nuevo lote:")
+    except:
+        msg.body("❌ Costo no válido. Ingresa un número válido.")
+
+@paso("entrada_cantidad")
+def paso_entrada_cantidad(phone_number, incoming_msg, estado, msg):
+    cantidad = incoming_msg.strip()
+    if not cantidad.isdigit():
+        msg.body("❌ Ingresa una cantidad válida.")
+        return
+
+    hoja = get_inventory_sheet_for_number(phone_number)
+    producto = estado["producto"]
+    codigo = estado["codigo"]
+    with bloqueo_escritura(hoja.url):
+        # La fila se relee de la hoja: el producto pudo moverse de fila o cambiar su
+        # stock desde que se eligió, y la entrada se suma sobre el valor actual
+        encontrado = hoja.releer(codigo)
+        if not encontrado:
+            msg.body("❌ El producto ya no existe en tu hoja. Escribe *menu* para ver las opciones.")
+            user_states.pop(phone_number, None)
+            return
+        fila, actual = encontrado
+        stock_actual = actual[5]
+        if stock_actual != producto[5]:
+            metricas.incrementar("escritura.reintentos")
+        nueva_cantidad = int(stock_actual) + int(cantidad)
 
-                    if fecha_obj < hoy:
-                        vencidos.append(f"- {nombre} ({marca}), Lote {lote_id} | Venció: {fecha_venc}")
-                    elif dias_restantes <= 21:
-                        proximos_vencer.append(f"- {nombre} ({marca}), Lote {lote_id} | Vence: {fecha_venc}")
+        # Stock, lote e historial se envían juntos en un solo batch_update
+        escritura = EscrituraAgrupada(hoja.url)
 
-            except Exception:
-                continue
+        # Actualizar stock total en hoja de productos
+        escritura.update_cell(hoja, fila, 6, str(nueva_cantidad))
 
-        respuesta = "📋 *Productos con stock mínimo:*\n"
-        respuesta += "\n".join(stock_minimos) if stock_minimos else "✅ No hay productos con stock bajo."
+        # Registrar lote
+        hoja_lotes = get_lotes_sheet_for_number(phone_number)
+        nuevo_lote_id = generar_id_lote(hoja_lotes, codigo)
+
+        nuevo_lote = [
+            codigo,
+            producto[1],
+            nuevo_lote_id,
+            estado["fecha_compra"],
+            estado.get("fecha_vencimiento", ""),
+            estado["costo"],
+            cantidad,
+            cantidad
+        ]
+        escritura.append_row(hoja_lotes, nuevo_lote)
+
+        # Registrar en historial con precio de venta desde producto[3]
+        registrar_movimiento(
+            phone_number,
+            "Entrada",
+            codigo,
+            producto[1],
+            cantidad,
+            nueva_cantidad,
+            estado["fecha_compra"],
+            precio=producto[3],
+            costo=estado["costo"],
+            escritura=escritura
+        )
 
-        respuesta += "\n\n⏰ *Productos próximos a vencer (≤21 días):*\n"
-        respuesta += "\n".join(proximos_vencer) if proximos_vencer else "✅ No hay productos próximos a vencer."
+        try:
+            escritura.confirmar()
+        except Exception as e:
+            logging.error(f"❌ Error al registrar entrada: {e}")
+            msg.body("❌ Ocurrió un error al registrar la entrada. Intenta nuevamente.")
+            return
+
+    msg.body(
+        f"✅ Entrada registrada. Nuevo stock: {nueva_cantidad}\n"
+        "📦 ¿Deseas registrar otra entrada? (sí / no)"
+    )
+    estado.clear()
+    estado["step"] = "confirmar_otra_entrada"
+
+@paso("confirmar_otra_entrada")
+def paso_confirmar_otra_entrada(phone_number, incoming_msg, estado, msg):
+    if incoming_msg.lower() in ["sí", "si"]:
+        estado.clear()
+        estado["step"] = "entrada_codigo"
+        msg.body("📥 Ingresa el código del producto al que deseas registrar entrada:")
+    else:
+        user_states.pop(phone_number, None)
+        msg.body("✅ Registro finalizado. Escribe *menu* para ver las opciones.")
+
+# Paso 7: Registrar salida
+@paso("salida_codigo")
+def paso_salida_codigo(phone_number, incoming_msg, estado, msg):
+    hoja = get_inventory_sheet_for_number(phone_number)
+    codigo = incoming_msg.strip().upper()
+
+    encontrado = hoja.buscar(codigo)
+    if encontrado:
+        i, row = encontrado
+        estado.update({
+            "step": "salida_fecha",
+            "fila": i,
+            "producto": row,
+            "codigo": codigo
+        })
+        hoja_lotes = get_lotes_sheet_for_number(phone_number)
+        lotes = cola_de_lotes(hoja_lotes.filas_de(codigo))
 
-        respuesta += "\n\n❌ *Productos vencidos:*\n"
-        respuesta += "\n".join(vencidos) if vencidos else "✅ No hay productos vencidos."
+        if not lotes:
+            msg.body("⚠️ No hay lotes disponibles para este producto.")
+            user_states.pop(phone_number, None)
+            return
 
-        respuesta += "\n\n📲 Escribe *menu* para regresar al menú principal."
-        msg.body(respuesta)
-        return str(resp)
-    return str(resp)
+        disponible = sum(int(lote[7]) for *_, lote in lotes)
+        primer_lote = lotes[0][-1]
+        msg.body(
+            f"🔍 Producto encontrado: {row[1]} - {row[2]}\n"
+            f"📦 Stock total: {row[5]} | 💰 Precio actual: S/ {row[3]}\n"
+            f"📦 Hay {disponible} unidades en {len(lotes)} lote(s). Se retirará primero del que vence antes "
+            f"(ID {primer_lote[2]}).\n"
+            "📅 Ingresa la *fecha de salida* (AAAA-MM-DD):"
+        )
+        return
+
+    msg.body("❌ Código no encontrado. ¿Deseas ingresar otro código? (sí / no)")
+    user_states[phone_number] = {"step": "salida_codigo_reintentar"}
+
+@paso("salida_codigo_reintentar")
+def paso_salida_codigo_reintentar(phone_number, incoming_msg, estado, msg):
+    if incoming_msg.lower() in ["sí", "si"]:
+        estado["step"] = "salida_codigo"
+        msg.body("📤 Ingresa el código del producto:")
+    else:
+        user_states.pop(phone_number, None)
+        msg.body("✅ Cancelado. Envía 'menu' para ver las opciones.")
+
+@paso("salida_fecha")
+def paso_salida_fecha(phone_number, incoming_msg, estado, msg):
+    fecha_salida = incoming_msg.strip()
+    fecha_obj = normalizar_fecha(fecha_salida)
+    hoy = date.today()
+
+    if not fecha_obj:
+        msg.body("❌ Formato de fecha inválido. Usa el formato AAAA-MM-DD.")
+        return
+    if fecha_obj > hoy:
+        msg.body("❌ La fecha de salida no puede ser futura. Ingresa una fecha válida.")
+        return
+
+    hoja_lotes = get_lotes_sheet_for_number(phone_number)
+    lotes = cola_de_lotes(hoja_lotes.filas_de(estado["codigo"]), fecha_obj)
+    if not lotes:
+        msg.body("⚠️ Los lotes disponibles vencieron antes de esa fecha. No se permite registrar salidas de productos vencidos.")
+        user_states.pop(phone_number, None)
+        return
+
+    estado["fecha_salida"] = fecha_salida
+    estado["disponible"] = sum(int(lote[7]) for *_, lote in lotes)
+    estado["step"] = "salida_cantidad"
+    msg.body(f"🔢 Ingresa la cantidad que deseas retirar (disponible: {estado['disponible']}):")
+
+@paso("salida_cantidad")
+def paso_salida_cantidad(phone_number, incoming_msg, estado, msg):
+    cantidad_salida = incoming_msg.strip()
+    if not cantidad_salida.isdigit():
+        msg.body("❌ Ingresa una cantidad válida.")
+        return
+
+    cantidad_retirar = int(cantidad_salida)
+    if cantidad_retirar > estado.get("disponible", cantidad_retirar):
+        msg.body(f"❌ No puedes retirar más de lo disponible en los lotes. Disponible: {estado['disponible']}")
+        return
+
+    hoja_productos = get_inventory_sheet_for_number(phone_number)
+    hoja_lotes = get_lotes_sheet_for_number(phone_number)
+    codigo = estado["codigo"]
+
+    with bloqueo_escritura(hoja_productos.url):
+        encontrado = hoja_productos.releer(codigo)
+        if not encontrado:
+            msg.body("❌ El producto ya no existe en tu hoja. Escribe *menu* para ver las opciones.")
+            user_states.pop(phone_number, None)
+            return
+        fila_producto, actual = encontrado
+        producto = estado["producto"]
+
+        # Se reparte la cantidad entre los lotes en orden FEFO sobre Lotes releída entera
+        # (una llamada), por si algún lote se movió de fila o cambió lo disponible
+        hoja_lotes.recargar()
+        lotes = cola_de_lotes(hoja_lotes.filas_de(codigo), normalizar_fecha(estado["fecha_salida"]))
+        retiros = []  # (fila, lote, cantidad, disponible antes de retirar)
+        pendiente = cantidad_retirar
+        while pendiente > 0 and lotes:
+            *_, fila_lote, lote = heapq.heappop(lotes)
+            disponible = int(lote[7])
+            retiros.append((fila_lote, lote, min(disponible, pendiente), disponible))
+            pendiente -= retiros[-1][2]
+        if pendiente > 0:
+            metricas.incrementar("escritura.rechazos")
+            estado["disponible"] = cantidad_retirar - pendiente + sum(int(lote[7]) for *_, lote in lotes)
+            msg.body(
+                "❌ Los lotes cambiaron mientras registrabas la salida. "
+                f"Disponible ahora: {estado['disponible']}. Ingresa otra cantidad:"
+            )
+            return
+
+        stock_actual = actual[5]
+        if stock_actual != producto[5]:
+            metricas.incrementar("escritura.reintentos")
+        nuevo_stock = int(stock_actual)
+
+        # Stock, lotes e historial (una fila por lote) se envían juntos en un solo batch_update
+        escritura = EscrituraAgrupada(hoja_productos.url)
+        for fila_lote, lote, cantidad, disponible in retiros:
+            escritura.update_cell(hoja_lotes, fila_lote, 8, str(disponible - cantidad))
+            nuevo_stock -= cantidad
+            registrar_movimiento(
+                phone_number,
+                "Salida",
+                codigo,
+                producto[1],
+                cantidad,
+                nuevo_stock,
+                estado["fecha_salida"],
+                precio=producto[3],
+                costo=lote[5],
+                escritura=escritura
+            )
+        escritura.update_cell(hoja_productos, fila_producto, 6, str(nuevo_stock))
+
+        try:
+            escritura.confirmar()
+        except Exception as e:
+            logging.error(f"❌ Error al registrar salida: {e}")
+            msg.body("❌ Ocurrió un error al registrar la salida. Intenta nuevamente.")
+            return
+
+    detalle = "\n".join(f"- Lote {lote[2]}: {cantidad}" for _, lote, cantidad, _ in retiros)
+    msg.body(
+        f"✅ Salida registrada. Nuevo stock total: {nuevo_stock}\n{detalle}\n"
+        "📋 Escribe *menu* para regresar al menú."
+    )
+    user_states.pop(phone_number, None)
+
+FORMATO_MASIVO = {
+    "entrada": (
+        "📋 Envía una línea por producto con el formato:\n"
+        "*CÓDIGO, fecha compra, fecha vencimiento, costo, cantidad*\n"
+        "Ej.: 1AU01, 2026-09-01, 2027-03-01, 2.50, 24\n"
+        "Deja la fecha de vencimiento vacía si el producto no vence. Escribe *menu* para cancelar."
+    ),
+    "salida": (
+        "📋 Envía una línea por producto con el formato:\n"
+        "*CÓDIGO, fecha salida, cantidad*\n"
+        "Ej.: 1AU01, 2026-09-15, 6\n"
+        "Escribe *menu* para cancelar."
+    )
+}
+
+@paso("entrada_masiva")
+def paso_entrada_masiva(phone_number, incoming_msg, estado, msg):
+    user_states.pop(phone_number, None)
+    msg.body(registrar_masivo(phone_number, "entrada", incoming_msg))
+
+@paso("salida_masiva")
+def paso_salida_masiva(phone_number, incoming_msg, estado, msg):
+    user_states.pop(phone_number, None)
+    msg.body(registrar_masivo(phone_number, "salida", incoming_msg))
+
+def _leer_entrada_masiva(hoja, campos, hoy):
+    if len(campos) != 5:
+        return None, "se esperaban 5 datos"
+    codigo, fecha_compra, fecha_venc, costo, cantidad = campos
+    codigo = codigo.upper()
+    encontrado = hoja.buscar(codigo)
+    if not encontrado:
+        return None, f"código {codigo} no encontrado"
+    compra = normalizar_fecha(fecha_compra)
+    if not compra or compra > hoy:
+        return None, "fecha de compra inválida o futura"
+    if fecha_venc and not normalizar_fecha(fecha_venc):
+        return None, "fecha de vencimiento inválida"
+    try:
+        float(costo)
+    except ValueError:
+        return None, "costo no válido"
+    if not cantidad.isdigit():
+        return None, "cantidad no válida"
+    return (codigo, encontrado[1], fecha_compra, fecha_venc, costo, int(cantidad)), None
+
+def _leer_salida_masiva(hoja, campos, hoy):
+    if len(campos) != 3:
+        return None, "se esperaban 3 datos"
+    codigo, fecha_salida, cantidad = campos
+    codigo = codigo.upper()
+    encontrado = hoja.buscar(codigo)
+    if not encontrado:
+        return None, f"código {codigo} no encontrado"
+    salida = normalizar_fecha(fecha_salida)
+    if not salida or salida > hoy:
+        return None, "fecha de salida inválida o futura"
+    if not cantidad.isdigit() or int(cantidad) == 0:
+        return None, "cantidad no válida"
+    return (codigo, encontrado[1], fecha_salida, int(cantidad)), None
+
+def registrar_masivo(phone_number, tipo, texto):
+    """
+    Registra una entrada o salida por cada línea de `texto` y devuelve el resumen línea
+    por línea. Las líneas válidas se escriben juntas (Productos, Lotes e Historial) en un
+    solo batch_update; las inválidas se informan sin afectar a las demás.
+    """
+    hoja = get_inventory_sheet_for_number(phone_number)
+    hoja_lotes = get_lotes_sheet_for_number(phone_number)
+    if not hoja or not hoja_lotes:
+        return "⚠️ No se pudo acceder a tu hoja de productos. Intenta nuevamente más tarde."
+
+    lineas = [linea for linea in texto.splitlines() if linea.strip()]
+    if len(lineas) > MAX_LINEAS_MASIVAS:
+        return f"❌ Envía como máximo {MAX_LINEAS_MASIVAS} líneas por mensaje."
+    leer = _leer_entrada_masiva if tipo == "entrada" else _leer_salida_masiva
+    hoy = date.today()
+    resultados = {}  # número de línea → texto del resultado
+    validas = []     # (número de línea, datos)
+    for n, linea in enumerate(lineas, start=1):
+        datos, error = leer(hoja, [campo.strip() for campo in linea.split(",")], hoy)
+        if error:
+            resultados[n] = f"❌ Línea {n}: {error}"
+        else:
+            validas.append((n, datos))
+
+    if validas:
+        with bloqueo_escritura(hoja.url):
+            # Productos (y Lotes en las salidas) se releen enteros una sola vez; el stock y
+            # lo disponible de cada línea se toman y descuentan sobre esa copia
+            hoja.recargar()
+            if tipo == "salida":
+                hoja_lotes.recargar()
+            escritura = EscrituraAgrupada(hoja.url)
+            stock = {}  # código → [fila del producto, stock actual], o el motivo del error
+            for n, datos in validas:
+                codigo = datos[0]
+                if codigo not in stock:
+                    encontrado = hoja.buscar(codigo)
+                    if not encontrado:
+                        stock[codigo] = f"el producto {codigo} ya no existe"
+                    else:
+                        try:
+                            stock[codigo] = [encontrado[0], int(encontrado[1][5] or 0)]
+                        except ValueError:
+                            stock[codigo] = "stock no válido"
+                if isinstance(stock[codigo], str):
+                    resultados[n] = f"❌ Línea {n}: {stock[codigo]}"
+            validas = [(n, datos) for n, datos in validas if not isinstance(stock[datos[0]], str)]
+            stock = {codigo: valor for codigo, valor in stock.items() if not isinstance(valor, str)}
+            inicial = {codigo: cantidad for codigo, (_, cantidad) in stock.items()}
+            if tipo == "entrada":
+                _entradas_masivas(phone_number, hoja_lotes, escritura, validas, stock, resultados)
+            else:
+                _salidas_masivas(phone_number, hoja_lotes, escritura, validas, stock, resultados)
+            for codigo, (fila, cantidad) in stock.items():
+                if cantidad != inicial[codigo]:
+                    escritura.update_cell(hoja, fila, 6, str(cantidad))
+            try:
+                escritura.confirmar()
+            except Exception as e:
+                logging.error(f"❌ Error al registrar {tipo} masiva: {e}")
+                return f"❌ Ocurrió un error al registrar las {tipo}s. No se guardó ninguna línea, intenta nuevamente."
+        metricas.incrementar(f"masivo.{tipo}.lineas", len(validas))
+
+    correctas = sum(1 for r in resultados.values() if r.startswith("✅"))
+    resumen = f"📋 *{tipo.capitalize()} masiva:* {correctas} de {len(lineas)} líneas registradas\n"
+    resumen += "\n".join(resultados[n] for n in sorted(resultados))
+    resumen += "\n📲 Escribe *menu* para regresar al menú."
+    return resumen
+
+def _entradas_masivas(phone_number, hoja_lotes, escritura, validas, stock, resultados):
+    for n, (codigo, producto, fecha_compra, fecha_venc, costo, cantidad) in validas:
+        lote_id = generar_id_lote(hoja_lotes, codigo)
+        escritura.append_row(hoja_lotes, [
+            codigo, producto[1], lote_id, fecha_compra, fecha_venc, costo, str(cantidad), str(cantidad)
+        ])
+        stock[codigo][1] += cantidad
+        registrar_movimiento(
+            phone_number, "Entrada", codigo, producto[1], cantidad, stock[codigo][1], fecha_compra,
+            precio=producto[3], costo=costo, escritura=escritura
+        )
+        resultados[n] = f"✅ Línea {n}: {codigo} +{cantidad} (lote {lote_id}, stock {stock[codigo][1]})"
+
+def _salidas_masivas(phone_number, hoja_lotes, escritura, validas, stock, resultados):
+    # hoja_lotes se acaba de releer en registrar_masivo: lo disponible sale de esa copia
+    disponibles = {}  # fila del lote → unidades que quedan tras las líneas anteriores
+    for n, (codigo, producto, fecha_salida, cantidad) in validas:
+        lotes = [
+            (fila, lote[:7] + [str(disponibles[fila])] if fila in disponibles else lote)
+            for fila, lote in hoja_lotes.filas_de(codigo)
+        ]
+        cola = cola_de_lotes(lotes, normalizar_fecha(fecha_salida))
+        retiros = []
+        pendiente = cantidad
+        while pendiente > 0 and cola:
+            *_, fila, lote = heapq.heappop(cola)
+            tomar = min(int(lote[7]), pendiente)
+            retiros.append((fila, lote, tomar))
+            pendiente -= tomar
+        if pendiente > 0:
+            resultados[n] = f"❌ Línea {n}: {codigo} solo tiene {cantidad - pendiente} unidades disponibles"
+            continue
+        for fila, lote, tomar in retiros:
+            disponibles[fila] = int(lote[7]) - tomar
+            escritura.update_cell(hoja_lotes, fila, 8, str(disponibles[fila]))
+            stock[codigo][1] -= tomar
+            registrar_movimiento(
+                phone_number, "Salida", codigo, producto[1], tomar, stock[codigo][1], fecha_salida,
+                precio=producto[3], costo=lote[5], escritura=escritura
+            )
+        resultados[n] = f"✅ Línea {n}: {codigo} -{cantidad} (stock {stock[codigo][1]})"
+
+# Los procesos de reporte_pdf (forkserver o spawn) vuelven a importar este módulo como
+# __mp_main__ cuando se ejecuta con "python app.py"; en ellos no se arranca el bot
+if __name__ != "__mp_main__":
+    precalentar()
+
+    if WEBHOOK_ASINCRONO:
+        cola_mensajes.iniciar(procesar_mensaje)
+
+    if programador.ALERTAS_PROGRAMADAS:
+        programador.iniciar()
 
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=10000)
\ No newline at end of file
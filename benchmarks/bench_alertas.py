@@ -0,0 +1,60 @@
+"""
+Compara las alertas de la opción 5 calculadas lote por lote con strptime (como antes)
+con las de alertas.py: la carga de los arrays y el cálculo sobre ellos ya cargados.
+
+    python benchmarks/bench_alertas.py [lotes]
+"""
+import os
+import sys
+import random
+import timeit
+from datetime import date, datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from alertas import Alertas  # noqa: E402
+
+def _hojas(n):
+    random.seed(1)
+    productos = [[f"P{i:04d}", f"Producto {i}", "Marca", "10", "0", "20", "A1"] for i in range(n // 5)]
+    hoy = date.today()
+    lotes = []
+    for i in range(n):
+        vence = hoy + timedelta(days=random.randint(-60, 720))
+        lotes.append([
+            f"P{random.randrange(n // 5):04d}", "Producto", str(i), "2024-01-01",
+            vence.isoformat(), "5", "10", str(random.randint(0, 10))
+        ])
+    return productos, lotes
+
+def _por_lote(productos, lotes, hoy):
+    minimos = {p[0]: int(p[5]) for p in productos}
+    bajos, proximos, vencidos = 0, 0, 0
+    for lote in lotes:
+        if lote[0] not in minimos:
+            continue
+        if int(lote[7]) <= minimos[lote[0]]:
+            bajos += 1
+        fecha = datetime.strptime(lote[4], "%Y-%m-%d").date()
+        if fecha < hoy:
+            vencidos += 1
+        elif (fecha - hoy).days <= 21:
+            proximos += 1
+    return bajos, proximos, vencidos
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    productos, lotes = _hojas(n)
+    hoy = date.today()
+
+    t_por_lote = min(timeit.repeat(lambda: _por_lote(productos, lotes, hoy), number=1, repeat=3))
+    t_carga = min(timeit.repeat(lambda: Alertas(productos, lotes), number=1, repeat=3))
+    alertas = Alertas(productos, lotes)
+    t_calculo = min(timeit.repeat(lambda: alertas.calcular(hoy), number=20, repeat=3)) / 20
+    print(f"{n} lotes, {len(productos)} productos")
+    print(f"lote por lote con strptime: {t_por_lote * 1000:.1f} ms")
+    print(f"carga de arrays:            {t_carga * 1000:.1f} ms")
+    print(f"cálculo sobre arrays:       {t_calculo * 1000:.2f} ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+Repite conversaciones de WhatsApp completas contra el webhook (cliente de pruebas de
+Flask) con un Google Sheets falso en memoria (hojas_falsas.py), y para cada flujo y
+tamaño de catálogo muestra la latencia p50/p99 del flujo, el p99 por mensaje y las
+llamadas a la API de Sheets: en la primera repetición (con las cachés que dejaron los
+flujos anteriores; el primer flujo de cada tamaño empieza en frío) y en promedio después.
+
+    python benchmarks/bench_conversaciones.py [repeticiones] [latencia por llamada en ms] [tamaños ...]
+
+Por defecto 20 repeticiones, 50 ms y catálogos de 100, 1000 y 5000 productos. No usa
+Google Sheets ni Twilio; la cuota de cuota.py se desactiva para no medir sus esperas.
+"""
+import io
+import os
+import sys
+import math
+import random
+import logging
+import tempfile
+import time
+from contextlib import redirect_stdout
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+_temporal = tempfile.mkdtemp(prefix="bench_conversaciones_")
+os.environ.setdefault("CONTADORES_DB", os.path.join(_temporal, "contadores.db"))
+os.environ.setdefault("AGREGADOS_DB", os.path.join(_temporal, "agregados.db"))
+os.environ.setdefault("REPORTES_DIR", os.path.join(_temporal, "reportes"))
+os.environ.setdefault("CUOTA_POR_MINUTO", "1000000000")
+os.environ.setdefault("CUOTA_CLIENTE_POR_MINUTO", "1000000000")
+
+import google_sheets  # noqa: E402
+from hojas_falsas import ClienteFalso  # noqa: E402
+
+ENCABEZADOS = {
+    "Productos": ["Código", "Nombre", "Marca", "Precio", "Stock", "Stock mínimo", "Lugar"],
+    "Lotes": ["Código", "Nombre", "Lote", "Fecha compra", "Fecha vencimiento", "Costo", "Cantidad", "Disponible"],
+    "Historial de movimientos": ["Fecha", "Código", "Nombre", "Tipo", "Cantidad", "Stock final", "Precio", "Costo"],
+}
+
+def _libro(n, hoy):
+    # n productos con dos lotes cada uno y cinco movimientos por producto en el último año
+    random.seed(n)
+    productos, lotes, historial = [ENCABEZADOS["Productos"]], [ENCABEZADOS["Lotes"]], [ENCABEZADOS["Historial de movimientos"]]
+    for i in range(n):
+        codigo, nombre = f"1AU{i + 1:04d}", f"Producto {i + 1}"
+        productos.append([codigo, nombre, "Alfa", "10", "20", "5", "A1"])
+        for lote in (1, 2):
+            compra = hoy - timedelta(days=random.randint(30, 365))
+            vence = hoy + timedelta(days=random.randint(-30, 720))
+            lotes.append([codigo, nombre, str(lote), compra.isoformat(), vence.isoformat(), "6", "10", "10"])
+    for dia in sorted(random.randint(1, 365) for _ in range(5 * n)):
+        i = random.randrange(n)
+        tipo = random.choice(["Entrada", "Salida", "Salida"])
+        historial.append([
+            (hoy - timedelta(days=366 - dia)).isoformat(), f"1AU{i + 1:04d}", f"Producto {i + 1}",
+            tipo, str(random.randint(1, 5)), "0", "10", "6"
+        ])
+    return {"Productos": productos, "Lotes": lotes, "Historial de movimientos": historial}
+
+def _flujos(hoy):
+    compra, vence = hoy.isoformat(), (hoy + timedelta(days=365)).isoformat()
+    return {
+        "listar productos": ["menu", "1", "mas"],
+        "agregar producto": ["menu", "2", "b", "si", "a", "Leche, Gloria, 4.5, 3, B2, x", "caja", "no"],
+        "entrada": ["menu", "3", "1AU0001", compra, vence, "5", "10", "no"],
+        "salida": ["menu", "4", "1AU0001", hoy.isoformat(), "1"],
+        "reporte": ["menu", "6"],
+        "reporte del mes": ["menu", "reporte mes"],
+        "alertas": ["menu", "5"],
+    }
+
+def _percentil(valores, p):
+    ordenados = sorted(valores)
+    return ordenados[max(0, math.ceil(p / 100 * len(ordenados)) - 1)]
+
+def main():
+    repeticiones = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    latencia = (float(sys.argv[2]) if len(sys.argv) > 2 else 50) / 1000
+    tamanos = [int(x) for x in sys.argv[3:]] or [100, 1000, 5000]
+    hoy = date.today()
+
+    cliente = ClienteFalso(latencia=0)
+    directorio = [["Número", "Nombre", "URL de hoja"]]
+    for n in tamanos:
+        directorio.append([f"51{n:09d}", f"Tienda {n}", f"libro-{n}"])
+        cliente.agregar_libro(f"libro-{n}", _libro(n, hoy))
+    cliente.agregar_libro("Clientes", {"Clientes": directorio})
+    google_sheets.configurar_cliente(cliente)
+
+    import app  # noqa: E402 (después de configurar el cliente falso)
+    logging.getLogger().setLevel(logging.WARNING)
+    webhook = app.app.test_client()
+    cliente.latencia = latencia
+
+    print(f"{repeticiones} repeticiones por flujo, {latencia * 1000:.0f} ms por llamada a Sheets")
+    print(f"{'productos':>9}  {'flujo':<18}{'msjs':>5}{'p50 (ms)':>10}{'p99 (ms)':>10}{'p99 msj':>9}{'llamadas 1.ª':>14}{'llamadas':>10}")
+    for n in tamanos:
+        telefono = f"whatsapp:+51{n:09d}"
+        for nombre, mensajes in _flujos(hoy).items():
+            duraciones, por_mensaje, llamadas = [], [], []
+            for _ in range(repeticiones):
+                antes = cliente.total_llamadas()
+                inicio = time.perf_counter()
+                for texto in mensajes:
+                    t = time.perf_counter()
+                    with redirect_stdout(io.StringIO()):
+                        respuesta = webhook.post("/webhook", data={"Body": texto, "From": telefono})
+                    por_mensaje.append(time.perf_counter() - t)
+                    assert respuesta.status_code == 200, respuesta.status_code
+                duraciones.append(time.perf_counter() - inicio)
+                llamadas.append(cliente.total_llamadas() - antes)
+            promedio = sum(llamadas[1:]) / max(len(llamadas) - 1, 1)
+            print(
+                f"{n:>9}  {nombre:<18}{len(mensajes):>5}"
+                f"{_percentil(duraciones, 50) * 1000:>10.1f}{_percentil(duraciones, 99) * 1000:>10.1f}"
+                f"{_percentil(por_mensaje, 99) * 1000:>9.1f}{llamadas[0]:>14}{promedio:>10.1f}"
+            )
+    print("Llamadas por método:", dict(cliente.llamadas.most_common()))
+
+if __name__ == "__main__":
+    main()
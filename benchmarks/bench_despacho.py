@@ -0,0 +1,63 @@
+"""
+Compara el costo de elegir el paso de la conversación con la cadena if/elif anterior
+(una comparación estado.get("step") == ... por paso) y con app.despachar_paso, tal como
+lo usa el webhook: el registro PASOS y los hooks registrados (métricas por paso).
+
+    python benchmarks/bench_despacho.py
+
+Solo mide el despacho: las funciones de PASOS se reemplazan por funciones vacías. La
+columna "sin hooks" mide despachar_paso con la lista de hooks vacía.
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app  # noqa: E402
+
+NOMBRES = list(app.PASOS)
+REPETICIONES = 200000
+
+def _nada(phone_number, incoming_msg, estado, msg):
+    return None
+
+def _cadena_elif():
+    # Genera una función con la misma forma que la cadena original
+    lineas = ["def despachar(phone_number, incoming_msg, estado, msg):"]
+    for i, nombre in enumerate(NOMBRES):
+        palabra = "if" if i == 0 else "elif"
+        lineas.append(f"    {palabra} estado.get('step') == {nombre!r}:")
+        lineas.append("        return _nada(phone_number, incoming_msg, estado, msg)")
+    espacio = {"_nada": _nada}
+    exec("\n".join(lineas), espacio)
+    return espacio["despachar"]
+
+def _medir(despachar, estado):
+    return min(timeit.repeat(lambda: despachar("51999", "x", estado, None), number=REPETICIONES, repeat=3))
+
+def main():
+    cadena = _cadena_elif()
+    originales = dict(app.PASOS)
+    app.PASOS.update({nombre: _nada for nombre in NOMBRES})
+    try:
+        print(f"{len(NOMBRES)} pasos, {len(app._hooks_pasos)} hooks, {REPETICIONES} despachos por medición")
+        print(f"{'paso':<36}{'if/elif (ns)':>14}{'despachar_paso (ns)':>21}{'sin hooks (ns)':>16}")
+        for nombre in (NOMBRES[0], NOMBRES[len(NOMBRES) // 2], NOMBRES[-1]):
+            estado = {"step": nombre}
+            t_cadena = _medir(cadena, estado)
+            t_registro = _medir(app.despachar_paso, estado)
+            hooks, app._hooks_pasos[:] = list(app._hooks_pasos), []
+            try:
+                t_sin_hooks = _medir(app.despachar_paso, estado)
+            finally:
+                app._hooks_pasos[:] = hooks
+            print(
+                f"{nombre:<36}{t_cadena / REPETICIONES * 1e9:>14.0f}"
+                f"{t_registro / REPETICIONES * 1e9:>21.0f}{t_sin_hooks / REPETICIONES * 1e9:>16.0f}"
+            )
+    finally:
+        app.PASOS.update(originales)
+
+if __name__ == "__main__":
+    main()
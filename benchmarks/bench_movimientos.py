@@ -0,0 +1,60 @@
+"""
+Compara un reporte por periodo recorriendo todas las filas del historial (como hacía la
+opción 6) con el mismo reporte sobre las columnas de movimientos.py.
+
+    python benchmarks/bench_movimientos.py [filas]
+"""
+import os
+import sys
+import random
+import timeit
+from datetime import date, datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from movimientos import Movimientos  # noqa: E402
+
+def _historial(n):
+    random.seed(1)
+    inicio = date(2023, 1, 1)
+    filas = []
+    for i in range(n):
+        fecha = inicio + timedelta(days=i * 1000 // n)
+        tipo = "Salida" if random.random() < 0.7 else "Entrada"
+        filas.append([
+            fecha.isoformat(), f"P{random.randrange(500):03d}", "Producto", tipo,
+            str(random.randint(1, 20)), "0", "10", "6"
+        ])
+    return filas
+
+def _recorrido(filas, desde, hasta):
+    unidades, ganancias = 0, 0.0
+    for fecha, _, _, tipo, cantidad, _, precio, costo in filas:
+        dia = datetime.strptime(fecha[:10], "%Y-%m-%d").date()
+        if desde <= dia <= hasta and tipo.lower() == "salida":
+            unidades += int(cantidad)
+            ganancias += (float(precio) - float(costo)) * int(cantidad)
+    return unidades, ganancias
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    filas = _historial(n)
+    desde, hasta = date(2024, 9, 1), date(2024, 9, 30)
+
+    t_carga = timeit.timeit(lambda: Movimientos(filas), number=1)
+    movimientos = Movimientos(filas)
+    resumen = movimientos.resumen(desde.toordinal(), hasta.toordinal())
+    assert (resumen["unidades_vendidas"], round(resumen["ganancias"], 2)) == \
+        tuple(round(x, 2) for x in _recorrido(filas, desde, hasta))
+
+    t_recorrido = min(timeit.repeat(lambda: _recorrido(filas, desde, hasta), number=1, repeat=3))
+    t_columnas = min(timeit.repeat(
+        lambda: movimientos.resumen(desde.toordinal(), hasta.toordinal()), number=20, repeat=3
+    )) / 20
+    print(f"{n} movimientos, periodo {desde} a {hasta}")
+    print(f"carga en columnas (una vez): {t_carga * 1000:.1f} ms")
+    print(f"recorrido completo:          {t_recorrido * 1000:.2f} ms")
+    print(f"columnas + bisect:           {t_columnas * 1000:.3f} ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""
+Cliente de gspread falso, en memoria, para medir el bot sin Google Sheets.
+
+Imita la parte de Client / Spreadsheet / Worksheet que usa google_sheets.py, espera
+`latencia` segundos en cada llamada (como si fuera a la API) y cuenta las llamadas por
+método. Se instala con google_sheets.configurar_cliente(ClienteFalso(...)).
+"""
+import threading
+import time
+from collections import Counter
+from gspread.exceptions import SpreadsheetNotFound, WorksheetNotFound
+
+class ClienteFalso:
+    def __init__(self, latencia=0.0):
+        self.latencia = latencia
+        self.libros = {}  # nombre o url → LibroFalso
+        self.llamadas = Counter()
+        self._lock = threading.Lock()
+
+    def _llamada(self, metodo):
+        with self._lock:
+            self.llamadas[metodo] += 1
+        if self.latencia:
+            time.sleep(self.latencia)
+
+    def total_llamadas(self):
+        with self._lock:
+            return sum(self.llamadas.values())
+
+    def agregar_libro(self, clave, hojas):
+        """
+        Crea un libro con las pestañas {título: filas}; la primera es sheet1.
+        """
+        self.libros[clave] = LibroFalso(self, clave, hojas)
+        return self.libros[clave]
+
+    def open(self, nombre):
+        self._llamada("open")
+        if nombre not in self.libros:
+            raise SpreadsheetNotFound(nombre)
+        return self.libros[nombre]
+
+    def open_by_url(self, url):
+        self._llamada("open_by_url")
+        if url not in self.libros:
+            raise SpreadsheetNotFound(url)
+        return self.libros[url]
+
+class LibroFalso:
+    def __init__(self, cliente, clave, hojas):
+        self.cliente = cliente
+        self.id = self.url = clave
+        self.hojas = [HojaFalsa(cliente, i, titulo, filas) for i, (titulo, filas) in enumerate(hojas.items())]
+
+    @property
+    def sheet1(self):
+        self.cliente._llamada("sheet1")
+        return self.hojas[0]
+
+    def worksheet(self, titulo):
+        self.cliente._llamada("worksheet")
+        for hoja in self.hojas:
+            if hoja.title == titulo:
+                return hoja
+        raise WorksheetNotFound(titulo)
+
+    def batch_update(self, cuerpo):
+        self.cliente._llamada("batch_update")
+        for solicitud in cuerpo["requests"]:
+            if "appendCells" in solicitud:
+                datos = solicitud["appendCells"]
+                hoja = self.hojas[datos["sheetId"]]
+                for fila in datos["rows"]:
+                    hoja.filas.append([_texto(v["userEnteredValue"]) for v in fila["values"]])
+            elif "updateCells" in solicitud:
+                datos = solicitud["updateCells"]
+                hoja = self.hojas[datos["start"]["sheetId"]]
+                hoja._escribir(
+                    datos["start"]["rowIndex"] + 1, datos["start"]["columnIndex"] + 1,
+                    _texto(datos["rows"][0]["values"][0]["userEnteredValue"])
+                )
+            elif "deleteDimension" in solicitud:
+                rango = solicitud["deleteDimension"]["range"]
+                del self.hojas[rango["sheetId"]].filas[rango["startIndex"]:rango["endIndex"]]
+            else:
+                raise ValueError(f"Solicitud no soportada: {solicitud}")
+        return {}
+
+def _texto(valor):
+    if "numberValue" in valor:
+        numero = valor["numberValue"]
+        return str(int(numero)) if numero == int(numero) else str(numero)
+    return valor.get("stringValue", valor.get("formulaValue", ""))
+
+class HojaFalsa:
+    def __init__(self, cliente, id_, titulo, filas):
+        self.cliente = cliente
+        self.id = id_
+        self.title = titulo
+        self.filas = [[str(v) for v in fila] for fila in filas]
+
+    def _escribir(self, row, col, value):
+        while len(self.filas) < row:
+            self.filas.append([])
+        fila = self.filas[row - 1]
+        fila.extend([""] * (col - len(fila)))
+        fila[col - 1] = str(value)
+
+    def get_all_values(self):
+        self.cliente._llamada("get_all_values")
+        return [list(fila) for fila in self.filas]
+
+    def get_all_records(self):
+        self.cliente._llamada("get_all_records")
+        encabezado = self.filas[0] if self.filas else []
+        return [dict(zip(encabezado, fila)) for fila in self.filas[1:]]
+
+    def row_values(self, row):
+        self.cliente._llamada("row_values")
+        fila = list(self.filas[row - 1]) if row <= len(self.filas) else []
+        while fila and fila[-1] == "":
+            fila.pop()
+        return fila
+
+    def append_row(self, values, value_input_option="RAW", **kwargs):
+        self.cliente._llamada("append_row")
+        self.filas.append([str(v) for v in values])
+        n = len(self.filas)
+        return {"updates": {"updatedRange": f"'{self.title}'!A{n}:{_columna(len(values))}{n}"}}
+
+    def append_rows(self, values, value_input_option="RAW", **kwargs):
+        self.cliente._llamada("append_rows")
+        self.filas.extend([str(v) for v in fila] for fila in values)
+        return {}
+
+    def update_cell(self, row, col, value):
+        self.cliente._llamada("update_cell")
+        self._escribir(row, col, value)
+        return {}
+
+    def delete_rows(self, start_index, end_index=None):
+        self.cliente._llamada("delete_rows")
+        del self.filas[start_index - 1:end_index or start_index]
+        return {}
+
+def _columna(n):
+    letras = ""
+    while n:
+        n, resto = divmod(n - 1, 26)
+        letras = chr(65 + resto) + letras
+    return letras or "A"
@@ -0,0 +1,70 @@
+import os
+import queue
+import logging
+import threading
+import zlib
+import xml.etree.ElementTree as ET
+from mensajeria import enviar_mensaje
+
+# Procesamiento asíncrono de mensajes entrantes: el webhook solo encola y responde vacío,
+# y un grupo de hilos procesa cada mensaje y envía la respuesta por la API REST.
+# Cada número se asigna siempre al mismo hilo, así sus mensajes se procesan en orden.
+WORKERS_MENSAJES = int(os.environ.get("WORKERS_MENSAJES", "4"))
+
+_colas = []
+_procesar = None
+_lock = threading.Lock()
+
+def respuestas_de_twiml(twiml):
+    """
+    Extrae de una respuesta TwiML los mensajes a enviar: [(texto, media_url o None)].
+    """
+    respuestas = []
+    for mensaje in ET.fromstring(twiml).iter("Message"):
+        texto = "\n".join(body.text or "" for body in mensaje.iter("Body"))
+        media = [m.text for m in mensaje.iter("Media") if m.text]
+        if texto or media:
+            respuestas.append((texto, media[0] if media else None))
+    return respuestas
+
+def _trabajar(cola):
+    while True:
+        phone_number, incoming_msg = cola.get()
+        try:
+            twiml = _procesar(phone_number, incoming_msg)
+            for texto, media_url in respuestas_de_twiml(twiml):
+                enviar_mensaje(phone_number, texto, media_url=media_url)
+        except Exception as e:
+            logging.error(f"❌ Error al procesar mensaje de {phone_number}: {e}")
+            enviar_mensaje(phone_number, "❌ Ocurrió un error al procesar tu mensaje. Intenta nuevamente.")
+        finally:
+            cola.task_done()
+
+def iniciar(procesar, workers=None):
+    """
+    Arranca los hilos de trabajo. `procesar(phone_number, incoming_msg)` debe devolver
+    la respuesta TwiML como texto.
+    """
+    global _procesar
+    with _lock:
+        _procesar = procesar
+        if _colas:
+            return
+        for _ in range(workers or WORKERS_MENSAJES):
+            cola = queue.Queue()
+            threading.Thread(target=_trabajar, args=(cola,), daemon=True).start()
+            _colas.append(cola)
+
+def encolar(phone_number, incoming_msg):
+    """
+    Encola un mensaje entrante para que lo procese el hilo asignado a su número.
+    """
+    cola = _colas[zlib.crc32(phone_number.encode()) % len(_colas)]
+    cola.put((phone_number, incoming_msg))
+
+def esperar():
+    """
+    Bloquea hasta que se hayan procesado todos los mensajes encolados.
+    """
+    for cola in _colas:
+        cola.join()
@@ -0,0 +1,86 @@
+import os
+import sqlite3
+import threading
+
+# Correlativos por cliente (códigos de producto y IDs de lote), guardados en SQLite para
+# que sobrevivan reinicios y para que varios procesos no asignen el mismo número.
+CONTADORES_DB = os.environ.get("CONTADORES_DB", "contadores.db")
+
+_conexion = None
+_lock = threading.Lock()
+
+def _obtener_conexion():
+    global _conexion
+    if _conexion is None:
+        _conexion = sqlite3.connect(CONTADORES_DB, check_same_thread=False, isolation_level=None, timeout=30)
+        _conexion.execute(
+            "CREATE TABLE IF NOT EXISTS contadores ("
+            "tenant TEXT NOT NULL, clave TEXT NOT NULL, valor INTEGER NOT NULL, "
+            "PRIMARY KEY (tenant, clave))"
+        )
+    return _conexion
+
+def asignar(tenant, clave, semilla, ocupado=None):
+    """
+    Reserva y devuelve el siguiente número del contador `clave` del cliente `tenant`.
+
+    La primera vez se inicializa con semilla() (el mayor número que ya existe en la hoja).
+    Si se pasa ocupado(n), se saltan los números que ya están en uso, p. ej. códigos
+    escritos a mano en la hoja después de inicializar el contador.
+    """
+    return asignar_varios(tenant, clave, 1, semilla, ocupado)[0]
+
+def asignar_varios(tenant, clave, cantidad, semilla, ocupado=None):
+    """
+    Como asignar(), pero reserva `cantidad` números de una vez y los devuelve en orden
+    (p. ej. para una importación masiva).
+
+    semilla() y ocupado(n) pueden leer la hoja, así que se llaman fuera del candado y de
+    la transacción: los números se reservan primero y luego se descartan los ocupados.
+    """
+    numeros = []
+    while len(numeros) < cantidad:
+        reservados = _reservar(tenant, clave, cantidad - len(numeros))
+        if reservados is None:
+            _inicializar(tenant, clave, semilla())
+            continue
+        numeros += [n for n in reservados if not (ocupado and ocupado(n))]
+    return numeros
+
+def _inicializar(tenant, clave, valor):
+    # Si otro hilo o proceso lo inicializó mientras se calculaba la semilla, gana el suyo
+    with _lock:
+        _obtener_conexion().execute(
+            "INSERT OR IGNORE INTO contadores (tenant, clave, valor) VALUES (?, ?, ?)", (tenant, clave, valor)
+        )
+
+def _reservar(tenant, clave, cantidad):
+    # Avanza el contador `cantidad` números y devuelve los reservados, o None si no existe
+    with _lock:
+        conexion = _obtener_conexion()
+        conexion.execute("BEGIN IMMEDIATE")
+        try:
+            row = conexion.execute(
+                "SELECT valor FROM contadores WHERE tenant = ? AND clave = ?", (tenant, clave)
+            ).fetchone()
+            if row:
+                conexion.execute(
+                    "UPDATE contadores SET valor = ? WHERE tenant = ? AND clave = ?",
+                    (row[0] + cantidad, tenant, clave)
+                )
+            conexion.execute("COMMIT")
+        except Exception:
+            conexion.execute("ROLLBACK")
+            raise
+    return range(row[0] + 1, row[0] + cantidad + 1) if row else None
+
+def reiniciar(tenant, clave=None):
+    """
+    Olvida los contadores de un cliente (o solo `clave`); se vuelven a inicializar desde la hoja.
+    """
+    with _lock:
+        conexion = _obtener_conexion()
+        if clave is None:
+            conexion.execute("DELETE FROM contadores WHERE tenant = ?", (tenant,))
+        else:
+            conexion.execute("DELETE FROM contadores WHERE tenant = ? AND clave = ?", (tenant, clave))
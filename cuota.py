@@ -0,0 +1,138 @@
+import os
+import time
+import random
+import logging
+import threading
+import gspread
+import metricas
+
+# Límite de llamadas a la API de Google Sheets, compartido por todo el proceso.
+# Cada llamada toma una ficha de la cubeta de su cliente (CUOTA_CLIENTE_POR_MINUTO, para
+# que un cliente muy activo no agote la cuota de los demás) y luego una de la cubeta
+# global (CUOTA_POR_MINUTO). Los errores 429 se reintentan con espera exponencial; los
+# 5xx solo en lecturas, porque una escritura pudo haberse aplicado.
+#
+# Las lecturas iguales simultáneas (get_all_values, get_all_records, abrir un libro o una
+# pestaña) se hacen una sola vez con compartida(). Las relecturas de comparar y escribir
+# de google_sheets.HojaCliente (releer() con row_values y recargar() con get_all_values,
+# dentro de bloqueo_escritura) nunca se comparten: una lectura ya en curso pudo empezar
+# antes de la última escritura.
+CUOTA_POR_MINUTO = float(os.environ.get("CUOTA_POR_MINUTO", "60"))
+CUOTA_CLIENTE_POR_MINUTO = float(os.environ.get("CUOTA_CLIENTE_POR_MINUTO", "30"))
+CUOTA_RAFAGA = float(os.environ.get("CUOTA_RAFAGA", "10"))      # llamadas seguidas sin esperar
+CUOTA_REINTENTOS = int(os.environ.get("CUOTA_REINTENTOS", "5"))
+CUOTA_ESPERA_BASE = float(os.environ.get("CUOTA_ESPERA_BASE", "1"))  # segundos antes del primer reintento
+CUOTA_ESPERA_MAX = 32.0
+
+class Cubeta:
+    """
+    Cubeta de fichas. reservar() toma una ficha aunque no haya y devuelve cuántos
+    segundos esperar para usarla; así las llamadas se atienden en orden de llegada.
+    """
+    def __init__(self, por_minuto, capacidad=CUOTA_RAFAGA):
+        self.tasa = por_minuto / 60.0
+        self.capacidad = capacidad
+        self.fichas = capacidad
+        self.actualizado = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reservar(self):
+        with self._lock:
+            ahora = time.monotonic()
+            self.fichas = min(self.capacidad, self.fichas + (ahora - self.actualizado) * self.tasa)
+            self.actualizado = ahora
+            self.fichas -= 1
+            return 0.0 if self.fichas >= 0 else -self.fichas / self.tasa
+
+_global = Cubeta(CUOTA_POR_MINUTO)
+_clientes = {}  # url → Cubeta
+_clientes_lock = threading.Lock()
+
+def _cubeta_cliente(tenant):
+    with _clientes_lock:
+        cubeta = _clientes.get(tenant)
+        if cubeta is None:
+            cubeta = _clientes[tenant] = Cubeta(CUOTA_CLIENTE_POR_MINUTO)
+        return cubeta
+
+def esperar_turno(tenant=None):
+    """
+    Bloquea hasta que el cliente `tenant` (None = sin cliente) pueda hacer una llamada.
+    """
+    espera = 0.0
+    if tenant is not None:
+        espera += _cubeta_cliente(tenant).reservar()
+        time.sleep(espera)
+    global_ = _global.reservar()
+    time.sleep(global_)
+    espera += global_
+    metricas.incrementar("cuota.llamadas")
+    if espera > 0:
+        metricas.observar("cuota.espera", espera)
+
+def _llamar(tenant, funcion, args, kwargs, reintentar):
+    intento = 0
+    while True:
+        esperar_turno(tenant)
+        try:
+            return funcion(*args, **kwargs)
+        except gspread.exceptions.APIError as e:
+            if not reintentar(e.code):
+                raise
+            if intento >= CUOTA_REINTENTOS:
+                metricas.incrementar("cuota.agotada")
+                raise
+            espera = min(CUOTA_ESPERA_MAX, CUOTA_ESPERA_BASE * 2 ** intento) * random.uniform(0.5, 1.0)
+            intento += 1
+            metricas.incrementar("cuota.reintentos")
+            logging.warning(f"⚠️ Google Sheets respondió {e.code}; reintento {intento} en {espera:.1f} s")
+            time.sleep(espera)
+
+def leer(tenant, funcion, *args, **kwargs):
+    """
+    Hace una lectura respetando la cuota; reintenta los 429 y 5xx.
+    """
+    return _llamar(tenant, funcion, args, kwargs, lambda codigo: codigo == 429 or codigo >= 500)
+
+def escribir(tenant, funcion, *args, **kwargs):
+    """
+    Hace una escritura respetando la cuota; reintenta solo los 429.
+    """
+    return _llamar(tenant, funcion, args, kwargs, lambda codigo: codigo == 429)
+
+class _Vuelo:
+    def __init__(self):
+        self.evento = threading.Event()
+        self.resultado = None
+        self.error = None
+
+_en_curso = {}  # clave → _Vuelo
+_en_curso_lock = threading.Lock()
+
+def compartida(clave, funcion):
+    """
+    Ejecuta funcion() una sola vez para todas las llamadas simultáneas con la misma
+    `clave`: las que llegan mientras otra está en curso esperan y reciben su resultado.
+    """
+    with _en_curso_lock:
+        vuelo = _en_curso.get(clave)
+        propio = vuelo is None
+        if propio:
+            vuelo = _en_curso[clave] = _Vuelo()
+    if not propio:
+        metricas.incrementar("cuota.lecturas_compartidas")
+        vuelo.evento.wait()
+        if vuelo.error is not None:
+            raise vuelo.error
+        # Copia de la lista para que quien la reciba pueda modificarla
+        return list(vuelo.resultado) if isinstance(vuelo.resultado, list) else vuelo.resultado
+    try:
+        vuelo.resultado = funcion()
+        return vuelo.resultado
+    except Exception as e:
+        vuelo.error = e
+        raise
+    finally:
+        with _en_curso_lock:
+            del _en_curso[clave]
+        vuelo.evento.set()
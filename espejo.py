@@ -0,0 +1,223 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+
+# Copia local en SQLite de las hojas de cada cliente (Productos, Lotes, Historial).
+# Las lecturas y escrituras del bot van a esta copia; cada escritura queda además en la
+# tabla `pendientes`, que google_sheets.sincronizar_espejo() envía luego a Google Sheets.
+ESPEJO_DB = os.environ.get("ESPEJO_DB", "espejo.db")
+
+_local = threading.local()
+
+def _conexion():
+    conexion = getattr(_local, "conexion", None)
+    if conexion is None:
+        conexion = sqlite3.connect(ESPEJO_DB, timeout=30, isolation_level=None)
+        conexion.execute("PRAGMA journal_mode=WAL")
+        conexion.executescript(
+            "CREATE TABLE IF NOT EXISTS filas ("
+            "url TEXT NOT NULL, hoja TEXT NOT NULL, posicion INTEGER NOT NULL, datos TEXT NOT NULL);"
+            "CREATE INDEX IF NOT EXISTS filas_posicion ON filas (url, hoja, posicion);"
+            "CREATE TABLE IF NOT EXISTS hojas ("
+            "url TEXT NOT NULL, hoja TEXT NOT NULL, traida_en REAL NOT NULL, "
+            "version INTEGER NOT NULL DEFAULT 0, PRIMARY KEY (url, hoja));"
+            "CREATE TABLE IF NOT EXISTS pendientes ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, url TEXT NOT NULL, hoja TEXT NOT NULL, "
+            "operacion TEXT NOT NULL, datos TEXT NOT NULL);"
+        )
+        _local.conexion = conexion
+    return conexion
+
+def _clave_hoja(nombre):
+    # La primera hoja del libro (Productos) se abre sin nombre
+    return nombre or ""
+
+def _dumps(valor):
+    return json.dumps(valor, separators=(",", ":"), ensure_ascii=False)
+
+def _aplicar(conexion, url, hoja, operacion, args):
+    if operacion == "update_cell":
+        row, col, value = args
+        actual = conexion.execute(
+            "SELECT rowid, datos FROM filas WHERE url = ? AND hoja = ? AND posicion = ?", (url, hoja, row)
+        ).fetchone()
+        fila = json.loads(actual[1]) if actual else []
+        fila += [""] * (col - len(fila))
+        fila[col - 1] = "" if value is None else str(value)
+        if actual:
+            conexion.execute("UPDATE filas SET datos = ? WHERE rowid = ?", (_dumps(fila), actual[0]))
+        else:
+            conexion.execute(
+                "INSERT INTO filas (url, hoja, posicion, datos) VALUES (?, ?, ?, ?)", (url, hoja, row, _dumps(fila))
+            )
+        return row
+    if operacion == "append_row":
+        (valores,) = args
+        ultima = conexion.execute(
+            "SELECT COALESCE(MAX(posicion), 0) FROM filas WHERE url = ? AND hoja = ?", (url, hoja)
+        ).fetchone()[0]
+        fila = ["" if v is None else str(v) for v in valores]
+        conexion.execute(
+            "INSERT INTO filas (url, hoja, posicion, datos) VALUES (?, ?, ?, ?)", (url, hoja, ultima + 1, _dumps(fila))
+        )
+        return ultima + 1
+    if operacion == "delete_rows":
+        inicio, fin = args
+        conexion.execute(
+            "DELETE FROM filas WHERE url = ? AND hoja = ? AND posicion BETWEEN ? AND ?", (url, hoja, inicio, fin)
+        )
+        conexion.execute(
+            "UPDATE filas SET posicion = posicion - ? WHERE url = ? AND hoja = ? AND posicion > ?",
+            (fin - inicio + 1, url, hoja, fin)
+        )
+        return inicio
+    raise ValueError(f"Operación desconocida: {operacion}")
+
+def aplicar(url, operaciones):
+    """
+    Aplica [(nombre de hoja, operación, args)] en una sola transacción y las deja
+    pendientes de enviar a Google Sheets. Devuelve el número de fila afectado por cada una.
+    """
+    conexion = _conexion()
+    conexion.execute("BEGIN IMMEDIATE")
+    try:
+        resultados = []
+        for nombre, operacion, args in operaciones:
+            hoja = _clave_hoja(nombre)
+            resultados.append(_aplicar(conexion, url, hoja, operacion, args))
+            conexion.execute("UPDATE hojas SET version = version + 1 WHERE url = ? AND hoja = ?", (url, hoja))
+            conexion.execute(
+                "INSERT INTO pendientes (url, hoja, operacion, datos) VALUES (?, ?, ?, ?)",
+                (url, hoja, operacion, _dumps(list(args)))
+            )
+        conexion.execute("COMMIT")
+        return resultados
+    except Exception:
+        conexion.execute("ROLLBACK")
+        raise
+
+def cargada(url, nombre):
+    return _conexion().execute(
+        "SELECT 1 FROM hojas WHERE url = ? AND hoja = ?", (url, _clave_hoja(nombre))
+    ).fetchone() is not None
+
+def version(url, nombre):
+    """
+    Número que aumenta con cada escritura local en la hoja.
+    """
+    row = _conexion().execute(
+        "SELECT version FROM hojas WHERE url = ? AND hoja = ?", (url, _clave_hoja(nombre))
+    ).fetchone()
+    return row[0] if row else 0
+
+def leer_filas(url, nombre):
+    return [
+        json.loads(datos) for (datos,) in _conexion().execute(
+            "SELECT datos FROM filas WHERE url = ? AND hoja = ? ORDER BY posicion", (url, _clave_hoja(nombre))
+        )
+    ]
+
+def leer_fila(url, nombre, row):
+    actual = _conexion().execute(
+        "SELECT datos FROM filas WHERE url = ? AND hoja = ? AND posicion = ?", (url, _clave_hoja(nombre), row)
+    ).fetchone()
+    return json.loads(actual[0]) if actual else []
+
+def reemplazar_filas(url, nombre, filas, version_leida=None):
+    """
+    Reemplaza la copia local por las filas leídas de Google Sheets. No hace nada (y
+    devuelve False) si la hoja tiene cambios locales sin enviar o si, con
+    `version_leida`, hubo escrituras locales desde que se empezó a leer la hoja remota.
+    """
+    hoja = _clave_hoja(nombre)
+    conexion = _conexion()
+    conexion.execute("BEGIN IMMEDIATE")
+    try:
+        actual = conexion.execute(
+            "SELECT version FROM hojas WHERE url = ? AND hoja = ?", (url, hoja)
+        ).fetchone()
+        pendiente = conexion.execute(
+            "SELECT 1 FROM pendientes WHERE url = ? AND hoja = ? LIMIT 1", (url, hoja)
+        ).fetchone()
+        if pendiente or (version_leida is not None and actual and actual[0] != version_leida):
+            conexion.execute("ROLLBACK")
+            return False
+        conexion.execute("DELETE FROM filas WHERE url = ? AND hoja = ?", (url, hoja))
+        conexion.executemany(
+            "INSERT INTO filas (url, hoja, posicion, datos) VALUES (?, ?, ?, ?)",
+            [(url, hoja, i, _dumps(fila)) for i, fila in enumerate(filas, start=1)]
+        )
+        conexion.execute(
+            "INSERT INTO hojas (url, hoja, traida_en) VALUES (?, ?, ?) "
+            "ON CONFLICT (url, hoja) DO UPDATE SET traida_en = excluded.traida_en", (url, hoja, time.time())
+        )
+        conexion.execute("COMMIT")
+        return True
+    except Exception:
+        conexion.execute("ROLLBACK")
+        raise
+
+def hojas_para_traer(antiguedad):
+    """
+    Devuelve [(url, nombre)] de las hojas traídas hace más de `antiguedad` segundos.
+    """
+    return [
+        (url, hoja or None) for url, hoja in _conexion().execute(
+            "SELECT url, hoja FROM hojas WHERE traida_en < ?", (time.time() - antiguedad,)
+        )
+    ]
+
+def urls_con_pendientes():
+    return [url for (url,) in _conexion().execute("SELECT DISTINCT url FROM pendientes")]
+
+def pendientes(url):
+    """
+    Devuelve [(id, nombre de hoja, operación, args)] del libro en el orden en que se aplicaron.
+    """
+    return [
+        (id_, hoja or None, operacion, json.loads(datos)) for id_, hoja, operacion, datos in _conexion().execute(
+            "SELECT id, hoja, operacion, datos FROM pendientes WHERE url = ? ORDER BY id", (url,)
+        )
+    ]
+
+def marcar_enviados(url, hasta_id):
+    _conexion().execute("DELETE FROM pendientes WHERE url = ? AND id <= ?", (url, hasta_id))
+
+class HojaEspejo:
+    """
+    Hoja de un cliente servida desde la copia local. Ofrece las mismas operaciones de
+    Worksheet que usa el bot; la primera lectura trae la hoja con cargar_remoto().
+    """
+    def __init__(self, url, nombre, cargar_remoto):
+        self.url = url
+        self.nombre = nombre
+        self.title = nombre or ""
+        self.cargar_remoto = cargar_remoto
+
+    def asegurar_cargada(self):
+        if not cargada(self.url, self.nombre):
+            reemplazar_filas(self.url, self.nombre, self.cargar_remoto())
+
+    def get_all_values(self):
+        self.asegurar_cargada()
+        return leer_filas(self.url, self.nombre)
+
+    def row_values(self, row):
+        self.asegurar_cargada()
+        return leer_fila(self.url, self.nombre, row)
+
+    def append_row(self, values, **kwargs):
+        self.asegurar_cargada()
+        (fila,) = aplicar(self.url, [(self.nombre, "append_row", (list(values),))])
+        # Misma forma que la respuesta de la API, para que HojaCliente ubique la fila
+        return {"updates": {"updatedRange": f"'{self.title}'!A{fila}"}}
+
+    def update_cell(self, row, col, value):
+        self.asegurar_cargada()
+        aplicar(self.url, [(self.nombre, "update_cell", (row, col, value))])
+
+    def delete_rows(self, start_index, end_index=None):
+        self.asegurar_cargada()
+        aplicar(self.url, [(self.nombre, "delete_rows", (start_index, end_index or start_index))])
@@ -0,0 +1,281 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+
+# Estado de conversación por número de teléfono.
+# Los almacenes se usan como un dict (in, [], pop, get); los pasos modifican el dict del
+# estado en sitio, por eso al terminar cada mensaje se llama a confirmar(phone_number).
+ESTADO_BACKEND = os.environ.get("ESTADO_BACKEND", "memoria")
+ESTADO_DB = os.environ.get("ESTADO_DB", "estados.db")
+ESTADO_TTL = float(os.environ.get("ESTADO_TTL", "3600"))     # segundos sin mensajes antes de olvidar la conversación
+ESTADO_MAX = int(os.environ.get("ESTADO_MAX", "10000"))      # conversaciones en memoria como máximo
+RESPUESTAS_TTL = float(os.environ.get("RESPUESTAS_TTL", "900"))  # segundos que se recuerda cada MessageSid
+RESPUESTAS_MAX = int(os.environ.get("RESPUESTAS_MAX", "10000"))  # MessageSid en memoria como máximo
+
+class EstadosEnMemoria:
+    """
+    Estados en un OrderedDict del proceso. Las conversaciones sin actividad por más de
+    `ttl` segundos se olvidan y, si se supera `max_usuarios`, se descarta la más antigua.
+    """
+    def __init__(self, ttl=ESTADO_TTL, max_usuarios=ESTADO_MAX):
+        self.ttl = ttl
+        self.max_usuarios = max_usuarios
+        self._estados = OrderedDict()  # phone → (estado, última actividad)
+        self._lock = threading.Lock()
+
+    def _vigente(self, phone_number):
+        item = self._estados.get(phone_number)
+        if item is None:
+            return None
+        if time.monotonic() - item[1] > self.ttl:
+            del self._estados[phone_number]
+            return None
+        return item[0]
+
+    def __contains__(self, phone_number):
+        with self._lock:
+            return self._vigente(phone_number) is not None
+
+    def __getitem__(self, phone_number):
+        with self._lock:
+            estado = self._vigente(phone_number)
+            if estado is None:
+                raise KeyError(phone_number)
+            return estado
+
+    def get(self, phone_number, default=None):
+        try:
+            return self[phone_number]
+        except KeyError:
+            return default
+
+    def __setitem__(self, phone_number, estado):
+        with self._lock:
+            self._estados[phone_number] = (estado, time.monotonic())
+            self._estados.move_to_end(phone_number)
+            while len(self._estados) > self.max_usuarios:
+                self._estados.popitem(last=False)
+
+    def pop(self, phone_number, *default):
+        with self._lock:
+            estado = self._vigente(phone_number)
+            if estado is None:
+                if default:
+                    return default[0]
+                raise KeyError(phone_number)
+            del self._estados[phone_number]
+            return estado
+
+    def confirmar(self, phone_number):
+        # El estado ya se modificó en sitio; solo renovamos su última actividad
+        with self._lock:
+            estado = self._vigente(phone_number)
+            if estado is not None:
+                self._estados[phone_number] = (estado, time.monotonic())
+                self._estados.move_to_end(phone_number)
+
+    def __len__(self):
+        return len(self._estados)
+
+class EstadosSQLite:
+    """
+    Estados en una base SQLite compartida por todos los procesos (p. ej. varios workers
+    de gunicorn). Cada estado se guarda como JSON compacto.
+
+    Durante un mensaje, el estado leído se mantiene en memoria del hilo para que las
+    modificaciones en sitio se vean en el mismo mensaje; confirmar() lo escribe en la base.
+    """
+    def __init__(self, ruta=ESTADO_DB, ttl=ESTADO_TTL):
+        self.ruta = ruta
+        self.ttl = ttl
+        self._local = threading.local()
+        self._escrituras = 0
+        self._conexion().execute(
+            "CREATE TABLE IF NOT EXISTS estados ("
+            "phone TEXT PRIMARY KEY, datos TEXT NOT NULL, actualizado REAL NOT NULL)"
+        )
+
+    def _conexion(self):
+        conexion = getattr(self._local, "conexion", None)
+        if conexion is None:
+            conexion = sqlite3.connect(self.ruta, timeout=30, isolation_level=None)
+            conexion.execute("PRAGMA journal_mode=WAL")
+            self._local.conexion = conexion
+        return conexion
+
+    def _abiertos(self):
+        abiertos = getattr(self._local, "abiertos", None)
+        if abiertos is None:
+            abiertos = self._local.abiertos = {}
+        return abiertos
+
+    def _leer(self, phone_number):
+        abiertos = self._abiertos()
+        if phone_number in abiertos:
+            return abiertos[phone_number]
+        row = self._conexion().execute(
+            "SELECT datos, actualizado FROM estados WHERE phone = ?", (phone_number,)
+        ).fetchone()
+        if row is None:
+            return None
+        if time.time() - row[1] > self.ttl:
+            self._conexion().execute("DELETE FROM estados WHERE phone = ?", (phone_number,))
+            return None
+        estado = json.loads(row[0])
+        abiertos[phone_number] = estado
+        return estado
+
+    def _escribir(self, phone_number, estado):
+        self._conexion().execute(
+            "INSERT OR REPLACE INTO estados (phone, datos, actualizado) VALUES (?, ?, ?)",
+            (phone_number, json.dumps(estado, separators=(",", ":"), ensure_ascii=False), time.time())
+        )
+        self._escrituras += 1
+        if self._escrituras % 500 == 0:
+            self.purgar()
+
+    def __contains__(self, phone_number):
+        return self._leer(phone_number) is not None
+
+    def __getitem__(self, phone_number):
+        estado = self._leer(phone_number)
+        if estado is None:
+            raise KeyError(phone_number)
+        return estado
+
+    def get(self, phone_number, default=None):
+        estado = self._leer(phone_number)
+        return default if estado is None else estado
+
+    def __setitem__(self, phone_number, estado):
+        self._abiertos()[phone_number] = estado
+        self._escribir(phone_number, estado)
+
+    def pop(self, phone_number, *default):
+        estado = self._leer(phone_number)
+        self._abiertos().pop(phone_number, None)
+        self._conexion().execute("DELETE FROM estados WHERE phone = ?", (phone_number,))
+        if estado is None:
+            if default:
+                return default[0]
+            raise KeyError(phone_number)
+        return estado
+
+    def confirmar(self, phone_number):
+        estado = self._abiertos().pop(phone_number, None)
+        if estado is not None:
+            self._escribir(phone_number, estado)
+
+    def purgar(self):
+        """
+        Borra las conversaciones vencidas.
+        """
+        self._conexion().execute("DELETE FROM estados WHERE actualizado < ?", (time.time() - self.ttl,))
+
+def crear_almacen_estados():
+    """
+    Crea el almacén de estados según ESTADO_BACKEND ("memoria" o "sqlite").
+    """
+    if ESTADO_BACKEND == "sqlite":
+        return EstadosSQLite()
+    return EstadosEnMemoria()
+
+# Respuestas ya dadas por MessageSid de Twilio, para no procesar dos veces un POST reintentado.
+# reservar(sid) devuelve True solo la primera vez; mientras el mensaje se procesa la
+# respuesta es None y al terminar se guarda con guardar(sid, twiml).
+class RespuestasEnMemoria:
+    def __init__(self, ttl=RESPUESTAS_TTL, max_respuestas=RESPUESTAS_MAX):
+        self.ttl = ttl
+        self.max_respuestas = max_respuestas
+        self._respuestas = OrderedDict()  # sid → (twiml o None, creado)
+        self._lock = threading.Lock()
+
+    def _vigente(self, sid):
+        item = self._respuestas.get(sid)
+        if item is not None and time.monotonic() - item[1] > self.ttl:
+            del self._respuestas[sid]
+            return None
+        return item
+
+    def reservar(self, sid):
+        with self._lock:
+            if self._vigente(sid) is not None:
+                return False
+            self._respuestas[sid] = (None, time.monotonic())
+            while len(self._respuestas) > self.max_respuestas:
+                self._respuestas.popitem(last=False)
+            return True
+
+    def respuesta(self, sid):
+        with self._lock:
+            item = self._vigente(sid)
+            return item[0] if item else None
+
+    def guardar(self, sid, twiml):
+        with self._lock:
+            item = self._vigente(sid)
+            if item is not None:
+                self._respuestas[sid] = (twiml, item[1])
+
+    def liberar(self, sid):
+        with self._lock:
+            self._respuestas.pop(sid, None)
+
+class RespuestasSQLite:
+    """
+    Respuestas por MessageSid en la misma base que los estados, compartidas entre procesos.
+    """
+    def __init__(self, ruta=ESTADO_DB, ttl=RESPUESTAS_TTL):
+        self.ruta = ruta
+        self.ttl = ttl
+        self._local = threading.local()
+        self._reservas = 0
+        self._conexion().execute(
+            "CREATE TABLE IF NOT EXISTS respuestas ("
+            "sid TEXT PRIMARY KEY, twiml TEXT, creado REAL NOT NULL)"
+        )
+
+    def _conexion(self):
+        conexion = getattr(self._local, "conexion", None)
+        if conexion is None:
+            conexion = sqlite3.connect(self.ruta, timeout=30, isolation_level=None)
+            conexion.execute("PRAGMA journal_mode=WAL")
+            self._local.conexion = conexion
+        return conexion
+
+    def reservar(self, sid):
+        conexion = self._conexion()
+        conexion.execute("DELETE FROM respuestas WHERE sid = ? AND creado < ?", (sid, time.time() - self.ttl))
+        cursor = conexion.execute(
+            "INSERT OR IGNORE INTO respuestas (sid, twiml, creado) VALUES (?, NULL, ?)", (sid, time.time())
+        )
+        self._reservas += 1
+        if self._reservas % 500 == 0:
+            self.purgar()
+        return cursor.rowcount == 1
+
+    def respuesta(self, sid):
+        row = self._conexion().execute(
+            "SELECT twiml FROM respuestas WHERE sid = ? AND creado >= ?", (sid, time.time() - self.ttl)
+        ).fetchone()
+        return row[0] if row else None
+
+    def guardar(self, sid, twiml):
+        self._conexion().execute("UPDATE respuestas SET twiml = ? WHERE sid = ?", (twiml, sid))
+
+    def liberar(self, sid):
+        self._conexion().execute("DELETE FROM respuestas WHERE sid = ?", (sid,))
+
+    def purgar(self):
+        self._conexion().execute("DELETE FROM respuestas WHERE creado < ?", (time.time() - self.ttl,))
+
+def crear_almacen_respuestas():
+    """
+    Crea el almacén de respuestas por MessageSid en el mismo backend que los estados.
+    """
+    if ESTADO_BACKEND == "sqlite":
+        return RespuestasSQLite()
+    return RespuestasEnMemoria()
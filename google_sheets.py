@@ -1,8 +1,22 @@
 import os
 import json
+import datetime
+import re
 import gspread
+import contadores
+import cuota
+import espejo
+import metricas
 import logging
-from oauth2client.service_account import ServiceAccountCredentials
+import threading
+import time
+import zlib
+from bisect import bisect_left, insort
+from collections import OrderedDict
+from contextlib import contextmanager
+import requests
+from google.auth.transport.requests import AuthorizedSession, Request
+from google.oauth2 import service_account
 
 # Configurar logging
 logging.basicConfig(level=logging.INFO)
@@ -10,53 +24,782 @@ logging.basicConfig(level=logging.INFO)
 # Configura el alcance de la API de Google Sheets
 SCOPE = ['https://spreadsheets.google.com/feeds', 'https://www.googleapis.com/auth/drive']
 
-# Lee las credenciales desde una variable de entorno (asegúrate de tener la variable GOOGLE_CREDS configurada)
-creds_json = os.environ.get("GOOGLE_CREDS")
+# Cliente de Google Sheets compartido por todo el proceso. Se crea en el primer uso (no al
+# importar), con una sola sesión HTTP cuyas conexiones se reutilizan entre hilos
+# (HTTP_CONEXIONES por host), y un hilo renueva el token TOKEN_MARGEN segundos antes de
+# que venza, para que ninguna petición tenga que esperar la renovación.
+# configurar_cliente() permite reemplazarlo, p. ej. por un cliente falso en pruebas.
+HTTP_CONEXIONES = int(os.environ.get("HTTP_CONEXIONES", "16"))
+TOKEN_MARGEN = int(os.environ.get("TOKEN_MARGEN", "300"))
 
-if not creds_json:
-    logging.error("❌ No se encontró la variable de entorno GOOGLE_CREDS")
-    exit()
+_cliente = None
+_credenciales = None
+_cliente_lock = threading.Lock()
+_renovador = None
 
-creds_dict = json.loads(creds_json)
-creds = ServiceAccountCredentials.from_json_keyfile_dict(creds_dict, SCOPE)
+def _crear_cliente():
+    # Lee las credenciales desde una variable de entorno (asegúrate de tener la variable GOOGLE_CREDS configurada)
+    creds_json = os.environ.get("GOOGLE_CREDS")
+    if not creds_json:
+        raise RuntimeError("No se encontró la variable de entorno GOOGLE_CREDS")
+    creds = service_account.Credentials.from_service_account_info(json.loads(creds_json), scopes=SCOPE)
+    sesion = AuthorizedSession(creds)
+    sesion.mount("https://", requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=HTTP_CONEXIONES))
+    return gspread.Client(auth=creds, session=sesion), creds
 
-# Autenticar con Google Sheets
-gc = gspread.authorize(creds)
+def cliente():
+    """
+    Devuelve el cliente de gspread del proceso, creándolo si todavía no existe.
+    """
+    global _cliente, _credenciales
+    if _cliente is not None:
+        return _cliente
+    with _cliente_lock:
+        if _cliente is None:
+            try:
+                _cliente, _credenciales = _crear_cliente()
+            except Exception as e:
+                logging.error(f"❌ No se pudo crear el cliente de Google Sheets: {e}")
+                raise
+            _iniciar_renovacion()
+        return _cliente
 
-def get_client_sheet_url(phone_number):
+def configurar_cliente(nuevo):
+    """
+    Reemplaza el cliente de gspread (p. ej. por uno falso); no se renueva ningún token.
+    """
+    global _cliente, _credenciales
+    with _cliente_lock:
+        _cliente, _credenciales = nuevo, None
+    with _handles_lock:
+        _libros.clear()
+        _worksheets.clear()
+        _hojas.clear()
+
+def _segundos_para_renovar(creds):
+    if not creds.valid or creds.expiry is None:
+        return 0
+    ahora = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+    return (creds.expiry - ahora).total_seconds() - TOKEN_MARGEN
+
+def _renovar_periodicamente():
+    peticion = Request(requests.Session())
+    while True:
+        creds = _credenciales
+        if creds is None:
+            return  # el cliente fue reemplazado por configurar_cliente()
+        espera = _segundos_para_renovar(creds)
+        if espera > 0:
+            time.sleep(espera)
+            continue
+        try:
+            creds.refresh(peticion)
+            logging.info("🔑 Token de Google Sheets renovado")
+        except Exception as e:
+            logging.error(f"❌ Error al renovar el token de Google Sheets: {e}")
+            time.sleep(30)
+
+def _iniciar_renovacion():
+    global _renovador
+    if _renovador is None or not _renovador.is_alive():
+        _renovador = threading.Thread(target=_renovar_periodicamente, daemon=True)
+        _renovador.start()
+
+def precalentar():
+    """
+    Crea el cliente y obtiene el primer token en segundo plano, para que la primera
+    petición del webhook no espere por ellos.
+    """
+    def _crear():
+        try:
+            cliente()
+        except Exception:
+            pass  # ya quedó registrado; se reintenta en el primer uso
+    threading.Thread(target=_crear, daemon=True).start()
+
+# Directorio de clientes en memoria: número → {"nombre": ..., "url": ...}
+# Se carga una sola vez y un hilo en segundo plano lo refresca cada CLIENTES_TTL segundos.
+CLIENTES_TTL = int(os.environ.get("CLIENTES_TTL", "300"))
+
+_directorio = {}
+_directorio_cargado = False
+_directorio_lock = threading.Lock()
+_refresco_directorio = None
+
+def _leer_directorio_clientes():
+    rows = cuota.compartida("Clientes", lambda: cuota.leer(None, lambda: cliente().open("Clientes").sheet1.get_all_records()))
+    logging.info(f"📄 {len(rows)} filas leídas de hoja 'Clientes'")
+    directorio = {}
+    for row in rows:
+        numero = str(row.get("Número", "")).strip()
+        if numero:
+            directorio[numero] = {
+                "nombre": row.get("Nombre", "cliente"),
+                "url": row.get("URL de hoja")
+            }
+    return directorio
+
+def refrescar_directorio_clientes():
     """
-    Busca el número de cliente en la hoja de clientes y devuelve el enlace de su hoja de productos.
+    Vuelve a leer la hoja 'Clientes' y reemplaza el directorio en memoria.
+    Si la lectura falla se conserva el directorio anterior.
     """
+    global _directorio, _directorio_cargado
     try:
-        # Abre la hoja de clientes (asegúrate de que esta hoja exista)
-        clientes_sheet = gc.open("Clientes").sheet1
+        directorio = _leer_directorio_clientes()
     except Exception as e:
-        logging.error(f"❌ Error al abrir hoja 'Clientes': {e}")
+        logging.error(f"❌ Error al leer hoja 'Clientes': {e}")
+        return False
+    _directorio = directorio
+    _directorio_cargado = True
+    return True
+
+def invalidar_directorio_clientes():
+    """
+    Descarta el directorio actual; la siguiente consulta lo vuelve a cargar desde la hoja.
+    """
+    global _directorio_cargado
+    _directorio_cargado = False
+
+def _refrescar_periodicamente():
+    while True:
+        time.sleep(CLIENTES_TTL)
+        refrescar_directorio_clientes()
+
+def _obtener_directorio():
+    global _refresco_directorio
+    if not _directorio_cargado:
+        with _directorio_lock:
+            if not _directorio_cargado:
+                refrescar_directorio_clientes()
+            if _refresco_directorio is None and CLIENTES_TTL > 0:
+                _refresco_directorio = threading.Thread(target=_refrescar_periodicamente, daemon=True)
+                _refresco_directorio.start()
+    return _directorio
+
+def listar_clientes():
+    """
+    Devuelve [(número, {"nombre", "url"})] de todos los clientes del directorio.
+    """
+    return list(_obtener_directorio().items())
+
+def buscar_cliente(phone_number):
+    """
+    Devuelve {"nombre", "url"} del cliente o None si el número no está registrado.
+    """
+    return _obtener_directorio().get(phone_number.strip())
+
+def get_client_sheet_url(phone_number):
+    """
+    Busca el número de cliente en el directorio y devuelve el enlace de su hoja de productos.
+    """
+    cliente = buscar_cliente(phone_number)
+    if not cliente:
+        logging.warning("⚠️ Número no encontrado en la hoja de clientes.")
         return None
+    return cliente["url"]
+
+# Caché LRU de libros y hojas abiertos, para no repetir open_by_url/worksheet en cada mensaje
+HOJAS_CACHE_MAX = int(os.environ.get("HOJAS_CACHE_MAX", "128"))
+# Segundos que se sirven las filas de una hoja desde memoria antes de volver a leerla
+FILAS_TTL = float(os.environ.get("FILAS_TTL", "30"))
+# "sheets": el bot lee y escribe directo en Google Sheets.
+# "sqlite": el bot usa la copia local de espejo.py y un hilo la sincroniza con Google Sheets
+# cada ESPEJO_SYNC_SEGUNDOS; las hojas sin cambios pendientes se vuelven a traer cada
+# ESPEJO_TRAER_SEGUNDOS para recoger ediciones manuales.
+ALMACEN_INVENTARIO = os.environ.get("ALMACEN_INVENTARIO", "sheets")
+ESPEJO_SYNC_SEGUNDOS = float(os.environ.get("ESPEJO_SYNC_SEGUNDOS", "5"))
+ESPEJO_TRAER_SEGUNDOS = float(os.environ.get("ESPEJO_TRAER_SEGUNDOS", "60"))
+_sincronizador = None
+# Columnas que identifican una fila en cada pestaña indexada (None = primera hoja, Productos)
+COLUMNAS_CLAVE = {
+    None: (0,),        # código
+    "Lotes": (0, 2),   # código, ID de lote
+}
+
+# Funciones (url, cambios) que se llaman cuando el bot modifica una pestaña. `cambios` es
+# [(fila anterior o None, fila nueva o None)], o None si no se sabe qué filas cambiaron.
+_observadores = {}  # nombre de pestaña → [funcion]
+
+def observar_hoja(nombre, funcion):
+    _observadores.setdefault(nombre, []).append(funcion)
+
+_libros = OrderedDict()      # url → Spreadsheet
+_worksheets = OrderedDict()  # (url, nombre de pestaña) → Worksheet
+_hojas = OrderedDict()       # (url, nombre de pestaña) → HojaCliente
+_handles_lock = threading.Lock()
 
+def _es_error_de_acceso(e):
+    if isinstance(e, (gspread.exceptions.SpreadsheetNotFound, gspread.exceptions.WorksheetNotFound)):
+        return True
+    return isinstance(e, gspread.exceptions.APIError) and e.code in (403, 404)
+
+def _lru_obtener(cache, clave):
+    with _handles_lock:
+        valor = cache.get(clave)
+        if valor is not None:
+            cache.move_to_end(clave)
+        return valor
+
+def _lru_guardar(cache, clave, valor):
+    with _handles_lock:
+        cache[clave] = valor
+        cache.move_to_end(clave)
+        while len(cache) > HOJAS_CACHE_MAX:
+            cache.popitem(last=False)
+
+def descartar_libro(url):
+    """
+    Olvida el libro y todas sus hojas en caché; se reabren en el siguiente acceso.
+    """
+    with _handles_lock:
+        _libros.pop(url, None)
+        for cache in (_worksheets, _hojas):
+            for clave in [c for c in cache if c[0] == url]:
+                del cache[clave]
+
+# Las escrituras de un mismo cliente se serializan: cada libro usa siempre uno de estos candados
+CANDADOS_ESCRITURA = int(os.environ.get("CANDADOS_ESCRITURA", "64"))
+_candados_escritura = [threading.Lock() for _ in range(CANDADOS_ESCRITURA)]
+
+@contextmanager
+def bloqueo_escritura(url):
+    """
+    Bloquea las escrituras del cliente dueño del libro `url` dentro de este proceso.
+    Cuenta en metricas las veces que hubo que esperar y cuánto se esperó.
+    """
+    candado = _candados_escritura[zlib.crc32(url.encode()) % len(_candados_escritura)]
+    if not candado.acquire(blocking=False):
+        metricas.incrementar("escritura.contencion")
+        inicio = time.perf_counter()
+        candado.acquire()
+        metricas.observar("escritura.espera", time.perf_counter() - inicio)
     try:
-        # Obtén todas las filas de la hoja 'Clientes'
-        rows = clientes_sheet.get_all_records()
-        logging.info(f"📄 {len(rows)} filas leídas de hoja 'Clientes'")
-    except Exception as e:
-        logging.error(f"❌ Error al leer filas: {e}")
-        return None
+        yield
+    finally:
+        candado.release()
 
-    # Busca el cliente por número
-    for row in rows:
-        numero_hoja = str(row.get("Número", "")).strip()
-        if numero_hoja == phone_number.strip():
-            logging.info(f"✅ Cliente encontrado: {row.get('Nombre')}")
+# Métodos de Worksheet que escriben (solo se reintentan por 429) y lecturas que se comparten
+# entre llamadas simultáneas iguales, salvo las de releer() y recargar(); ver cuota.py
+_ESCRITURAS = {"append_row", "append_rows", "update_cell", "update", "delete_rows", "insert_row", "batch_update", "clear"}
+_LECTURAS_COMPARTIDAS = {"get_all_values", "get_all_records"}
+
+def _sin_vacias_al_final(fila):
+    # row_values() omite las celdas vacías del final; get_all_values() las rellena
+    fila = ["" if v is None else str(v) for v in fila]
+    while fila and fila[-1] == "":
+        fila.pop()
+    return fila
+
+def _fila_de_rango(rango):
+    # "'Lotes'!A5:H5" → 5
+    m = re.search(r"![A-Z]+(\d+)", rango or "")
+    return int(m.group(1)) if m else None
+
+class HojaCliente:
+    """
+    Envoltura de un Worksheet en caché. Reenvía todas las llamadas al Worksheet y,
+    si alguna falla por hoja inexistente o sin permisos, descarta el handle del libro.
+
+    Además guarda las filas de la hoja en memoria: get_all_values() solo lee la hoja
+    cuando pasaron más de FILAS_TTL segundos, y append_row/update_cell/delete_rows
+    escriben en la hoja y actualizan la copia en memoria.
+
+    Para las pestañas de COLUMNAS_CLAVE mantiene también un índice clave → número de
+    fila, de modo que buscar() y filas_de() no recorren la hoja, y una lista ordenada
+    de códigos para las búsquedas por prefijo de buscar_prefijo().
+    """
+    def __init__(self, url, nombre, worksheet):
+        self.url = url
+        self.nombre = nombre
+        self.worksheet = worksheet
+        self.columnas_clave = COLUMNAS_CLAVE.get(nombre)
+        self._filas = None
+        self._leido_en = 0.0
+        self._indice = None  # clave → número de fila (primera aparición)
+        self._grupos = None  # código → [números de fila]
+        self._codigos = None  # [(código en mayúsculas, código)] ordenada, una entrada por fila
+        self._lock = threading.RLock()
+
+    def _llamar(self, metodo, *args, compartir=True, **kwargs):
+        funcion = getattr(self.worksheet, metodo)
+        try:
+            if isinstance(self.worksheet, espejo.HojaEspejo):
+                return funcion(*args, **kwargs)
+            if metodo in _ESCRITURAS:
+                return cuota.escribir(self.url, funcion, *args, **kwargs)
+            if compartir and metodo in _LECTURAS_COMPARTIDAS:
+                clave = (self.url, self.nombre, metodo, args, tuple(sorted(kwargs.items())))
+                return cuota.compartida(clave, lambda: cuota.leer(self.url, funcion, *args, **kwargs))
+            return cuota.leer(self.url, funcion, *args, **kwargs)
+        except Exception as e:
+            if _es_error_de_acceso(e):
+                descartar_libro(self.url)
+            raise
+
+    def __getattr__(self, attr):
+        valor = getattr(self.worksheet, attr)
+        if not callable(valor):
+            return valor
+        return lambda *args, **kwargs: self._llamar(attr, *args, **kwargs)
+
+    def invalidar(self):
+        """
+        Descarta las filas en memoria; la siguiente lectura vuelve a la hoja.
+        """
+        with self._lock:
+            self._descartar_filas()
+
+    def _descartar_filas(self):
+        self._filas = None
+        self._codigos = None
+        self._descartar_indice()
+
+    def _descartar_indice(self):
+        self._indice = None
+        self._grupos = None
+
+    def _vigente(self):
+        return self._filas is not None and time.monotonic() - self._leido_en <= FILAS_TTL
+
+    def _cargar_filas(self):
+        if not self._vigente():
+            self._filas = self._llamar("get_all_values")
+            self._leido_en = time.monotonic()
+            self._codigos = None
+            self._descartar_indice()
+        return self._filas
+
+    def recargar(self):
+        """
+        Vuelve a leer toda la hoja con una sola llamada y reemplaza la copia en memoria.
+        Se usa dentro de bloqueo_escritura antes de escribir varias filas: después,
+        buscar() y filas_de() dan las filas actuales aunque se hayan insertado, borrado
+        o editado filas a mano. Si la copia anterior no coincidía, cuenta un conflicto.
+        """
+        filas = self._llamar("get_all_values", compartir=False)
+        with self._lock:
+            anterior = self._filas
+            self._filas = filas
+            self._leido_en = time.monotonic()
+            self._codigos = None
+            self._descartar_indice()
+        if anterior is not None and list(map(_sin_vacias_al_final, anterior)) != list(map(_sin_vacias_al_final, filas)):
+            metricas.incrementar("escritura.conflictos")
+            logging.warning(f"⚠️ La hoja {self.nombre or 'Productos'} cambió fuera del bot; se volvió a leer")
+
+    def get_all_values(self):
+        with self._lock:
+            # Las filas en caché no se modifican en sitio, basta con copiar la lista
+            return list(self._cargar_filas())
+
+    def _clave(self, fila):
+        if len(fila) <= max(self.columnas_clave):
+            return None
+        if len(self.columnas_clave) == 1:
+            return fila[self.columnas_clave[0]]
+        return tuple(fila[c] for c in self.columnas_clave)
+
+    def _indexar(self, numero, fila):
+        clave = self._clave(fila)
+        if clave is None:
+            return
+        self._indice.setdefault(clave, numero)
+        self._grupos.setdefault(fila[0], []).append(numero)
+
+    def _cargar_indice(self):
+        filas = self._cargar_filas()
+        if self._indice is None:
+            self._indice = {}
+            self._grupos = {}
+            for numero, fila in enumerate(filas[1:], start=2):
+                self._indexar(numero, fila)
+        return self._indice
+
+    def buscar(self, *clave):
+        """
+        Devuelve (número de fila, fila) para la clave dada o None si no existe.
+        En Productos la clave es el código; en Lotes, el código y el ID del lote.
+        """
+        clave = clave[0] if len(clave) == 1 else clave
+        with self._lock:
+            numero = self._cargar_indice().get(clave)
+            if numero is None:
+                return None
+            return numero, self._filas[numero - 1]
+
+    def filas_de(self, codigo):
+        """
+        Devuelve [(número de fila, fila)] de todas las filas cuyo código es `codigo`,
+        en el orden de la hoja.
+        """
+        with self._lock:
+            self._cargar_indice()
+            return [(numero, self._filas[numero - 1]) for numero in self._grupos.get(codigo, [])]
+
+    def _cargar_codigos(self):
+        filas = self._cargar_filas()
+        if self._codigos is None:
+            self._codigos = sorted((f[0].upper(), f[0]) for f in filas[1:] if f and f[0])
+        return self._codigos
+
+    def buscar_prefijo(self, prefijo, limite=None):
+        """
+        Devuelve (total, [(número de fila, fila)]) de las filas cuyo código empieza por
+        `prefijo` (sin distinguir mayúsculas), ordenadas por código. Con `limite` solo se
+        devuelven las primeras `limite` filas, pero `total` cuenta todas las coincidencias.
+        """
+        prefijo = prefijo.upper()
+        with self._lock:
+            codigos = self._cargar_codigos()
+            self._cargar_indice()
+            inicio = bisect_left(codigos, (prefijo,))
+            fin = bisect_left(codigos, (prefijo + "\U0010ffff",))
+            resultados = []
+            i = inicio
+            while i < fin and (limite is None or len(resultados) < limite):
+                codigo = codigos[i][1]
+                numeros = self._grupos.get(codigo, [])
+                resultados.extend((n, self._filas[n - 1]) for n in numeros)
+                i += max(len(numeros), 1)
+            if limite is not None:
+                resultados = resultados[:limite]
+            return fin - inicio, resultados
+
+    def _normalizar(self, valores):
+        fila = ["" if v is None else str(v) for v in valores]
+        ancho = len(self._filas[0]) if self._filas else 0
+        return fila + [""] * (ancho - len(fila))
+
+    def releer(self, *clave):
+        """
+        Lee directo de la hoja, sin la copia en memoria, la fila del registro `clave`
+        (como en buscar) y devuelve (número de fila, fila) o None si ya no existe. Si en
+        esa posición hay otro registro o algún valor cambió (p. ej. se insertó una fila o
+        se editó a mano), vuelve a leer la hoja con recargar() y ubica otra vez el registro.
+        """
+        encontrado = self.buscar(*clave)
+        if encontrado is not None:
+            numero, anterior = encontrado
+            actual = self._llamar("row_values", numero, compartir=False)
+            if _sin_vacias_al_final(actual) == _sin_vacias_al_final(anterior):
+                return encontrado
+            logging.warning(f"⚠️ La fila {numero} de {self.nombre or 'Productos'} cambió: {anterior} → {actual}")
+        self.recargar()
+        return self.buscar(*clave)
+
+    def _notificar(self, cambios):
+        for funcion in _observadores.get(self.nombre, ()):
             try:
-                # Obtener URL de la hoja de productos
-                url = row.get("URL de hoja")
-                return url
+                funcion(self.url, cambios)
             except Exception as e:
-                logging.error(f"❌ Error al obtener URL de la hoja del cliente: {e}")
-                return None
+                logging.error(f"❌ Error al notificar cambios de la hoja: {e}")
+
+    # Actualización de la copia en memoria tras una escritura confirmada por la API.
+    # También las usa EscrituraAgrupada después de enviar su batch_update.
+    def _parchear_agregar(self, valores, fila_api=None):
+        with self._lock:
+            if self._filas is None:
+                pass
+            elif fila_api is not None and fila_api != len(self._filas) + 1:
+                # La API insertó la fila en otra posición (p. ej. filas vacías intermedias)
+                self._descartar_filas()
+            else:
+                fila = self._normalizar(valores)
+                self._filas.append(fila)
+                if self._indice is not None:
+                    self._indexar(len(self._filas), fila)
+                if self._codigos is not None and fila and fila[0]:
+                    insort(self._codigos, (fila[0].upper(), fila[0]))
+        self._notificar([(None, ["" if v is None else str(v) for v in valores])])
+
+    def _parchear_celda(self, row, col, value):
+        cambios = None  # sin la fila anterior en memoria no se sabe qué cambió
+        with self._lock:
+            if self._filas is not None and row > len(self._filas):
+                self._descartar_filas()
+            elif self._filas is not None:
+                anterior = self._filas[row - 1]
+                fila = list(anterior)
+                fila += [""] * (col - len(fila))
+                fila[col - 1] = "" if value is None else str(value)
+                self._filas[row - 1] = fila
+                cambios = [(anterior, fila)]
+                if self.columnas_clave and col - 1 in self.columnas_clave:
+                    self._codigos = None
+                    self._descartar_indice()
+        self._notificar(cambios)
+
+    def _parchear_borrado(self, start_index, end_index=None):
+        borradas = None
+        with self._lock:
+            if self._filas is not None:
+                borradas = self._filas[start_index - 1:end_index or start_index]
+                del self._filas[start_index - 1:end_index or start_index]
+                if self._codigos is not None:
+                    for fila in borradas:
+                        if fila and fila[0]:
+                            i = bisect_left(self._codigos, (fila[0].upper(), fila[0]))
+                            if i < len(self._codigos) and self._codigos[i][1] == fila[0]:
+                                del self._codigos[i]
+                # Las filas siguientes cambian de número; el índice se rehace en la próxima búsqueda
+                self._descartar_indice()
+        self._notificar(None if borradas is None else [(fila, None) for fila in borradas])
+
+    def append_row(self, values, **kwargs):
+        respuesta = self._llamar("append_row", values, **kwargs)
+        rango = respuesta.get("updates", {}).get("updatedRange") if isinstance(respuesta, dict) else None
+        fila_api = _fila_de_rango(rango)
+        if fila_api is None:
+            self.invalidar()
+            self._notificar([(None, ["" if v is None else str(v) for v in values])])
+        else:
+            self._parchear_agregar(values, fila_api)
+        return respuesta
+
+    def update_cell(self, row, col, value):
+        respuesta = self._llamar("update_cell", row, col, value)
+        self._parchear_celda(row, col, value)
+        return respuesta
+
+    def delete_rows(self, start_index, end_index=None):
+        respuesta = self._llamar("delete_rows", start_index, end_index)
+        self._parchear_borrado(start_index, end_index)
+        return respuesta
+
+def _valor_celda(valor):
+    # Imita value_input_option="USER_ENTERED" de update_cell para números y fórmulas
+    texto = "" if valor is None else str(valor)
+    if texto.startswith("="):
+        return {"formulaValue": texto}
+    try:
+        return {"numberValue": float(texto)} if texto.strip() else {"stringValue": texto}
+    except ValueError:
+        return {"stringValue": texto}
+
+def _solicitud_celda(sheet_id, row, col, value):
+    return {"updateCells": {
+        "start": {"sheetId": sheet_id, "rowIndex": row - 1, "columnIndex": col - 1},
+        "rows": [{"values": [{"userEnteredValue": _valor_celda(value)}]}],
+        "fields": "userEnteredValue"
+    }}
+
+def _solicitud_agregar(sheet_id, filas):
+    # Igual que append_row con value_input_option="RAW": los valores se guardan como texto
+    return {"appendCells": {"sheetId": sheet_id, "fields": "userEnteredValue", "rows": [
+        {"values": [{"userEnteredValue": {"stringValue": "" if v is None else str(v)}} for v in valores]}
+        for valores in filas
+    ]}}
+
+def _solicitud_borrar(sheet_id, inicio, fin):
+    return {"deleteDimension": {"range": {
+        "sheetId": sheet_id, "dimension": "ROWS", "startIndex": inicio - 1, "endIndex": fin
+    }}}
+
+class EscrituraAgrupada:
+    """
+    Unidad de trabajo para un libro de cliente: acumula update_cell, append_row y
+    delete_rows de una misma operación lógica y los envía juntos en un único
+    batch_update al confirmar. Los números de fila se interpretan como estaban antes
+    de la operación; las filas agregadas van al final de cada hoja.
+
+        with EscrituraAgrupada(url) as escritura:
+            escritura.update_cell(hoja, fila, 6, nuevo_stock)
+            escritura.append_row(hoja_lotes, nuevo_lote)
+    """
+    def __init__(self, url):
+        self.url = url
+        self.actualizaciones = []  # (hoja, fila, columna, valor)
+        self.agregados = []        # (hoja, valores)
+        self.borrados = []         # (hoja, fila inicial, fila final)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, tipo, valor, traza):
+        if tipo is None:
+            self.confirmar()
+        return False
+
+    def update_cell(self, hoja, row, col, value):
+        self.actualizaciones.append((hoja, row, col, value))
+
+    def append_row(self, hoja, values):
+        self.agregados.append((hoja, list(values)))
+
+    def delete_rows(self, hoja, start_index, end_index=None):
+        self.borrados.append((hoja, start_index, end_index or start_index))
+
+    def _solicitudes(self):
+        solicitudes = [_solicitud_celda(hoja.id, row, col, value) for hoja, row, col, value in self.actualizaciones]
+
+        filas_por_hoja = OrderedDict()
+        for hoja, valores in self.agregados:
+            filas_por_hoja.setdefault(hoja.id, []).append(valores)
+        for sheet_id, filas in filas_por_hoja.items():
+            solicitudes.append(_solicitud_agregar(sheet_id, filas))
+
+        for hoja, inicio, fin in self._rangos_borrados():
+            solicitudes.append(_solicitud_borrar(hoja.id, inicio, fin))
+        return solicitudes
+
+    def _operaciones(self):
+        # Las mismas operaciones, en el mismo orden, para la copia local de espejo.py
+        operaciones = [(hoja.nombre, "update_cell", (row, col, value)) for hoja, row, col, value in self.actualizaciones]
+        operaciones += [(hoja.nombre, "append_row", (valores,)) for hoja, valores in self.agregados]
+        operaciones += [(hoja.nombre, "delete_rows", (inicio, fin)) for hoja, inicio, fin in self._rangos_borrados()]
+        return operaciones
+
+    def _rangos_borrados(self):
+        # Rangos de abajo hacia arriba, uniendo los contiguos o solapados de una misma hoja
+        rangos = []
+        for hoja, inicio, fin in sorted(self.borrados, key=lambda b: (b[0].nombre or "", -b[1])):
+            if rangos and rangos[-1][0] is hoja and fin + 1 >= rangos[-1][1]:
+                rangos[-1][1] = inicio
+                rangos[-1][2] = max(rangos[-1][2], fin)
+            else:
+                rangos.append([hoja, inicio, fin])
+        return rangos
+
+    def confirmar(self):
+        """
+        Envía todas las operaciones pendientes en un solo batch_update (o en una sola
+        transacción de la copia local con ALMACEN_INVENTARIO=sqlite) y actualiza las
+        filas en memoria de cada hoja.
+        """
+        if not (self.actualizaciones or self.agregados or self.borrados):
+            return
+        if ALMACEN_INVENTARIO == "sqlite":
+            for hoja in {id(h): h for h, *_ in self.actualizaciones + self.agregados + self.borrados}.values():
+                hoja.worksheet.asegurar_cargada()
+            espejo.aplicar(self.url, self._operaciones())
+        else:
+            try:
+                cuota.escribir(self.url, abrir_libro(self.url).batch_update, {"requests": self._solicitudes()})
+            except Exception as e:
+                if _es_error_de_acceso(e):
+                    descartar_libro(self.url)
+                raise
+
+        for hoja, row, col, value in self.actualizaciones:
+            hoja._parchear_celda(row, col, value)
+        for hoja, valores in self.agregados:
+            hoja._parchear_agregar(valores)
+        for hoja, inicio, fin in self._rangos_borrados():
+            hoja._parchear_borrado(inicio, fin)
+        self.actualizaciones, self.agregados, self.borrados = [], [], []
+
+def abrir_libro(url):
+    libro = _lru_obtener(_libros, url)
+    if libro is None:
+        libro = cuota.compartida(("libro", url), lambda: cuota.leer(url, cliente().open_by_url, url))
+        _lru_guardar(_libros, url, libro)
+    return libro
+
+def _worksheet_remoto(url, nombre):
+    clave = (url, nombre)
+    worksheet = _lru_obtener(_worksheets, clave)
+    if worksheet is None:
+        try:
+            libro = abrir_libro(url)
+            worksheet = cuota.compartida(("pestaña", url, nombre), lambda: cuota.leer(
+                url, lambda: libro.sheet1 if nombre is None else libro.worksheet(nombre)
+            ))
+        except Exception as e:
+            if _es_error_de_acceso(e):
+                descartar_libro(url)
+            raise
+        _lru_guardar(_worksheets, clave, worksheet)
+    return worksheet
+
+def abrir_hoja(url, nombre=None):
+    """
+    Devuelve la pestaña `nombre` del libro en `url` (la primera si nombre es None),
+    reutilizando el handle en caché cuando existe.
+    """
+    clave = (url, nombre)
+    hoja = _lru_obtener(_hojas, clave)
+    if hoja is None:
+        if ALMACEN_INVENTARIO == "sqlite":
+            _iniciar_sincronizacion()
+            worksheet = espejo.HojaEspejo(url, nombre, lambda: _leer_remoto(url, nombre))
+        else:
+            worksheet = _worksheet_remoto(url, nombre)
+        hoja = HojaCliente(url, nombre, worksheet)
+        _lru_guardar(_hojas, clave, hoja)
+    return hoja
+
+def _leer_remoto(url, nombre):
+    worksheet = _worksheet_remoto(url, nombre)
+    return cuota.compartida(
+        (url, nombre, "get_all_values", (), ()), lambda: cuota.leer(url, worksheet.get_all_values)
+    )
+
+def enviar_pendientes(url, limite=500):
+    """
+    Envía a Google Sheets, en un solo batch_update, los cambios de la copia local del
+    libro que aún no se enviaron. Devuelve cuántas operaciones se enviaron.
+    """
+    operaciones = espejo.pendientes(url)[:limite]
+    if not operaciones:
+        return 0
+    solicitudes = []
+    for _, nombre, operacion, args in operaciones:
+        sheet_id = _worksheet_remoto(url, nombre).id
+        if operacion == "update_cell":
+            solicitudes.append(_solicitud_celda(sheet_id, *args))
+        elif operacion == "append_row":
+            solicitudes.append(_solicitud_agregar(sheet_id, args))
+        else:
+            solicitudes.append(_solicitud_borrar(sheet_id, *args))
+    try:
+        cuota.escribir(url, abrir_libro(url).batch_update, {"requests": solicitudes})
+    except Exception as e:
+        if _es_error_de_acceso(e):
+            descartar_libro(url)
+        raise
+    espejo.marcar_enviados(url, operaciones[-1][0])
+    return len(operaciones)
+
+def traer_cambios(url, nombre):
+    """
+    Vuelve a leer la hoja de Google Sheets y reemplaza la copia local si no hay cambios
+    locales pendientes, para recoger ediciones hechas a mano en la hoja.
+    """
+    version = espejo.version(url, nombre)
+    filas = _leer_remoto(url, nombre)
+    if espejo.reemplazar_filas(url, nombre, filas, version):
+        hoja = _lru_obtener(_hojas, (url, nombre))
+        if hoja is not None:
+            hoja.invalidar()
+        return True
+    return False
 
-    logging.warning("⚠️ Número no encontrado en la hoja de clientes.")
-    return None
+def sincronizar_espejo():
+    for url in espejo.urls_con_pendientes():
+        try:
+            enviados = enviar_pendientes(url)
+            logging.info(f"🔄 {enviados} cambios enviados a {url}")
+        except Exception as e:
+            logging.error(f"❌ Error al enviar cambios a la hoja: {e}")
+    for url, nombre in espejo.hojas_para_traer(ESPEJO_TRAER_SEGUNDOS):
+        try:
+            traer_cambios(url, nombre)
+        except Exception as e:
+            logging.error(f"❌ Error al traer cambios de la hoja: {e}")
+
+def _sincronizar_periodicamente():
+    while True:
+        time.sleep(ESPEJO_SYNC_SEGUNDOS)
+        sincronizar_espejo()
+
+def _iniciar_sincronizacion():
+    global _sincronizador
+    if _sincronizador is None:
+        with _handles_lock:
+            if _sincronizador is None:
+                _sincronizador = threading.Thread(target=_sincronizar_periodicamente, daemon=True)
+                _sincronizador.start()
 
 def get_inventory_sheet_for_number(phone_number):
     """
@@ -65,9 +808,7 @@ def get_inventory_sheet_for_number(phone_number):
     url = get_client_sheet_url(phone_number)
     if url:
         try:
-            # Abre la hoja del cliente a partir de la URL
-            cliente_sheet = gc.open_by_url(url)
-            return cliente_sheet.sheet1  # Devuelve la primera hoja de la URL
+            return abrir_hoja(url)  # Devuelve la primera hoja de la URL
         except Exception as e:
             logging.error(f"❌ Error al abrir la hoja del cliente: {e}")
             return None
@@ -81,8 +822,7 @@ def get_lotes_sheet_for_number(phone_number):
     url = get_client_sheet_url(phone_number)
     if url:
         try:
-            libro = gc.open_by_url(url)
-            return libro.worksheet("Lotes")  # Accede a la hoja 'Lotes'
+            return abrir_hoja(url, "Lotes")  # Accede a la hoja 'Lotes'
         except Exception as e:
             logging.error(f"❌ Error al acceder a la hoja 'Lotes': {e}")
             return None
@@ -90,65 +830,105 @@ def get_lotes_sheet_for_number(phone_number):
         logging.error("❌ No se encontró la URL de hoja del cliente.")
         return None
 
+def _producto_de_fila(row):
+    return {
+        "codigo": row[0],
+        "nombre": row[1],
+        "marca": row[2],
+        "precio": row[3],
+        "cantidad": row[4],
+        "stock_minimo": row[5],
+        "lugar": row[6]
+    }
+
 def obtener_productos(hoja):
     try:
         data = hoja.get_all_values()[1:]  # Ignora la fila de encabezado
-        productos = []
-        for row in data:
-            if len(row) >= 7:
-                producto = {
-                    "codigo": row[0],
-                    "nombre": row[1],
-                    "marca": row[2],
-                    "precio": row[3],
-                    "cantidad": row[4],
-                    "stock_minimo": row[5],
-                    "lugar": row[6]
-                }
-                productos.append(producto)
-        return productos
+        return [_producto_de_fila(row) for row in data if len(row) >= 7]
     except Exception as e:
         logging.error(f"❌ Error al leer los datos de la hoja del cliente: {e}")
         return None
 
-def get_client_name(phone_number):
+def buscar_productos_por_prefijo(hoja, prefijo, limite=None):
+    """
+    Devuelve (total de coincidencias, productos) para los códigos que empiezan por `prefijo`,
+    como máximo `limite` productos ordenados por código.
+    """
     try:
-        clientes_sheet = gc.open("Clientes").sheet1
-        rows = clientes_sheet.get_all_records()
-        for row in rows:
-            if str(row.get("Número", "")).strip() == phone_number:
-                return row.get("Nombre", "cliente")
+        total, filas = hoja.buscar_prefijo(prefijo, limite)
+        return total, [_producto_de_fila(row) for _, row in filas if len(row) >= 7]
     except Exception as e:
-        logging.error(f"❌ Error al obtener nombre del cliente: {e}")
+        logging.error(f"❌ Error al leer los datos de la hoja del cliente: {e}")
+        return 0, None
+
+def generar_codigo_producto(hoja, prefijo):
+    """
+    Devuelve el siguiente código libre para `prefijo` (categoría + marca + empaque),
+    p. ej. 1AU07. El correlativo se reserva de forma atómica en el contador del cliente.
+    """
+    return generar_codigos_producto(hoja, prefijo, 1)[0]
+
+def generar_codigos_producto(hoja, prefijo, cantidad):
+    """
+    Devuelve `cantidad` códigos libres seguidos para `prefijo`, reservados de una vez.
+    """
+    def semilla():
+        _, filas = hoja.buscar_prefijo(prefijo)
+        sufijos = [int(row[0][len(prefijo):]) for _, row in filas if row[0][len(prefijo):].isdigit()]
+        return max(sufijos, default=0)
+
+    numeros = contadores.asignar_varios(
+        hoja.url, f"codigo:{prefijo}", cantidad, semilla,
+        ocupado=lambda n: hoja.buscar(f"{prefijo}{str(n).zfill(2)}") is not None
+    )
+    return [f"{prefijo}{str(numero).zfill(2)}" for numero in numeros]
+
+def generar_id_lote(hoja_lotes, codigo):
+    """
+    Devuelve el siguiente ID de lote para el producto `codigo`.
+    """
+    def semilla():
+        lotes = hoja_lotes.filas_de(codigo)
+        ids = [int(row[2]) for _, row in lotes if row[2].isdigit()]
+        return max(max(ids, default=0), len(lotes))
+
+    numero = contadores.asignar(
+        hoja_lotes.url, f"lote:{codigo}", semilla,
+        ocupado=lambda n: hoja_lotes.buscar(codigo, str(n)) is not None
+    )
+    return str(numero)
+
+def get_client_name(phone_number):
+    cliente = buscar_cliente(phone_number)
+    if cliente:
+        return cliente["nombre"]
     return "cliente"
 
 def get_historial_sheet_for_number(phone_number):
     """
     Devuelve la hoja 'Historial de movimientos' del cliente basado en su número telefónico.
     """
-    try:
-        clientes_sheet = gc.open("Clientes").sheet1
-        rows = clientes_sheet.get_all_records()
-        for row in rows:
-            if str(row.get("Número", "")).strip() == phone_number:
-                url = row.get("URL de hoja")
-                if url:
-                    libro = gc.open_by_url(url)
-                    return libro.worksheet("Historial de movimientos")
+    url = get_client_sheet_url(phone_number)
+    if not url:
         logging.warning("⚠️ No se encontró hoja de historial para este número.")
         return None
+    try:
+        return abrir_hoja(url, "Historial de movimientos")
     except Exception as e:
         logging.error(f"❌ Error al acceder a hoja de historial: {e}")
         return None
-        
-def registrar_movimiento(phone_number, tipo, codigo, nombre, cantidad, stock_final, fecha=None, precio="", costo=""):
+
+def registrar_movimiento(phone_number, tipo, codigo, nombre, cantidad, stock_final, fecha=None, precio="", costo="", escritura=None):
+    """
+    Agrega una fila al historial del cliente. Si se pasa `escritura` (EscrituraAgrupada),
+    la fila se envía junto con el resto de la operación al confirmarla.
+    """
     try:
         sheet_url = get_client_sheet_url(phone_number)
         if not sheet_url:
             return
 
-        book = gc.open_by_url(sheet_url)
-        hoja_historial = book.worksheet("Historial de movimientos")
+        hoja_historial = abrir_hoja(sheet_url, "Historial de movimientos")
 
         if not fecha:
             fecha = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
@@ -163,7 +943,10 @@ def registrar_movimiento(phone_number, tipo, codigo, nombre, cantidad, stock_fin
             str(precio),
             str(costo)
         ]
-        hoja_historial.append_row(nuevo_registro)
+        if escritura:
+            escritura.append_row(hoja_historial, nuevo_registro)
+        else:
+            hoja_historial.append_row(nuevo_registro)
     except Exception as e:
         logging.error(f"❌ Error al registrar movimiento: {e}")
         return
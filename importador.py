@@ -0,0 +1,265 @@
+import os
+import sys
+import csv
+import time
+import logging
+import tempfile
+import threading
+import unicodedata
+from itertools import islice
+from urllib.parse import urlparse
+import requests
+from twilio.request_validator import RequestValidator
+import google_sheets
+from google_sheets import EscrituraAgrupada, bloqueo_escritura, generar_codigos_producto
+from mensajeria import enviar_mensaje
+
+try:
+    from openpyxl import load_workbook
+except ImportError:  # solo hace falta para archivos .xlsx
+    load_workbook = None
+
+# Importación masiva del catálogo de productos desde un CSV o un Excel (.xlsx), por
+# línea de comandos o enviando el archivo por WhatsApp:
+#
+#     python importador.py <url de la hoja> <archivo.csv|archivo.xlsx>
+#
+# El archivo se lee fila por fila sin cargarlo entero; cada IMPORTACION_LOTE filas se
+# reservan los códigos de una vez (mismo esquema categoría + marca + empaque que el bot)
+# y se agregan a Productos en un solo batch_update.
+IMPORTACION_LOTE = int(os.environ.get("IMPORTACION_LOTE", "1000"))
+IMPORTACION_MAX_ERRORES = 10  # errores que se detallan en el resumen
+
+TIPOS_CSV = {"text/csv", "text/comma-separated-values", "application/csv", "text/plain"}
+TIPO_XLSX = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+FORMATO_IMPORTACION = (
+    "📎 Envía un archivo CSV o Excel (.xlsx) con estas columnas en la primera fila:\n"
+    "```Artículo, Marca, Precio, Stock Mínimo, Ubicación, Categoría, Empaque```\n"
+    "Categoría: A-D (perecibles) o E-H (no perecibles), como en el menú de agregar producto."
+)
+
+# Categorías del menú de agregar producto (letra o nombre → dígito del código)
+CATEGORIAS = {
+    "a": "1", "b": "2", "c": "3", "d": "4",  # Perecibles
+    "e": "5", "f": "6", "g": "7", "h": "8",  # No perecibles
+    "comestibles": "1", "medicamentos": "2", "higiene personal": "3", "limpieza": "4",
+    "herramientas": "5", "papeleria": "6", "electronicos": "7", "ropa": "8",
+}
+CATEGORIAS.update({digito: digito for digito in "12345678"})
+
+# Nombres aceptados para cada columna (sin tildes ni mayúsculas)
+COLUMNAS = {
+    "nombre": ("articulo", "nombre", "producto"),
+    "marca": ("marca",),
+    "precio": ("precio",),
+    "stock_minimo": ("stock minimo", "stock_minimo", "minimo"),
+    "lugar": ("ubicacion", "ubicacion referencial", "lugar"),
+    "categoria": ("categoria",),
+    "empaque": ("empaque", "tipo de empaque"),
+}
+OBLIGATORIAS = ("nombre", "marca", "precio", "stock_minimo", "categoria", "empaque")
+
+def _normalizar(texto):
+    texto = unicodedata.normalize("NFKD", str(texto or "").strip().lower())
+    return "".join(c for c in texto if not unicodedata.combining(c))
+
+def _filas_csv(ruta):
+    with open(ruta, "rb") as archivo:
+        muestra = archivo.read(65536)
+    try:
+        muestra.decode("utf-8")
+        codificacion = "utf-8-sig"
+    except UnicodeDecodeError:
+        codificacion = "cp1252"  # CSV guardado desde Excel en Windows
+    with open(ruta, newline="", encoding=codificacion) as archivo:
+        try:
+            dialecto = csv.Sniffer().sniff(archivo.read(8192), delimiters=",;\t")
+        except csv.Error:
+            dialecto = csv.excel
+        archivo.seek(0)
+        yield from csv.reader(archivo, dialecto)
+
+def _filas_xlsx(ruta):
+    if load_workbook is None:
+        raise ValueError("Para importar archivos Excel hace falta instalar openpyxl")
+    libro = load_workbook(ruta, read_only=True, data_only=True)
+    try:
+        for fila in libro.worksheets[0].iter_rows(values_only=True):
+            yield ["" if valor is None else str(valor) for valor in fila]
+    finally:
+        libro.close()
+
+def leer_filas(ruta):
+    """
+    Recorre las filas del archivo (CSV o .xlsx según la extensión) como listas de texto.
+    """
+    if ruta.lower().endswith((".xlsx", ".xlsm")):
+        return _filas_xlsx(ruta)
+    return _filas_csv(ruta)
+
+def _mapear_columnas(encabezado):
+    nombres = [_normalizar(c) for c in encabezado]
+    posiciones = {}
+    for campo, alias in COLUMNAS.items():
+        for i, nombre in enumerate(nombres):
+            if nombre in alias:
+                posiciones[campo] = i
+                break
+    faltan = [campo for campo in OBLIGATORIAS if campo not in posiciones]
+    if faltan:
+        raise ValueError(f"Faltan columnas en el encabezado: {', '.join(faltan)}")
+    return posiciones
+
+def _leer_producto(fila, posiciones):
+    # Devuelve (prefijo del código, fila sin código) o (None, motivo del error)
+    datos = {campo: fila[i].strip() if i < len(fila) else "" for campo, i in posiciones.items()}
+    if not datos["nombre"] or not datos["marca"] or not datos["empaque"]:
+        return None, "faltan artículo, marca o empaque"
+    categoria = CATEGORIAS.get(_normalizar(datos["categoria"]))
+    if not categoria:
+        return None, f"categoría '{datos['categoria']}' no válida"
+    try:
+        float(datos["precio"])
+    except ValueError:
+        return None, "precio no válido"
+    stock_minimo = datos["stock_minimo"].removesuffix(".0")  # Excel guarda los enteros como 5.0
+    if not stock_minimo.isdigit():
+        return None, "stock mínimo no válido"
+    prefijo = f"{categoria}{datos['marca'][0].upper()}{datos['empaque'][0].upper()}"
+    return prefijo, [datos["nombre"], datos["marca"], datos["precio"], "0", stock_minimo, datos.get("lugar", "")]
+
+def _agregar_lote(url, hoja, productos):
+    # productos: [(prefijo, fila sin código)] → se agregan con códigos nuevos, en orden
+    cantidades = {}
+    for prefijo, _ in productos:
+        cantidades[prefijo] = cantidades.get(prefijo, 0) + 1
+    codigos = {prefijo: iter(generar_codigos_producto(hoja, prefijo, n)) for prefijo, n in cantidades.items()}
+    with bloqueo_escritura(url):
+        with EscrituraAgrupada(url) as escritura:
+            for prefijo, fila in productos:
+                escritura.append_row(hoja, [next(codigos[prefijo])] + fila)
+
+def importar(url, filas):
+    """
+    Importa a la hoja Productos del libro `url` los productos de `filas` (la primera es
+    el encabezado). Devuelve {"leidas", "importadas", "errores": [(línea, motivo)],
+    "segundos", "por_segundo"}.
+    """
+    inicio = time.perf_counter()
+    resultado = {"leidas": 0, "importadas": 0, "errores": []}
+    filas = iter(filas)
+    posiciones = _mapear_columnas(next(filas, []))
+    hoja = google_sheets.abrir_hoja(url)
+    linea = 1
+    while True:
+        bloque = list(islice(filas, IMPORTACION_LOTE))
+        if not bloque:
+            break
+        productos = []
+        for fila in bloque:
+            linea += 1
+            if not any(str(valor).strip() for valor in fila):
+                continue
+            resultado["leidas"] += 1
+            prefijo, dato = _leer_producto(fila, posiciones)
+            if prefijo is None:
+                resultado["errores"].append((linea, dato))
+            else:
+                productos.append((prefijo, dato))
+        if productos:
+            _agregar_lote(url, hoja, productos)
+            resultado["importadas"] += len(productos)
+
+    resultado["segundos"] = time.perf_counter() - inicio
+    resultado["por_segundo"] = resultado["importadas"] / resultado["segundos"] if resultado["segundos"] else 0.0
+    logging.info(
+        f"📥 {resultado['importadas']} productos importados en {resultado['segundos']:.1f} s "
+        f"({resultado['por_segundo']:.0f} por segundo), {len(resultado['errores'])} filas con errores"
+    )
+    return resultado
+
+def texto_importacion(resultado):
+    """
+    Resumen de importar() para enviar por WhatsApp.
+    """
+    texto = (
+        f"📥 *Importación terminada*\n"
+        f"✅ Productos agregados: {resultado['importadas']} de {resultado['leidas']}\n"
+        f"⏱️ {resultado['segundos']:.1f} s ({resultado['por_segundo']:.0f} productos por segundo)"
+    )
+    errores = resultado["errores"]
+    if errores:
+        texto += f"\n\n⚠️ {len(errores)} filas no se importaron:\n"
+        texto += "\n".join(f"- Línea {linea}: {motivo}" for linea, motivo in errores[:IMPORTACION_MAX_ERRORES])
+        if len(errores) > IMPORTACION_MAX_ERRORES:
+            texto += f"\n… y {len(errores) - IMPORTACION_MAX_ERRORES} más."
+    return texto
+
+def es_importable(tipo):
+    """
+    Indica si un adjunto con este Content-Type se puede importar.
+    """
+    return tipo.split(";")[0].strip().lower() in TIPOS_CSV | {TIPO_XLSX}
+
+def firma_valida(url, parametros, firma):
+    """
+    Comprueba la cabecera X-Twilio-Signature de un POST al webhook: solo Twilio conoce
+    TWILIO_AUTH_TOKEN, así que un POST falsificado no pasa.
+    """
+    token = os.environ.get("TWILIO_AUTH_TOKEN", "")
+    return bool(token and firma) and RequestValidator(token).validate(url, parametros, firma)
+
+def es_adjunto_de_twilio(media_url):
+    """
+    Indica si el enlace del adjunto es de la API de Twilio, el único host al que se le
+    envían las credenciales de la cuenta.
+    """
+    partes = urlparse(media_url)
+    return partes.scheme == "https" and partes.hostname == "api.twilio.com"
+
+def _descargar(media_url, tipo):
+    # Los adjuntos de Twilio se descargan con las credenciales de la cuenta; requests no
+    # las reenvía si Twilio redirige a otro host
+    if not es_adjunto_de_twilio(media_url):
+        raise ValueError("el adjunto no viene de Twilio")
+    sufijo = ".xlsx" if tipo.startswith(TIPO_XLSX) else ".csv"
+    auth = (os.environ.get("TWILIO_ACCOUNT_SID", ""), os.environ.get("TWILIO_AUTH_TOKEN", ""))
+    with requests.get(media_url, auth=auth, stream=True, timeout=60) as respuesta:
+        respuesta.raise_for_status()
+        with tempfile.NamedTemporaryFile(suffix=sufijo, delete=False) as archivo:
+            for bloque in respuesta.iter_content(65536):
+                archivo.write(bloque)
+    return archivo.name
+
+def _importar_adjunto(phone_number, url, media_url, tipo):
+    ruta = None
+    try:
+        ruta = _descargar(media_url, tipo)
+        texto = texto_importacion(importar(url, leer_filas(ruta)))
+    except ValueError as e:
+        texto = f"❌ No se pudo importar el archivo: {e}\n\n{FORMATO_IMPORTACION}"
+    except Exception as e:
+        logging.error(f"❌ Error al importar el archivo de {phone_number}: {e}")
+        texto = "❌ Ocurrió un error al importar tu archivo. Los productos ya agregados se mantienen."
+    finally:
+        if ruta:
+            os.remove(ruta)
+    enviar_mensaje(phone_number, texto)
+
+def importar_adjunto(phone_number, url, media_url, tipo):
+    """
+    Importa en segundo plano el archivo adjunto de un mensaje de WhatsApp y le envía el
+    resumen al usuario cuando termina.
+    """
+    threading.Thread(target=_importar_adjunto, args=(phone_number, url, media_url, tipo), daemon=True).start()
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("Uso: python importador.py <url de la hoja> <archivo.csv|archivo.xlsx>")
+        sys.exit(1)
+    try:
+        print(texto_importacion(importar(sys.argv[1], leer_filas(sys.argv[2]))))
+    except ValueError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
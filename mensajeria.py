@@ -0,0 +1,49 @@
+import os
+import logging
+
+class MensajeroTwilio:
+    """
+    Envía mensajes de WhatsApp salientes con la API REST de Twilio.
+    """
+    def __init__(self, account_sid, auth_token, remitente):
+        from twilio.rest import Client
+        self.client = Client(account_sid, auth_token)
+        self.remitente = remitente if remitente.startswith("whatsapp:") else f"whatsapp:{remitente}"
+
+    def enviar(self, phone_number, texto, media_url=None):
+        kwargs = {"from_": self.remitente, "to": f"whatsapp:+{phone_number}", "body": texto}
+        if media_url:
+            kwargs["media_url"] = [media_url]
+        return self.client.messages.create(**kwargs)
+
+_mensajero = None
+
+def obtener_mensajero():
+    """
+    Devuelve el mensajero configurado; por defecto uno de Twilio creado con
+    TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN y TWILIO_WHATSAPP_FROM.
+    """
+    global _mensajero
+    if _mensajero is None:
+        _mensajero = MensajeroTwilio(
+            os.environ.get("TWILIO_ACCOUNT_SID", ""),
+            os.environ.get("TWILIO_AUTH_TOKEN", ""),
+            os.environ.get("TWILIO_WHATSAPP_FROM", "")
+        )
+    return _mensajero
+
+def configurar_mensajero(mensajero):
+    """
+    Reemplaza el mensajero saliente, p. ej. por uno falso en pruebas locales.
+    Basta con un objeto que tenga enviar(phone_number, texto, media_url=None).
+    """
+    global _mensajero
+    _mensajero = mensajero
+
+def enviar_mensaje(phone_number, texto, media_url=None):
+    try:
+        obtener_mensajero().enviar(phone_number, texto, media_url=media_url)
+        return True
+    except Exception as e:
+        logging.error(f"❌ Error al enviar mensaje a {phone_number}: {e}")
+        return False
@@ -0,0 +1,39 @@
+import threading
+
+# Métricas del proceso: contadores y tiempos acumulados por nombre.
+# La app las expone en /metricas.
+_contadores = {}
+_tiempos = {}  # nombre → [llamadas, segundos totales, máximo]
+_lock = threading.Lock()
+
+def incrementar(nombre, valor=1):
+    with _lock:
+        _contadores[nombre] = _contadores.get(nombre, 0) + valor
+
+def observar(nombre, segundos):
+    """
+    Registra la duración de una operación.
+    """
+    with _lock:
+        tiempo = _tiempos.setdefault(nombre, [0, 0.0, 0.0])
+        tiempo[0] += 1
+        tiempo[1] += segundos
+        tiempo[2] = max(tiempo[2], segundos)
+
+def instantanea():
+    """
+    Devuelve una copia de todas las métricas, con los tiempos en milisegundos.
+    """
+    with _lock:
+        return {
+            "contadores": dict(_contadores),
+            "tiempos": {
+                nombre: {
+                    "llamadas": llamadas,
+                    "promedio_ms": round(total / llamadas * 1000, 3) if llamadas else 0.0,
+                    "maximo_ms": round(maximo * 1000, 3),
+                    "total_ms": round(total * 1000, 3)
+                }
+                for nombre, (llamadas, total, maximo) in _tiempos.items()
+            }
+        }
@@ -0,0 +1,190 @@
+import os
+import time
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from datetime import datetime
+from functools import lru_cache
+from itertools import accumulate
+from operator import itemgetter
+import google_sheets
+
+# Historial de movimientos de cada cliente en memoria, en columnas ordenadas por fecha,
+# para responder reportes por periodo ("reporte 2026-09-01 2026-09-30") sin recorrer la hoja.
+# Los totales de un rango salen de dos búsquedas binarias y restas de sumas acumuladas.
+# Las filas nuevas del historial se agregan al vuelo en su lugar por fecha (p. ej. una entrada
+# con fecha de compra pasada); si cambia una fila existente, el historial se vuelve a cargar
+# en la siguiente consulta.
+MOVIMIENTOS_TTL = float(os.environ.get("MOVIMIENTOS_TTL", "300"))        # segundos antes de recargar desde la hoja
+MOVIMIENTOS_CACHE_MAX = int(os.environ.get("MOVIMIENTOS_CACHE_MAX", "64"))  # clientes en memoria como máximo
+
+HOJA_HISTORIAL = "Historial de movimientos"
+
+# Columnas con suma acumulada, en el orden de Movimientos._registro()
+_SUMADAS = ("entradas", "salidas", "ventas", "ganancias", "num_salidas")
+_ENTERAS = {"entradas", "salidas", "num_salidas"}
+
+def _dia(texto):
+    # "2026-09-01" o "2026-09-01 10:30:00" → ordinal de la fecha
+    return ordinal_de_fecha(texto.strip()[:10])
+
+@lru_cache(maxsize=4096)
+def ordinal_de_fecha(fecha):
+    # Las fechas se repiten mucho en el historial; strptime es lo más caro de la carga
+    try:
+        return datetime.strptime(fecha, "%Y-%m-%d").toordinal()
+    except ValueError:
+        return None
+
+class Movimientos:
+    """
+    Movimientos de un cliente: una fila por movimiento en arrays paralelos ordenados por
+    día, más la suma acumulada de cada columna de _SUMADAS.
+    """
+    def __init__(self, filas):
+        self.codigos = {}  # código → id de producto
+        self.nombres = []  # id de producto → nombre
+        self.cargado_en = time.monotonic()
+        registros = [r for r in map(self._registro, filas) if r]
+        registros.sort(key=itemgetter(0))
+        columnas = list(zip(*registros)) or [()] * (2 + len(_SUMADAS))
+        self.dias = array("l", columnas[0])
+        self.productos = array("l", columnas[1])
+        self.columnas = {
+            nombre: array("l" if nombre in _ENTERAS else "d", valores)
+            for nombre, valores in zip(_SUMADAS, columnas[2:])
+        }
+        self.acumulados = {
+            nombre: array("d", accumulate(valores, initial=0.0))
+            for nombre, valores in zip(_SUMADAS, columnas[2:])
+        }
+
+    def _registro(self, fila):
+        # → (día, id de producto, entradas, salidas, ventas, ganancias, num_salidas)
+        fila = list(fila) + [""] * (8 - len(fila))
+        fecha, codigo, nombre, tipo, cantidad, _, precio, costo = fila[:8]
+        dia = _dia(fecha)
+        try:
+            cantidad = int(cantidad)
+        except ValueError:
+            return None
+        if dia is None:
+            return None
+        producto = self.codigos.get(codigo)
+        if producto is None:
+            producto = self.codigos[codigo] = len(self.nombres)
+            self.nombres.append(nombre)
+        tipo = tipo.lower()
+        if tipo == "salida":
+            try:
+                precio = float(precio)
+                return dia, producto, 0, cantidad, precio * cantidad, (precio - float(costo)) * cantidad, 1
+            except ValueError:
+                return dia, producto, 0, cantidad, 0.0, 0.0, 1
+        if tipo == "entrada":
+            return dia, producto, cantidad, 0, 0.0, 0.0, 0
+        return dia, producto, 0, 0, 0.0, 0.0, 0
+
+    def agregar(self, fila):
+        """
+        Agrega una fila nueva del historial en su posición por fecha, después de las del
+        mismo día. Si no es la última, se rehacen las sumas acumuladas desde ahí.
+        """
+        registro = self._registro(fila)
+        if registro is None:
+            return
+        i = bisect_right(self.dias, registro[0])
+        self.dias.insert(i, registro[0])
+        self.productos.insert(i, registro[1])
+        for nombre, valor in zip(_SUMADAS, registro[2:]):
+            columna = self.columnas[nombre]
+            columna.insert(i, valor)
+            acumulado = self.acumulados[nombre]
+            if i == len(columna) - 1:
+                acumulado.append(acumulado[-1] + valor)
+            else:
+                acumulado[i + 1:] = array("d", accumulate(columna[i:], initial=acumulado[i]))[1:]
+
+    def resumen(self, desde, hasta, cuantos=3):
+        """
+        Totales de los movimientos entre los días `desde` y `hasta` (ordinales, inclusive),
+        con los `cuantos` productos más vendidos.
+        """
+        i = bisect_left(self.dias, desde)
+        j = bisect_right(self.dias, hasta)
+        totales = {nombre: self.acumulados[nombre][j] - self.acumulados[nombre][i] for nombre in _SUMADAS}
+
+        por_producto = {}
+        por_dia = {}
+        for dia, producto, salidas in zip(self.dias[i:j], self.productos[i:j], self.columnas["salidas"][i:j]):
+            if salidas:
+                por_producto[producto] = por_producto.get(producto, 0) + salidas
+                por_dia[dia] = por_dia.get(dia, 0) + salidas
+        mas_vendidos = sorted(por_producto.items(), key=lambda x: x[1], reverse=True)[:cuantos]
+        codigos = {id_: codigo for codigo, id_ in self.codigos.items()}
+        mejor_dia = max(por_dia.items(), key=lambda x: x[1]) if por_dia else None
+        return {
+            "movimientos": j - i,
+            "salidas": int(totales["num_salidas"]),
+            "unidades_vendidas": int(totales["salidas"]),
+            "unidades_ingresadas": int(totales["entradas"]),
+            "ventas": totales["ventas"],
+            "ganancias": totales["ganancias"],
+            "mas_vendidos": [(self.nombres[p], codigos[p], u) for p, u in mas_vendidos],
+            "mejor_dia": (datetime.fromordinal(mejor_dia[0]).date(), mejor_dia[1]) if mejor_dia else None
+        }
+
+_cache = OrderedDict()  # url → Movimientos
+_versiones = {}         # url → cambios vistos en el historial, para no guardar una carga desactualizada
+_lock = threading.Lock()
+
+def obtener(url):
+    """
+    Devuelve los Movimientos del cliente, cargándolos de su hoja de historial si no
+    están en memoria o tienen más de MOVIMIENTOS_TTL segundos.
+    """
+    with _lock:
+        movimientos = _cache.get(url)
+        if movimientos is not None and time.monotonic() - movimientos.cargado_en <= MOVIMIENTOS_TTL:
+            _cache.move_to_end(url)
+            return movimientos
+        version = _versiones.get(url, 0)
+    movimientos = Movimientos(google_sheets.abrir_hoja(url, HOJA_HISTORIAL).get_all_values()[1:])
+    with _lock:
+        if _versiones.get(url, 0) != version:
+            return movimientos  # el historial cambió mientras se leía; se usa esta vez sin guardarla
+        _cache[url] = movimientos
+        _cache.move_to_end(url)
+        while len(_cache) > MOVIMIENTOS_CACHE_MAX:
+            _cache.popitem(last=False)
+    return movimientos
+
+def reporte_periodo(url, desde, hasta, cuantos=3):
+    """
+    Totales del cliente entre las fechas `desde` y `hasta` (date, inclusive).
+    """
+    movimientos = obtener(url)
+    with _lock:
+        return movimientos.resumen(desde.toordinal(), hasta.toordinal(), cuantos)
+
+def version(url):
+    """
+    Número que cambia cada vez que el bot modifica el historial del cliente.
+    """
+    with _lock:
+        return _versiones.get(url, 0)
+
+def _al_cambiar_historial(url, cambios):
+    with _lock:
+        _versiones[url] = _versiones.get(url, 0) + 1
+        movimientos = _cache.get(url)
+        if movimientos is None:
+            return
+        if cambios is None or any(anterior is not None for anterior, _ in cambios):
+            del _cache[url]
+            return
+        for _, nueva in cambios:
+            movimientos.agregar(nueva)
+
+google_sheets.observar_hoja(HOJA_HISTORIAL, _al_cambiar_historial)
@@ -0,0 +1,94 @@
+import os
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+import alertas
+import metricas
+from google_sheets import listar_clientes
+from mensajeria import enviar_mensaje
+
+# Envío programado de alertas (stock mínimo y vencimientos) a todos los clientes del
+# directorio, sin cron externo: un hilo del proceso despierta a cada hora de
+# ALERTAS_HORARIO (p. ej. "08:00,18:00") y revisa los clientes con un grupo de
+# ALERTAS_WORKERS hilos. Cada libro se revisa una sola vez por ronda aunque tenga varios
+# números, y cada número recibe un solo resumen, solo si hay algo que avisar.
+# Activar en un solo proceso (ALERTAS_PROGRAMADAS=1) para no enviar resúmenes repetidos.
+ALERTAS_PROGRAMADAS = os.environ.get("ALERTAS_PROGRAMADAS", "0") == "1"
+ALERTAS_HORARIO = os.environ.get("ALERTAS_HORARIO", "08:00")
+ALERTAS_WORKERS = int(os.environ.get("ALERTAS_WORKERS", "4"))
+
+_hilo = None
+_lock = threading.Lock()
+
+def _leer_horario(texto):
+    # "08:00,18:30" → [(8, 0), (18, 30)]
+    horario = []
+    for parte in texto.split(","):
+        hora, _, minuto = parte.strip().partition(":")
+        horario.append((int(hora), int(minuto or 0)))
+    return sorted(horario)
+
+def proxima_ejecucion(ahora, horario):
+    """
+    Devuelve el próximo momento del horario [(hora, minuto)] posterior a `ahora`.
+    """
+    hoy = [ahora.replace(hour=h, minute=m, second=0, microsecond=0) for h, m in horario]
+    futuros = [momento for momento in hoy if momento > ahora]
+    return futuros[0] if futuros else hoy[0] + timedelta(days=1)
+
+def _revisar_cliente(url, numeros):
+    datos = alertas.alertas_de(url)
+    if not (datos["stock_bajo"] or datos["por_vencer"] or datos["vencidos"]):
+        return 0
+    texto = "🔔 *Alertas de tu inventario*\n\n" + alertas.texto_alertas(datos)
+    texto += "\n\n📲 Escribe *5* para revisarlas o *menu* para ver las opciones."
+    return sum(1 for numero in numeros if enviar_mensaje(numero, texto))
+
+def enviar_alertas():
+    """
+    Revisa las alertas de todos los clientes y envía un resumen a cada número con alertas.
+    Devuelve cuántos resúmenes se enviaron.
+    """
+    inicio = time.perf_counter()
+    numeros_por_libro = {}
+    for numero, cliente in listar_clientes():
+        if cliente["url"]:
+            numeros_por_libro.setdefault(cliente["url"], []).append(numero)
+
+    enviados = 0
+    with ThreadPoolExecutor(max_workers=ALERTAS_WORKERS) as grupo:
+        futuros = {grupo.submit(_revisar_cliente, url, numeros): url for url, numeros in numeros_por_libro.items()}
+        for futuro, url in futuros.items():
+            try:
+                enviados += futuro.result()
+            except Exception as e:
+                metricas.incrementar("alertas.errores")
+                logging.error(f"❌ Error al revisar alertas de {url}: {e}")
+    metricas.incrementar("alertas.enviadas", enviados)
+    metricas.observar("alertas.ronda", time.perf_counter() - inicio)
+    logging.info(f"🔔 Alertas revisadas en {len(numeros_por_libro)} libros, {enviados} resúmenes enviados")
+    return enviados
+
+def _ejecutar_periodicamente(horario):
+    while True:
+        espera = (proxima_ejecucion(datetime.now(), horario) - datetime.now()).total_seconds()
+        time.sleep(max(espera, 0))
+        try:
+            enviar_alertas()
+        except Exception as e:
+            logging.error(f"❌ Error en el envío programado de alertas: {e}")
+        time.sleep(1)  # que la siguiente espera no vuelva a caer en el mismo momento programado
+
+def iniciar(horario=None):
+    """
+    Arranca el hilo del envío programado de alertas (una sola vez por proceso).
+    """
+    global _hilo
+    with _lock:
+        if _hilo is None:
+            _hilo = threading.Thread(
+                target=_ejecutar_periodicamente, args=(_leer_horario(horario or ALERTAS_HORARIO),), daemon=True
+            )
+            _hilo.start()
@@ -0,0 +1,241 @@
+import os
+import glob
+import logging
+import multiprocessing
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.lib.units import cm
+from reportlab.platypus import Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle
+import alertas
+import google_sheets
+import metricas
+import movimientos
+from mensajeria import enviar_mensaje
+
+# Reporte en PDF (valorización del stock, más vendidos del periodo, lotes por vencer y
+# pérdidas por vencimiento), enviado por WhatsApp como enlace a /reportes/<archivo>.
+# Los datos se reúnen en un hilo aparte y el PDF se dibuja en un grupo de procesos, así
+# el webhook nunca espera a reportlab. Cada PDF se reutiliza para el mismo cliente y
+# periodo hasta que el bot registra un movimiento nuevo o cambia el día.
+#
+# El grupo se crea con el primer reporte y sus procesos parten de forkserver (o spawn),
+# no de un fork del bot con sus hilos ya corriendo.
+REPORTES_DIR = os.environ.get("REPORTES_DIR", "reportes")
+REPORTES_MAX = int(os.environ.get("REPORTES_MAX", "200"))        # PDFs guardados como máximo
+REPORTES_MAX_EDAD = int(os.environ.get("REPORTES_MAX_EDAD", str(2 * 24 * 3600)))  # segundos
+REPORTES_WORKERS = int(os.environ.get("REPORTES_WORKERS", "2"))
+# Dirección pública de la app para armar el enlace (Render define RENDER_EXTERNAL_URL)
+URL_PUBLICA = (os.environ.get("URL_PUBLICA") or os.environ.get("RENDER_EXTERNAL_URL", "")).rstrip("/")
+TOP_VENDIDOS = 10
+
+HOJA_LOTES = "Lotes"
+
+_grupo = None
+_cache = OrderedDict()  # (url, desde, hasta) → (versión del historial, día, archivo)
+_en_curso = {}          # (url, desde, hasta) → números que esperan ese PDF
+_lock = threading.Lock()
+
+def _numero(texto, tipo=float):
+    try:
+        return tipo(texto)
+    except (TypeError, ValueError):
+        return tipo()
+
+def datos_reporte(url, desde, hasta, hoy=None):
+    """
+    Reúne los datos del PDF como tipos simples (se envían a otro proceso para dibujarlo).
+    """
+    hoy = hoy or date.today()
+    productos = {}  # código → [nombre, marca, precio, stock, costo del stock]
+    for fila in google_sheets.abrir_hoja(url).get_all_values()[1:]:
+        fila = list(fila) + [""] * (4 - len(fila))
+        productos[fila[0]] = [fila[1], fila[2], _numero(fila[3]), 0, 0.0]
+
+    perdidas = []
+    for lote in google_sheets.abrir_hoja(url, HOJA_LOTES).get_all_values()[1:]:
+        lote = list(lote) + [""] * (8 - len(lote))
+        disponible, costo = _numero(lote[7], int), _numero(lote[5])
+        if disponible <= 0:
+            continue
+        if lote[0] in productos:
+            productos[lote[0]][3] += disponible
+            productos[lote[0]][4] += disponible * costo
+        vence = movimientos.ordinal_de_fecha(lote[4].strip())
+        if vence is not None and vence < hoy.toordinal():
+            perdidas.append((lote[1], lote[2], lote[4].strip(), disponible, disponible * costo))
+
+    stock = [
+        (codigo, nombre, marca, unidades, costo, unidades * precio)
+        for codigo, (nombre, marca, precio, unidades, costo) in sorted(productos.items())
+        if unidades
+    ]
+    return {
+        "desde": desde.isoformat(),
+        "hasta": hasta.isoformat(),
+        "generado": datetime.now().strftime("%Y-%m-%d %H:%M"),
+        "stock": stock,
+        "ventas": movimientos.reporte_periodo(url, desde, hasta, TOP_VENDIDOS),
+        "por_vencer": alertas.alertas_de(url, hoy)["por_vencer"],
+        "perdidas": perdidas,
+    }
+
+def _tabla(encabezado, filas, anchos):
+    tabla = Table([encabezado] + filas, colWidths=[a * cm for a in anchos], repeatRows=1)
+    tabla.setStyle(TableStyle([
+        ("BACKGROUND", (0, 0), (-1, 0), colors.HexColor("#2f5597")),
+        ("TEXTCOLOR", (0, 0), (-1, 0), colors.white),
+        ("FONTNAME", (0, 0), (-1, 0), "Helvetica-Bold"),
+        ("FONTSIZE", (0, 0), (-1, -1), 8),
+        ("ROWBACKGROUNDS", (0, 1), (-1, -1), [colors.white, colors.HexColor("#eef2f8")]),
+        ("GRID", (0, 0), (-1, -1), 0.25, colors.grey),
+    ]))
+    return tabla
+
+def dibujar_pdf(datos, ruta):
+    """
+    Dibuja el PDF con los datos de datos_reporte(); corre en el grupo de procesos.
+    """
+    estilos = getSampleStyleSheet()
+    ventas = datos["ventas"]
+    partes = [
+        Paragraph("Reporte de inventario y ventas", estilos["Title"]),
+        Paragraph(f"Periodo: {datos['desde']} al {datos['hasta']} - generado el {datos['generado']}", estilos["Normal"]),
+        Spacer(1, 0.5 * cm),
+        Paragraph("Ventas del periodo", estilos["Heading2"]),
+        _tabla(["Unidades vendidas", "Salidas", "Unidades ingresadas", "Ventas (S/)", "Ganancias (S/)"], [[
+            ventas["unidades_vendidas"], ventas["salidas"], ventas["unidades_ingresadas"],
+            f"{ventas['ventas']:.2f}", f"{ventas['ganancias']:.2f}"
+        ]], [3.4, 2.4, 3.6, 3.2, 3.4]),
+    ]
+    if ventas["mas_vendidos"]:
+        partes += [
+            Paragraph("Más vendidos", estilos["Heading2"]),
+            _tabla(["#", "Producto", "Código", "Unidades"], [
+                [i, nombre, codigo, unidades] for i, (nombre, codigo, unidades) in enumerate(ventas["mas_vendidos"], 1)
+            ], [1, 9, 3, 3]),
+        ]
+
+    total_costo = sum(fila[4] for fila in datos["stock"])
+    total_venta = sum(fila[5] for fila in datos["stock"])
+    partes += [
+        Paragraph("Valorización del stock", estilos["Heading2"]),
+        Paragraph(f"Al costo: S/ {total_costo:.2f} - a precio de venta: S/ {total_venta:.2f}", estilos["Normal"]),
+        Spacer(1, 0.2 * cm),
+        _tabla(["Código", "Producto", "Marca", "Stock", "Costo (S/)", "Venta (S/)"], [
+            [codigo, nombre, marca, unidades, f"{costo:.2f}", f"{venta:.2f}"]
+            for codigo, nombre, marca, unidades, costo, venta in datos["stock"]
+        ], [2, 5.4, 2.8, 1.4, 2.2, 2.2]),
+        Paragraph(f"Lotes por vencer (en {alertas.DIAS_ALERTA_VENCIMIENTO} días o menos)", estilos["Heading2"]),
+    ]
+    if datos["por_vencer"]:
+        partes.append(_tabla(["Producto", "Marca", "Lote", "Vence"], [list(lote) for lote in datos["por_vencer"]], [7, 4, 2, 3]))
+    else:
+        partes.append(Paragraph("No hay lotes por vencer.", estilos["Normal"]))
+
+    partes.append(Paragraph("Pérdidas por vencimiento", estilos["Heading2"]))
+    if datos["perdidas"]:
+        partes += [
+            Paragraph(f"Total: S/ {sum(p[4] for p in datos['perdidas']):.2f}", estilos["Normal"]),
+            Spacer(1, 0.2 * cm),
+            _tabla(["Producto", "Lote", "Venció", "Unidades", "Pérdida (S/)"], [
+                [nombre, lote, vence, unidades, f"{monto:.2f}"] for nombre, lote, vence, unidades, monto in datos["perdidas"]
+            ], [6, 2, 3, 2, 3]),
+        ]
+    else:
+        partes.append(Paragraph("No hay lotes vencidos con unidades.", estilos["Normal"]))
+
+    SimpleDocTemplate(ruta, pagesize=A4, title="Reporte de inventario").build(partes)
+    return ruta
+
+def limpiar():
+    """
+    Borra los PDFs con más de REPORTES_MAX_EDAD segundos. Solo se borran por edad: otro
+    proceso del bot puede haber enviado hace poco el enlace de un PDF del directorio.
+    """
+    limite = time.time() - REPORTES_MAX_EDAD
+    for ruta in glob.glob(os.path.join(REPORTES_DIR, "*.pdf")):
+        try:
+            if os.path.getmtime(ruta) < limite:
+                os.remove(ruta)
+        except OSError:
+            pass  # otro proceso lo borró primero
+
+def _obtener_grupo():
+    global _grupo
+    with _lock:
+        if _grupo is None:
+            os.makedirs(REPORTES_DIR, exist_ok=True)
+            limpiar()
+            metodo = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+            _grupo = ProcessPoolExecutor(max_workers=REPORTES_WORKERS, mp_context=multiprocessing.get_context(metodo))
+        return _grupo
+
+def enlace(archivo):
+    return f"{URL_PUBLICA}/reportes/{archivo}"
+
+def pdf_en_cache(url, desde, hasta):
+    """
+    Devuelve el enlace del PDF ya generado para ese cliente y periodo si sigue vigente.
+    """
+    clave = (url, desde, hasta)
+    with _lock:
+        item = _cache.get(clave)
+        if item and item[:2] == (movimientos.version(url), date.today()):
+            _cache.move_to_end(clave)
+            return enlace(item[2])
+    return None
+
+def _guardar(clave, version, hoy, archivo):
+    with _lock:
+        anterior = _cache.pop(clave, None)
+        _cache[clave] = (version, hoy, archivo)
+        descartados = [anterior] if anterior else []
+        while len(_cache) > REPORTES_MAX:
+            descartados.append(_cache.popitem(last=False)[1])
+    for _, _, viejo in descartados:
+        try:
+            os.remove(os.path.join(REPORTES_DIR, viejo))
+        except OSError:
+            pass
+
+def _generar(clave):
+    url, desde, hasta = clave
+    inicio = time.perf_counter()
+    try:
+        version, hoy = movimientos.version(url), date.today()
+        datos = datos_reporte(url, desde, hasta, hoy)
+        archivo = f"{secrets.token_urlsafe(16)}.pdf"  # nombre imposible de adivinar
+        _obtener_grupo().submit(dibujar_pdf, datos, os.path.join(REPORTES_DIR, archivo)).result()
+        _guardar(clave, version, hoy, archivo)
+        metricas.observar("reportes.pdf", time.perf_counter() - inicio)
+        texto, media_url = f"📄 Tu reporte del {desde} al {hasta}.", enlace(archivo)
+    except Exception as e:
+        metricas.incrementar("reportes.errores")
+        logging.error(f"❌ Error al generar el reporte PDF de {url}: {e}")
+        texto, media_url = "❌ Ocurrió un error al generar tu reporte PDF. Intenta nuevamente.", None
+    with _lock:
+        numeros = _en_curso.pop(clave, [])
+    for numero in numeros:
+        enviar_mensaje(numero, texto, media_url=media_url)
+
+def solicitar(phone_number, url, desde, hasta):
+    """
+    Genera en segundo plano el PDF del periodo y se lo envía al número cuando está
+    listo. Si el mismo PDF ya se está generando, el número se suma a quienes lo esperan.
+    """
+    clave = (url, desde, hasta)
+    with _lock:
+        esperando = _en_curso.get(clave)
+        if esperando is not None:
+            if phone_number not in esperando:
+                esperando.append(phone_number)
+            return
+        _en_curso[clave] = [phone_number]
+    threading.Thread(target=_generar, args=(clave,), daemon=True).start()